@@ -0,0 +1,427 @@
+import dbm
+import json
+import os
+import threading
+import time
+
+import profiler
+from file_lock import VersionLock
+from movie import Movie
+
+# OMDB API to get movie data
+OMDB_URL: str = os.environ.get('MOVIE_APP_OMDB_URL',
+                               'http://www.omdbapi.com/')
+OMDB_API_KEY: str = os.environ.get('MOVIE_APP_OMDB_KEY', '6f0c3bf6')
+# Connect and read timeouts in seconds for every API call
+TIMEOUT: tuple = (3.05, 10)
+# Directory where API responses are cached between runs
+CACHE_DIR: str = os.environ.get('MOVIE_APP_CACHE_DIR', '.movie_cache')
+# Cached OMDB responses are reused for a week before being fetched again
+OMDB_CACHE_TTL: float = 7 * 24 * 60 * 60
+# Starts the cache records that point to the record of another key
+ALIAS_MARK: bytes = b'@'
+# Size of the connection pool kept open by the shared session
+POOL_SIZE: int = 16
+# Number of parallel API calls made by bulk lookups
+MAX_WORKERS: int = 8
+# Maximum number of API calls per second made by bulk lookups
+RATE_LIMIT: float = 10.0
+
+
+class FetchError(Exception):
+    """Raised when an API call fails."""
+
+
+class HTTPFetchError(FetchError):
+    """Raised when the API answers with an HTTP error status."""
+
+
+class FetchConnectionError(FetchError):
+    """Raised when the API can't be reached."""
+
+
+class FetchTimeout(FetchError):
+    """Raised when the API doesn't answer in time."""
+
+
+def normalize_title(title):
+    """
+    Returns the cache key form of a movie title: case folded with
+    surrounding and repeated whitespace removed.
+    """
+    return ' '.join(title.casefold().split())
+
+
+def movie_from_omdb(movie_dict_data):
+    """
+    Builds a movie record for the database from an OMDB API response.
+
+    Raises:
+        KeyError: If the response doesn't describe a movie.
+    """
+    return Movie(title=movie_dict_data['Title'],
+                 rating=float(movie_dict_data['imdbRating']),
+                 year=int(movie_dict_data['Year']),
+                 poster=movie_dict_data['Poster'],
+                 imdbID=movie_dict_data['imdbID'], note='',
+                 country=movie_dict_data['Country'])
+
+
+def create_session(pool_size=POOL_SIZE):
+    """
+    Creates a requests session that keeps up to `pool_size` connections
+    alive per host.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_json(session, url, params=None, timeout=TIMEOUT):
+    """
+    Sends a GET request and returns the decoded JSON body.
+
+    Raises:
+        HTTPFetchError: If the API answers with an error status.
+        FetchConnectionError: If the API can't be reached.
+        FetchTimeout: If the API doesn't answer in time.
+        FetchError: For any other failure, including invalid JSON.
+    """
+    import requests
+
+    profiler.count('http calls')
+    try:
+        with profiler.phase('http'):
+            response = session.get(url, params=params, timeout=timeout)
+        profiler.count('bytes downloaded', len(response.content))
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.HTTPError as errh:
+        raise HTTPFetchError(errh) from errh
+    except requests.exceptions.ConnectionError as errc:
+        raise FetchConnectionError(errc) from errc
+    except requests.exceptions.Timeout as errt:
+        raise FetchTimeout(errt) from errt
+    except (requests.exceptions.RequestException, ValueError) as err:
+        raise FetchError(err) from err
+
+
+def get_bytes(session, url, timeout=TIMEOUT):
+    """
+    Sends a GET request and returns the raw body, for example an image.
+
+    Raises:
+        HTTPFetchError: If the server answers with an error status.
+        FetchConnectionError: If the server can't be reached.
+        FetchTimeout: If the server doesn't answer in time.
+        FetchError: For any other failure.
+    """
+    import requests
+
+    profiler.count('http calls')
+    try:
+        with profiler.phase('http'):
+            response = session.get(url, timeout=timeout)
+        profiler.count('bytes downloaded', len(response.content))
+        response.raise_for_status()
+        return response.content
+    except requests.exceptions.HTTPError as errh:
+        raise HTTPFetchError(errh) from errh
+    except requests.exceptions.ConnectionError as errc:
+        raise FetchConnectionError(errc) from errc
+    except requests.exceptions.Timeout as errt:
+        raise FetchTimeout(errt) from errt
+    except requests.exceptions.RequestException as err:
+        raise FetchError(err) from err
+
+
+class RateLimiter:
+    """
+    Spaces out calls made from several threads so that no more than
+    `rate` calls start per second.
+    """
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate else 0.0
+        self._next_call = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until the caller is allowed to make its next call.
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_call)
+            self._next_call = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class ResponseCache:
+    """
+    A dbm database on disk that maps keys to API responses.
+
+    Every response is stored once, under the first of its keys; the other
+    keys are aliases that point to it. Entries older than `ttl` seconds are
+    treated as missing. New entries are kept in memory until `save`, which
+    writes only them, so saving never rewrites the whole cache.
+
+    Several processes can share the cache: a lock file next to the
+    database keeps reads and writes from overlapping, and a process that
+    saves only replaces the entries it stored.
+    """
+
+    def __init__(self, path, ttl=None):
+        """
+        Args:
+            path (str): The path of the cache database.
+            ttl (float): Seconds an entry stays valid, or None to keep
+            entries forever.
+        """
+        self.path = path
+        self.ttl = ttl
+        self._pending = {}  # key -> encoded record, not saved yet
+        self._lock = threading.Lock()
+        self._file_lock = VersionLock(f'{path}.lock')
+
+    def _records(self, keys, db):
+        """
+        Returns the records of the keys, with aliases followed, reading
+        the ones that weren't stored since the last save from `db`.
+        """
+        def read(key):
+            record = self._pending.get(key)
+            if record is None and db is not None:
+                record = db.get(key)
+            return record
+
+        records = {}
+        for key in keys:
+            record = read(key)
+            if record is not None and record.startswith(ALIAS_MARK):
+                record = read(record[len(ALIAS_MARK):].decode('utf-8'))
+            if record is not None:
+                records[key] = record
+        return records
+
+    def get_many(self, keys):
+        """
+        Returns a dictionary with the cached value of every key that has
+        one that hasn't expired. The database is opened once for all of
+        them.
+        """
+        keys = list(keys)
+        with self._lock:
+            records = self._records(keys, None)
+            # The lock file is written by the first save
+            if len(records) < len(keys) and \
+                    os.path.exists(self._file_lock.path):
+                with self._file_lock.locked(shared=True):
+                    try:
+                        db = dbm.open(self.path, 'r')
+                    except dbm.error:
+                        db = None
+                    try:
+                        records = self._records(keys, db)
+                    finally:
+                        if db is not None:
+                            db.close()
+        values = {}
+        now = time.time()
+        for key, record in records.items():
+            entry = json.loads(record)
+            if self.ttl is None or now - entry['time'] <= self.ttl:
+                values[key] = entry['value']
+        profiler.count('response cache hits', len(values))
+        profiler.count('response cache misses', len(keys) - len(values))
+        return values
+
+    def get(self, key):
+        """
+        Returns the cached value for the key, or None if it is missing or
+        has expired.
+        """
+        return self.get_many([key]).get(key)
+
+    def put(self, keys, value, save=True):
+        """
+        Stores the value under the first key in `keys`, makes the other
+        keys point to it and, unless `save` is False, writes the new
+        entries to the database.
+        """
+        keys = list(dict.fromkeys(keys))
+        entry = json.dumps({'time': time.time(), 'value': value})
+        alias = ALIAS_MARK + keys[0].encode('utf-8')
+        with self._lock:
+            self._pending[keys[0]] = entry.encode('utf-8')
+            for key in keys[1:]:
+                self._pending[key] = alias
+        if save:
+            self.save()
+
+    def save(self):
+        """
+        Writes the entries stored since the last save to the database.
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._file_lock.locked():
+                with dbm.open(self.path, 'c') as db:
+                    for key, record in self._pending.items():
+                        db[key] = record
+            self._pending.clear()
+
+
+class OmdbClient:
+    """
+    Fetches movie data from the OMDB API.
+
+    All calls share one keep-alive session, and successful responses are
+    cached on disk by normalized title and by imdbID, so a movie that was
+    already fetched is served without touching the network.
+    """
+
+    def __init__(self, base_url=OMDB_URL, api_key=OMDB_API_KEY,
+                 timeout=TIMEOUT, cache=None):
+        """
+        Args:
+            base_url (str): The API address, for example a local stand-in
+            server when testing.
+            api_key (str): The OMDB API key.
+            timeout (tuple): Connect and read timeouts in seconds.
+            cache (ResponseCache): The response cache, by default `omdb`
+            in CACHE_DIR.
+        """
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        if cache is None:
+            cache = ResponseCache(os.path.join(CACHE_DIR, 'omdb'),
+                                  ttl=OMDB_CACHE_TTL)
+        self.cache = cache
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The shared session, created on first use."""
+        with self._session_lock:
+            if self._session is None:
+                self._session = create_session()
+            return self._session
+
+    def fetch_movie(self, title=None, imdb_id=None, refresh=False,
+                    save=True):
+        """
+        Returns the OMDB data of a movie looked up by title or imdbID.
+
+        Args:
+            title (str): The movie title.
+            imdb_id (str): The imdbID, used instead of the title if given.
+            refresh (bool): Skip the cache and always call the API.
+            save (bool): Write the cache file after a successful call.
+
+        Returns:
+            dict: The API response. Unknown movies return OMDB's error
+            response, which is not cached.
+
+        Raises:
+            FetchError: If the API call fails.
+        """
+        if imdb_id is not None:
+            key = f'id:{imdb_id}'
+            params = {'apikey': self.api_key, 'i': imdb_id}
+        else:
+            key = f'title:{normalize_title(title)}'
+            params = {'apikey': self.api_key, 't': title}
+
+        if not refresh:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        movie_dict_data = get_json(self.session, self.base_url, params,
+                                   self.timeout)
+        if movie_dict_data.get('Response') != 'False':
+            # Stored under the imdbID, with the titles pointing to it
+            keys = [f'id:{movie_dict_data["imdbID"]}', key,
+                    f'title:{normalize_title(movie_dict_data["Title"])}']
+            self.cache.put(keys, movie_dict_data, save=save)
+        return movie_dict_data
+
+    def fetch_movies(self, titles, max_workers=MAX_WORKERS,
+                     rate_limit=RATE_LIMIT):
+        """
+        Looks up many titles at once.
+
+        Titles already in the cache are answered straight away. The others
+        are fetched in parallel by up to `max_workers` threads, starting at
+        most `rate_limit` calls per second, and the cache file is written
+        once at the end.
+
+        Args:
+            titles (list): The movie titles to look up.
+            max_workers (int): The number of parallel API calls.
+            rate_limit (float): Maximum calls per second, or None for no
+            limit.
+
+        Returns:
+            dict: Maps each title to its API response, or to the FetchError
+            raised while fetching it.
+        """
+        results = {}
+        missing = {}
+        cached_titles = self.cache.get_many(
+            {f'title:{normalize_title(title)}' for title in titles})
+        for title in titles:
+            cached = cached_titles.get(f'title:{normalize_title(title)}')
+            if cached is not None:
+                results[title] = cached
+            else:
+                # Titles that only differ in case or spacing are fetched once
+                missing.setdefault(normalize_title(title), []).append(title)
+        if not missing:
+            return results
+
+        limiter = RateLimiter(rate_limit)
+
+        def fetch(title):
+            limiter.wait()
+            try:
+                return self.fetch_movie(title, refresh=True, save=False)
+            except FetchError as err:
+                return err
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            requested = [same_titles[0] for same_titles in missing.values()]
+            fetched = executor.map(profiler.bind(fetch), requested)
+            for same_titles, result in zip(missing.values(), fetched):
+                for title in same_titles:
+                    results[title] = result
+        self.cache.save()
+        return results
+
+
+_default_client = None
+
+
+def get_client():
+    """
+    Returns the OMDB client shared by the storages.
+    """
+    global _default_client
+    if _default_client is None:
+        _default_client = OmdbClient()
+    return _default_client
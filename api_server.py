@@ -0,0 +1,374 @@
+import asyncio
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# Address the server listens on by default
+HOST: str = '127.0.0.1'
+PORT: int = 8000
+# Largest request body accepted, in bytes
+MAX_BODY: int = 1024 * 1024
+# Number of GET answers kept in memory; the least recently used go first
+CACHE_SIZE: int = 128
+# The resources answered to GET requests
+READ_PATHS: tuple = ('/movies', '/search', '/stats', '/sorted', '/histogram')
+REASONS: dict = {200: 'OK', 201: 'Created', 207: 'Multi-Status',
+                 400: 'Bad Request', 404: 'Not Found',
+                 405: 'Method Not Allowed', 413: 'Payload Too Large',
+                 422: 'Unprocessable Entity', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    """Raised by a request handler to answer with an error status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def movie_to_json(movie):
+    """
+    Returns a movie record as a dictionary that can be encoded as JSON.
+    """
+    return movie.to_dict() if hasattr(movie, 'to_dict') else dict(movie)
+
+
+def positive_int(query, name, default=None):
+    """
+    Returns a query parameter that must be a whole number above zero.
+    """
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        value = int(values[0])
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise HTTPError(400, f'{name} must be a positive number')
+    return value
+
+
+def number(query, name, number_type):
+    """
+    Returns a query parameter that must be a number of the given type, or
+    None if it isn't given.
+    """
+    values = query.get(name)
+    if not values:
+        return None
+    try:
+        return number_type(values[0])
+    except ValueError:
+        raise HTTPError(400, f'{name} must be a number') from None
+
+
+class LibraryServer:
+    """
+    A small HTTP server that serves a movie library as JSON.
+
+    Endpoints:
+        GET    /movies               all the movies; with min_rating=,
+                                     max_rating=, year_from=, year_to=
+                                     or country=, the movies that match
+        GET    /search?q=...         titles containing the text; with
+                                     fuzzy=1, the closest titles and scores
+        GET    /stats                the rating statistics
+        GET    /sorted?limit=&page=  the movies by rating, one page
+        GET    /histogram?bins=      the number of movies per rating bucket
+        POST   /movies               {"title": ...} or {"titles": [...]}
+        PATCH  /movies/<title>       {"note": ...}
+        DELETE /movies/<title>
+
+    The storage is only ever used from one worker thread, which makes it
+    the single writer and lets SQLite connections work. The storage keeps
+    the library in memory, so reads don't load the file again, and the
+    encoded answers of the most recent GET requests are kept, so
+    concurrent readers of the same resource are answered from memory
+    without waiting for the worker. Identical reads that arrive together
+    share one trip to the worker.
+
+    The answers are dropped after every write through the server, and
+    whenever the storage's version shows that another program, such as
+    the command line or a refresh, changed the library.
+    """
+
+    def __init__(self, storage_factory, host=HOST, port=PORT):
+        """
+        Args:
+            storage_factory (callable): Returns the IStorage to serve. It is
+            called on the worker thread.
+            host (str): The address to listen on.
+            port (int): The port to listen on, or 0 for any free port.
+        """
+        self.host = host
+        self.port = port
+        self._storage_factory = storage_factory
+        self._storage = None
+        self._worker = ThreadPoolExecutor(max_workers=1)
+        # (path, sorted query) -> future of the encoded answer
+        self._responses = OrderedDict()
+        self._version = None
+        self._server = None
+
+    async def _call(self, function, *args):
+        """
+        Runs a function of the storage on the worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._worker, lambda: function(self._storage, *args))
+
+    async def start(self):
+        """
+        Opens the storage and starts listening.
+        """
+        loop = asyncio.get_running_loop()
+        self._storage = await loop.run_in_executor(self._worker,
+                                                   self._storage_factory)
+        self._server = await asyncio.start_server(self._handle_connection,
+                                                  self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """
+        Starts the server and answers requests until it is cancelled.
+        """
+        await self.start()
+        print(f'Serving the movie library on http://{self.host}:{self.port}/')
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            self._worker.shutdown()
+
+    async def close(self):
+        """
+        Stops listening and waits for the worker to finish.
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        self._worker.shutdown()
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Answers the requests of one connection, which is kept open between
+        requests unless the client asks to close it.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = \
+                        request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._send(writer, 400,
+                                     {'error': 'Malformed request'}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection') != 'close')
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._send(writer, 400,
+                                     {'error': 'Invalid Content-Length'},
+                                     False)
+                    break
+                if length > MAX_BODY:
+                    await self._send(writer, 413,
+                                     {'error': 'Request body too large'},
+                                     False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self._dispatch(method, target, body)
+                await self._send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, payload, keep_alive):
+        """
+        Writes a JSON answer. The payload is either already encoded or a
+        value to encode.
+        """
+        if not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode('utf-8')
+        head = (f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\n'
+                f'Content-Type: application/json\r\n'
+                f'Content-Length: {len(payload)}\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+                f'\r\n')
+        writer.write(head.encode('latin-1') + payload)
+        await writer.drain()
+
+    async def _dispatch(self, method, target, body):
+        """
+        Routes a request and returns the status and the answer.
+        """
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        query = parse_qs(url.query)
+        try:
+            if method == 'GET':
+                if path not in READ_PATHS:
+                    raise HTTPError(404, 'Unknown resource')
+                return 200, await self._cached_read(path, query)
+            if method == 'POST' and path == '/movies':
+                return await self._add(self._json_body(body))
+            if method in ('PATCH', 'DELETE') and \
+                    path.startswith('/movies/'):
+                title = unquote(path[len('/movies/'):])
+                if method == 'DELETE':
+                    return await self._write(
+                        lambda storage: storage.delete_movie(title))
+                note = self._json_body(body).get('note')
+                if not isinstance(note, str):
+                    raise HTTPError(400, 'note must be a string')
+                return await self._write(
+                    lambda storage: storage.update_movie(title, note))
+            if path in READ_PATHS or path.startswith('/movies/'):
+                raise HTTPError(405, 'Method not allowed')
+            raise HTTPError(404, 'Unknown resource')
+        except HTTPError as err:
+            return err.status, {'error': str(err)}
+        except Exception as err:
+            return 500, {'error': f'{type(err).__name__}: {err}'}
+
+    @staticmethod
+    def _json_body(body):
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            raise HTTPError(400, 'The body is not valid JSON')
+        if not isinstance(data, dict):
+            raise HTTPError(400, 'The body must be a JSON object')
+        return data
+
+    async def _cached_read(self, path, query):
+        """
+        Returns the encoded answer of a GET request, from memory if the
+        library hasn't changed since it was last computed.
+        """
+        version = self._storage.version()
+        if version != self._version:
+            self._responses.clear()
+            self._version = version
+        # The order of the parameters doesn't change the answer
+        key = (path, tuple(sorted((name, tuple(values))
+                                  for name, values in query.items())))
+        future = self._responses.get(key)
+        if future is None:
+            read = self._read_function(path, query)
+            future = asyncio.ensure_future(self._call(
+                lambda storage: json.dumps(read(storage)).encode('utf-8')))
+            self._responses[key] = future
+            if len(self._responses) > CACHE_SIZE:
+                self._responses.popitem(last=False)
+        else:
+            self._responses.move_to_end(key)
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            if self._responses.get(key) is future:
+                del self._responses[key]
+            raise
+
+    @staticmethod
+    def _read_function(path, query):
+        """
+        Returns the function that computes the answer of a GET request
+        from the storage.
+        """
+        if path == '/movies':
+            conditions = (number(query, 'min_rating', float),
+                          number(query, 'max_rating', float),
+                          number(query, 'year_from', int),
+                          number(query, 'year_to', int),
+                          query.get('country', [None])[0])
+            if all(condition is None for condition in conditions):
+                return lambda storage: [movie_to_json(movie)
+                                        for movie in storage.list_movies()]
+            return lambda storage: [
+                movie_to_json(movie)
+                for movie in storage.filter_movies(*conditions)]
+        if path == '/histogram':
+            bins = positive_int(query, 'bins', 10)
+            return lambda storage: [
+                {'low': low, 'high': high, 'count': count}
+                for low, high, count in storage.rating_histogram(bins)]
+        if path == '/stats':
+            return lambda storage: storage.stats_summary()
+        if path == '/sorted':
+            limit = positive_int(query, 'limit')
+            page = positive_int(query, 'page', 1)
+            return lambda storage: [
+                movie_to_json(movie)
+                for movie in storage.sorted_movies(limit, page)]
+        text = query.get('q', [''])[0]
+        if query.get('fuzzy', ['0'])[0] in ('1', 'true'):
+            limit = positive_int(query, 'limit', 10)
+            return lambda storage: [
+                {'movie': movie_to_json(movie), 'score': score}
+                for movie, score in storage.fuzzy_search(text, limit)]
+        return lambda storage: [movie_to_json(movie)
+                                for movie in storage.find_movies(text)]
+
+    async def _write(self, function):
+        """
+        Runs a change on the worker and forgets the cached answers.
+        """
+        try:
+            changed = await self._call(function)
+        finally:
+            self._responses.clear()
+        if not changed:
+            raise HTTPError(404, 'No single movie matches the title')
+        return 200, {'ok': True}
+
+    async def _add(self, data):
+        titles = data.get('titles')
+        if titles is None and 'title' in data:
+            titles = [data['title']]
+        if not isinstance(titles, list) or not titles or \
+                not all(isinstance(title, str) for title in titles):
+            raise HTTPError(400, 'Give a title or a list of titles')
+        try:
+            failures = await self._call(
+                lambda storage: storage.add_movies(titles))
+        finally:
+            self._responses.clear()
+        # 201 when every title was added, 207 when only some were, and 422
+        # when none was
+        if not failures:
+            status = 201
+        elif len(failures) < len(set(titles)):
+            status = 207
+        else:
+            status = 422
+        return status, {'failures': failures}
+
+
+def serve(storage_factory, host=HOST, port=PORT):
+    """
+    Serves the library returned by `storage_factory` until interrupted.
+    """
+    try:
+        asyncio.run(LibraryServer(storage_factory, host,
+                                  port).serve_forever())
+    except KeyboardInterrupt:
+        pass
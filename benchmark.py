@@ -0,0 +1,398 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from movie import FIELDS, Movie
+from movie_stats import RatingStats
+from columnar import ColumnarView, HAVE_NUMPY, filter_movies
+
+# Library sizes measured by default
+SIZES: tuple = (1000, 10000, 100000)
+# Storage backends measured by default
+FORMATS: tuple = ('json', 'jsonl', 'csv', 'sqlite', 'mlib')
+# Number of timed runs of every storage operation
+RUNS: int = 20
+# Number of runs of the columnar comparison; the fastest one is reported
+REPEAT: int = 5
+COUNTRIES: tuple = ('United States', 'UK', 'France', 'Germany', 'Japan',
+                    'India', 'Italy', 'Spain', 'Canada', 'Brazil')
+TEMPLATE_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  '_static', 'index_template.html')
+EXTENSIONS: dict = {'json': '.json', 'jsonl': '.jsonl', 'csv': '.csv',
+                    'sqlite': '.db', 'mlib': '.mlib'}
+MAIN_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'main.py')
+# Commands whose cold start is measured, run as separate processes
+STARTUP_COMMANDS: tuple = ('list', 'stats')
+
+
+def synthetic_movies(count, seed=0):
+    """
+    Returns `count` made-up movies with random ratings, years and
+    countries. The titles are "Movie 0", "Movie 1" and so on.
+    """
+    generator = random.Random(seed)
+    return [Movie(f'Movie {number}', round(generator.uniform(1, 10), 1),
+                  generator.randint(1920, 2023),
+                  poster=f'https://example.com/{number}.jpg',
+                  imdbID=f'tt{number:07d}',
+                  country=generator.choice(COUNTRIES))
+            for number in range(count)]
+
+
+def write_library(file_format, path, movies):
+    """
+    Writes the movies to a new library file in the given format.
+    """
+    if file_format == 'json':
+        with open(path, 'w') as handler:
+            json.dump([movie.to_dict() for movie in movies], handler)
+    elif file_format == 'jsonl':
+        with open(path, 'w') as handler:
+            handler.writelines(json.dumps(movie.to_dict()) + '\n'
+                               for movie in movies)
+    elif file_format == 'csv':
+        with open(path, 'w', newline='') as handler:
+            writer = csv.DictWriter(handler, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(movie.to_dict() for movie in movies)
+    elif file_format == 'mlib':
+        from storage_mmap import convert_library
+        convert_library(movies, path)
+    else:
+        from storage_sqlite import StorageSqlite
+        StorageSqlite(path)._insert_movies(movies)
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    """
+    Answers OMDB and country requests with made-up data, so the benchmark
+    measures the application and not the internet. The same title always
+    gets the same answer.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are sent in separate writes, which Nagle's
+    # algorithm would delay on a keep-alive connection
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith('/name/'):
+            country = unquote(url.path[len('/name/'):])
+            body = [{'cca2': country[:2].upper()}]
+        else:
+            title = parse_qs(url.query).get('t', [''])[0]
+            number = zlib.crc32(title.encode('utf-8'))
+            body = {'Title': title,
+                    'Year': str(1920 + number % 100),
+                    'imdbRating': str(1 + number % 90 / 10),
+                    'Poster': f'https://example.com/{number}.jpg',
+                    'imdbID': f'tt{number % 10 ** 7:07d}',
+                    'Country': COUNTRIES[number % len(COUNTRIES)],
+                    'Response': 'True'}
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server():
+    """
+    Starts the stub API on a free local port in a background thread.
+
+    Returns:
+        tuple: The server and its base URL.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubApiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/'
+
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the value below which `fraction` of the sorted values fall,
+    using the nearest-rank method.
+    """
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def measure(operation, runs):
+    """
+    Runs `operation(run)` for every run number and reports its latency
+    percentiles in seconds, its throughput in operations per second and
+    the peak memory in bytes it allocated. The peak is measured on one
+    extra run, because tracing allocations slows the timed runs down.
+    Everything the operation prints is discarded.
+    """
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for run in range(runs):
+            start = time.perf_counter()
+            operation(run)
+            latencies.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            operation(runs)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    latencies.sort()
+    total = sum(latencies)
+    return {'runs': runs,
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+            'throughput': runs / total if total else None,
+            'peak_memory': peak}
+
+
+def open_storage(file_format, path, client):
+    """
+    Opens a library file with the storage class of its format.
+    """
+    if file_format == 'json':
+        from storage_json import StorageJson
+        return StorageJson(path, client=client)
+    if file_format == 'jsonl':
+        from storage_jsonl import StorageJsonl
+        return StorageJsonl(path, client=client)
+    if file_format == 'csv':
+        from storage_csv import StorageCsv
+        return StorageCsv(path, client=client)
+    if file_format == 'mlib':
+        from storage_mmap import StorageMmap
+        return StorageMmap(path, client=client)
+    from storage_sqlite import StorageSqlite
+    return StorageSqlite(path, client=client)
+
+
+def benchmark_storage(file_format, count, api_url, runs):
+    """
+    Measures every storage operation on a synthetic library of `count`
+    movies. The library, the API caches and the web page are created in a
+    temporary working directory that is removed afterwards.
+    """
+    from api_client import OmdbClient, ResponseCache
+    from country_codes import CountryResolver, set_resolver
+
+    work_dir = tempfile.mkdtemp(prefix='movie_benchmark_')
+    previous_dir = os.getcwd()
+    try:
+        os.chdir(work_dir)
+        os.makedirs('_static')
+        shutil.copy(TEMPLATE_PATH, os.path.join('_static',
+                                                'index_template.html'))
+        path = 'library' + EXTENSIONS[file_format]
+        write_library(file_format, path, synthetic_movies(count))
+        # Both clients use the stub API and caches in the working directory
+        cache_dir = os.path.join(work_dir, '.movie_cache')
+        client = OmdbClient(base_url=api_url, cache=ResponseCache(
+            os.path.join(cache_dir, 'omdb')))
+        set_resolver(CountryResolver(
+            cache=ResponseCache(os.path.join(cache_dir, 'countries')),
+            api_url=api_url + 'name/'))
+        storage = open_storage(file_format, path, client)
+        # Deleted movies are taken from the second half of the library,
+        # so they are never the ones being updated or searched for
+        operations = {
+            'load': lambda run: open_storage(
+                file_format, path, client).list_movies(),
+            'list_movies': lambda run: storage.list_movies(),
+            'add_movie': lambda run: storage.add_movie(
+                f'Benchmark Movie {run}'),
+            'update_movie': lambda run: storage.update_movie(
+                f'Movie {run}', f'Note {run}'),
+            'delete_movie': lambda run: storage.delete_movie(
+                f'Movie {count // 2 + run}'),
+            'stats': lambda run: storage.stats(),
+            'search_movie': lambda run: storage.search_movie(
+                f'Movie {run * 7 % count}'),
+            'sort_page': lambda run: storage.movies_sorted_by_rating(20),
+            'generate_website': lambda run: storage.generate_website(),
+        }
+        return {'format': file_format,
+                'movies': count,
+                'operations': {name: measure(operation, runs)
+                               for name, operation in operations.items()}}
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_startup(file_format, count, runs):
+    """
+    Measures how long the command line program takes to run a command on
+    a library of `count` movies in a new process, next to a Python process
+    that does nothing. The difference is what the program itself costs,
+    its imports included.
+    """
+    work_dir = tempfile.mkdtemp(prefix='movie_benchmark_')
+    try:
+        path = os.path.join(work_dir, 'library' + EXTENSIONS[file_format])
+        write_library(file_format, path, synthetic_movies(count))
+        commands = {'python': [sys.executable, '-c', 'pass']}
+        for command in STARTUP_COMMANDS:
+            commands[command] = [sys.executable, MAIN_PATH, path, command]
+        return {'format': file_format,
+                'movies': count,
+                'commands': {
+                    name: measure(lambda run: subprocess.run(
+                        arguments, cwd=work_dir, check=True,
+                        stdout=subprocess.DEVNULL), runs)
+                    for name, arguments in commands.items()}}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def best_time(function, repeat=REPEAT):
+    """
+    Returns the fastest of `repeat` runs of `function`, in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def compare_columnar(count):
+    """
+    Times the stats, sorting and filtering operations on a library of
+    `count` movies with plain Python and, if NumPy is installed, with the
+    columnar view.
+    """
+    movies = synthetic_movies(count)
+    result = {
+        'movies': count,
+        'python': {
+            'stats': best_time(lambda: RatingStats(movies).summary()),
+            'sort': best_time(lambda: sorted(
+                movies, key=lambda item: item['rating'], reverse=True)),
+            'filter': best_time(lambda: filter_movies(
+                movies, min_rating=8, year_from=1990, year_to=2010)),
+        },
+    }
+    if HAVE_NUMPY:
+        view = ColumnarView(movies)
+        result['columnar'] = {
+            'build': best_time(lambda: ColumnarView(movies)),
+            'stats': best_time(view.summary),
+            'sort': best_time(view.sorted_by_rating),
+            'filter': best_time(lambda: view.filter(
+                min_rating=8, year_from=1990, year_to=2010)),
+        }
+    return result
+
+
+def git_commit():
+    """
+    Returns the commit of the working tree, or None outside a git
+    repository.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(baseline, report):
+    """
+    Prints how the median latency of every operation changed since the
+    baseline report.
+    """
+    old = {(result['format'], result['movies'], name): summary['p50']
+           for result in baseline.get('storage', [])
+           for name, summary in result['operations'].items()}
+    print(f'Compared with {baseline.get("commit")}:', file=sys.stderr)
+    for result in report['storage']:
+        for name, summary in result['operations'].items():
+            key = (result['format'], result['movies'], name)
+            if key in old and old[key]:
+                print(f'{key[0]:6} {key[1]:>8} {name:16} '
+                      f'{old[key] * 1000:10.3f} ms -> '
+                      f'{summary["p50"] * 1000:10.3f} ms '
+                      f'({summary["p50"] / old[key]:.2f}x)',
+                      file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measures the storage operations and the website '
+                    'generator on synthetic libraries, with the web APIs '
+                    'replaced by a local stub, and prints the results as '
+                    'JSON.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='the library sizes to measure')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS,
+                        default=FORMATS, help='the storage backends')
+    parser.add_argument('--runs', type=int, default=RUNS,
+                        help='the timed runs of every operation')
+    parser.add_argument('--startup-runs', type=int, default=REPEAT,
+                        help='the timed starts of every command')
+    parser.add_argument('--output', help='write the report to this file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='a report of an earlier commit to compare with')
+    args = parser.parse_args()
+
+    server, api_url = start_stub_server()
+    try:
+        report = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': HAVE_NUMPY,
+            'storage': [benchmark_storage(file_format, count, api_url,
+                                          args.runs)
+                        for count in args.sizes
+                        for file_format in args.formats],
+            'startup': [benchmark_startup(file_format, count,
+                                          args.startup_runs)
+                        for count in args.sizes
+                        for file_format in args.formats],
+            'columnar': [compare_columnar(count) for count in args.sizes],
+        }
+    finally:
+        server.shutdown()
+
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w') as handler:
+            handler.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare, 'r') as handler:
+            compare_reports(json.load(handler), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import importlib.util
+from fractions import Fraction
+
+# NumPy is optional. It is slow to import, so it is only imported once a
+# large library needs it.
+HAVE_NUMPY: bool = importlib.util.find_spec('numpy') is not None
+np = None
+# Libraries smaller than this are handled faster by plain Python
+MIN_ROWS: int = 5000
+# Year stored for movies whose year isn't a single number
+NO_YEAR: int = -1
+
+
+def _load_numpy():
+    """
+    Imports NumPy on first use and returns the module.
+    """
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+class ColumnarView:
+    """
+    A column-oriented copy of a movie list, backed by NumPy arrays.
+
+    Ratings, years and country codes are stored in one array each, so
+    statistics, sorting, histograms and filters run as vectorized
+    operations instead of Python loops over the movies. Row `i` of every
+    array describes `movies[i]`.
+
+    The view is a snapshot: it is rebuilt when the movie list changes.
+    """
+
+    def __init__(self, movies):
+        """
+        Args:
+            movies (list): The movies, in library order.
+
+        Raises:
+            ValueError: If a rating isn't a number.
+        """
+        _load_numpy()
+        self.movies = movies
+        count = len(movies)
+        self.ratings = np.fromiter(
+            (float(movie['rating']) for movie in movies), dtype=np.float64,
+            count=count)
+        self.years = np.fromiter(
+            (movie['year'] if isinstance(movie['year'], int) else NO_YEAR
+             for movie in movies), dtype=np.int32, count=count)
+        # Every distinct country gets a small integer code
+        codes = {}
+        self.countries = np.fromiter(
+            (codes.setdefault(movie['country'], len(codes))
+             for movie in movies), dtype=np.int32, count=count)
+        self.country_codes = codes
+
+    def __len__(self):
+        return len(self.movies)
+
+    def mean(self):
+        """Returns the average rating."""
+        return float(self.ratings.mean())
+
+    def median(self):
+        """Returns the median rating."""
+        return float(np.median(self.ratings))
+
+    def order_by_rating(self, descending=True):
+        """
+        Returns the row numbers sorted by rating. Movies with the same
+        rating stay in library order.
+        """
+        keys = -self.ratings if descending else self.ratings
+        return np.argsort(keys, kind='stable')
+
+    def sorted_by_rating(self, descending=True):
+        """
+        Returns the movies sorted by rating, highest first by default.
+        """
+        return [self.movies[row]
+                for row in self.order_by_rating(descending).tolist()]
+
+    def histogram(self, bins=10, value_range=(0, 10)):
+        """
+        Returns the number of movies per rating bucket.
+
+        Returns:
+            list: (lower bound, upper bound, count) tuples.
+        """
+        counts, edges = np.histogram(self.ratings, bins=bins,
+                                     range=value_range)
+        return [(float(edges[i]), float(edges[i + 1]), int(counts[i]))
+                for i in range(len(counts))]
+
+    def filter(self, min_rating=None, max_rating=None, year_from=None,
+               year_to=None, country=None):
+        """
+        Returns the movies that match every given condition, in library
+        order. Conditions left as None are ignored.
+
+        Args:
+            min_rating (float): The lowest rating to include.
+            max_rating (float): The highest rating to include.
+            year_from (int): The first release year to include.
+            year_to (int): The last release year to include.
+            country (str): The exact `country` field to match.
+        """
+        mask = np.ones(len(self.movies), dtype=bool)
+        if min_rating is not None:
+            mask &= self.ratings >= min_rating
+        if max_rating is not None:
+            mask &= self.ratings <= max_rating
+        if year_from is not None:
+            mask &= self.years >= year_from
+        if year_to is not None:
+            mask &= (self.years <= year_to) & (self.years != NO_YEAR)
+        if country is not None:
+            if country not in self.country_codes:
+                return []
+            mask &= self.countries == self.country_codes[country]
+        return [self.movies[row] for row in np.flatnonzero(mask).tolist()]
+
+    def summary(self):
+        """
+        Returns the rating statistics in the same form as
+        `RatingStats.summary`. The average is computed exactly, like
+        RatingStats does, so both give the same value.
+        """
+        if len(self.movies) == 0:
+            return {'count': 0}
+        values, counts = np.unique(self.ratings, return_counts=True)
+        total = sum((Fraction(value) * number for value, number in
+                     zip(values.tolist(), counts.tolist())), Fraction(0))
+        highest = float(self.ratings.max())
+        lowest = float(self.ratings.min())
+        best_rows = np.flatnonzero(self.ratings == highest).tolist()
+        worst_rows = [] if lowest == highest else \
+            np.flatnonzero(self.ratings == lowest).tolist()
+        return {'count': len(self.movies),
+                'average': float(total / len(self.movies)),
+                'median': self.median(),
+                'highest': highest,
+                'lowest': lowest,
+                'best': [self.movies[row]['title'] for row in best_rows],
+                'worst': [self.movies[row]['title'] for row in worst_rows]}
+
+
+def _matches(movie, min_rating, max_rating, year_from, year_to, country):
+    """
+    Returns whether a movie meets the conditions of `filter_movies`.
+    """
+    rating = float(movie['rating'])
+    year = movie['year'] if isinstance(movie['year'], int) else NO_YEAR
+    return ((min_rating is None or rating >= min_rating)
+            and (max_rating is None or rating <= max_rating)
+            and (year_from is None or year >= year_from)
+            and (year_to is None or (year != NO_YEAR and year <= year_to))
+            and (country is None or movie['country'] == country))
+
+
+def filter_movies(movies, min_rating=None, max_rating=None, year_from=None,
+                  year_to=None, country=None):
+    """
+    Returns the movies that match every given condition, in library order,
+    without NumPy. See `ColumnarView.filter` for the conditions.
+    """
+    return [movie for movie in movies
+            if _matches(movie, min_rating, max_rating, year_from, year_to,
+                        country)]
+
+
+def rating_histogram(movies, bins=10, value_range=(0, 10)):
+    """
+    Returns the number of movies per rating bucket without NumPy, in the
+    same form as `ColumnarView.histogram`. The last bucket includes its
+    upper bound and ratings outside the range are left out.
+    """
+    low, high = value_range
+    width = (high - low) / bins
+    counts = [0] * bins
+    for movie in movies:
+        rating = float(movie['rating'])
+        if low <= rating <= high:
+            counts[min(int((rating - low) / width), bins - 1)] += 1
+    return [(low + i * width, low + (i + 1) * width, counts[i])
+            for i in range(bins)]
+
+
+def sort_ratings(ratings):
+    """
+    Returns the ratings sorted in ascending order as a list, using NumPy
+    for large lists when it is installed.
+    """
+    if HAVE_NUMPY and len(ratings) >= MIN_ROWS:
+        _load_numpy()
+        return np.sort(np.asarray(ratings, dtype=np.float64)).tolist()
+    return sorted(ratings)
+
+
+def rating_order(ratings):
+    """
+    Returns the positions of the ratings sorted from highest to lowest,
+    equal ratings in their original order. NumPy is used for large lists
+    when it is installed.
+    """
+    if HAVE_NUMPY and len(ratings) >= MIN_ROWS:
+        _load_numpy()
+        keys = -np.asarray(ratings, dtype=np.float64)
+        return np.argsort(keys, kind='stable').tolist()
+    return sorted(range(len(ratings)), key=lambda row: -ratings[row])
@@ -0,0 +1,133 @@
+import os
+import threading
+
+import profiler
+from api_client import CACHE_DIR, MAX_WORKERS, TIMEOUT, ResponseCache, \
+    create_session, get_json
+
+# The API to get country code from country name
+COUNTRY_API: str = os.environ.get('MOVIE_APP_COUNTRY_URL',
+                                  "https://restcountries.com/v3.1/name/")
+
+
+def country_name(movie_country):
+    """
+    Returns the name of the country to look up for a movie's `country`
+    field. Only the first country of a list is used.
+    """
+    if 'United States' in movie_country:
+        return 'United States of America'
+    elif ',' in movie_country:
+        return movie_country[:movie_country.index(',')]
+    return movie_country
+
+
+class CountryResolver:
+    """
+    Resolves country names to their two-letter (cca2) codes.
+
+    Codes are remembered in memory and in a cache file on disk, so every
+    country is looked up at most once. The names that still have to be
+    looked up are resolved in parallel.
+    """
+
+    def __init__(self, cache=None, max_workers=MAX_WORKERS,
+                 timeout=TIMEOUT, api_url=COUNTRY_API):
+        """
+        Args:
+            cache (ResponseCache): The disk cache, by default `countries`
+            in CACHE_DIR. Country codes never expire.
+            max_workers (int): The number of parallel API calls.
+            timeout (tuple): Connect and read timeouts in seconds.
+            api_url (str): The address the country name is appended to,
+            for example a local stand-in server when testing.
+        """
+        if cache is None:
+            cache = ResponseCache(os.path.join(CACHE_DIR, 'countries'))
+        self.cache = cache
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.api_url = api_url
+        self._codes = {}
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _lookup(self, country):
+        with self._lock:
+            if self._session is None:
+                self._session = create_session(self.max_workers)
+        country_data = get_json(self._session, self.api_url + country,
+                                timeout=self.timeout)
+        return country_data[0]["cca2"]
+
+    def resolve(self, countries):
+        """
+        Returns the codes of the given country names.
+
+        Args:
+            countries (iterable): Country names, as returned by
+            `country_name`. Duplicates are looked up once.
+
+        Returns:
+            dict: Maps each country name to its code.
+
+        Raises:
+            FetchError: If a country couldn't be fetched from the API.
+            KeyError, IndexError: If the API returned no code for a country.
+        """
+        countries = set(countries)
+        missing = [country for country in countries
+                   if country not in self._codes]
+        cached = self.cache.get_many(missing)
+        self._codes.update(cached)
+        missing = [country for country in missing if country not in cached]
+
+        if missing:
+            def lookup(country):
+                try:
+                    return self._lookup(country)
+                except Exception as err:
+                    return err
+
+            from concurrent.futures import ThreadPoolExecutor
+
+            with profiler.phase('resolve countries'), \
+                    ThreadPoolExecutor(max_workers=self.max_workers) \
+                    as executor:
+                results = list(executor.map(profiler.bind(lookup),
+                                            missing))
+            errors = []
+            for country, result in zip(missing, results):
+                if isinstance(result, Exception):
+                    errors.append(result)
+                else:
+                    self._codes[country] = result
+                    self.cache.put([country], result, save=False)
+            # The codes that were found are kept even if others failed
+            self.cache.save()
+            if errors:
+                raise errors[0]
+
+        return {country: self._codes[country] for country in countries}
+
+
+_default_resolver = None
+
+
+def get_resolver():
+    """
+    Returns the country resolver shared by the storages.
+    """
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = CountryResolver()
+    return _default_resolver
+
+
+def set_resolver(resolver):
+    """
+    Replaces the country resolver shared by the storages, for example with
+    one that uses a local stand-in API.
+    """
+    global _default_resolver
+    _default_resolver = resolver
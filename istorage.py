@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
 
+from movie_cache import file_signature
+
 
 class IStorage(ABC):
     @abstractmethod
@@ -50,3 +52,46 @@ class IStorage(ABC):
         and saves it. The function doesn't need to validate the input.
         """
         pass
+
+    @abstractmethod
+    def add_movies(self, titles):
+        """
+        Adds many movies to the movies' database at once.
+        Looks up all the titles in parallel, adds the ones that were found
+        and saves the database a single time.
+
+        Returns a dictionary that maps every title that couldn't be added
+        to the reason, for example:
+        {
+          "Not A Real Movie": "The movie not found"
+        }
+        """
+        pass
+
+    @abstractmethod
+    def refresh_movies(self, fresh_movies):
+        """
+        Replaces the data of movies with newer data fetched from OMDB.
+        Every fresh movie replaces the stored movie with the same imdbID,
+        keeping its note, and only movies whose data changed are saved.
+
+        Returns the number of movies that changed.
+        """
+        pass
+
+    def version(self):
+        """
+        Returns a value that changes whenever the library changes, through
+        this storage or another process. Only the metadata of the file is
+        read, so it is cheap enough to check before every read.
+        """
+        return file_signature((self.file_path,))
+
+    @abstractmethod
+    def batch(self):
+        """
+        Returns a context manager that groups changes: the commands run
+        inside it work on the loaded movies, and the changes are saved
+        with a single write when it ends.
+        """
+        pass
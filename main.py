@@ -1,18 +1,91 @@
-from storage_json import StorageJson
-from storage_csv import StorageCsv
-from movie_app import MovieApp
+from movie_app import MovieApp, add_commands
+import profiler
 import argparse
+import sys
+
+
+def open_storage(file_path, journal=False, interactive=True):
+    """
+    Returns the storage for a file, chosen by its extension, or None if
+    the file type isn't supported.
+
+    Only the module of the chosen backend is imported, which keeps the
+    start of the program fast.
+    """
+    if file_path.endswith('.jsonl'):
+        from storage_jsonl import StorageJsonl
+        return StorageJsonl(file_path, interactive=interactive)
+    if file_path.endswith('.json'):
+        from storage_json import StorageJson
+        return StorageJson(file_path, journal=journal,
+                           interactive=interactive)
+    if file_path.endswith('.csv'):
+        from storage_csv import StorageCsv
+        return StorageCsv(file_path, interactive=interactive)
+    if file_path.endswith(('.db', '.sqlite')):
+        from storage_sqlite import StorageSqlite
+        return StorageSqlite(file_path, interactive=interactive)
+    if file_path.endswith('.mlib'):
+        from storage_mmap import StorageMmap
+        return StorageMmap(file_path, interactive=interactive)
+    return None
+
+
+def run_command(args, storage, storage_factory):
+    """
+    Runs the command given on the command line against a storage.
+    """
+    if args.command == 'convert':
+        from storage_mmap import convert_library
+
+        if not args.target.endswith('.mlib'):
+            print('The new library must have the .mlib extension.')
+            return
+        movies = storage.list_movies()
+        convert_library(movies, args.target)
+        print(f'{len(movies)} movies written to "{args.target}".')
+        return
+    movie_app = MovieApp(storage, storage_factory)
+    if args.command == 'batch':
+        if args.script == '-':
+            movie_app.run_batch(sys.stdin)
+        else:
+            try:
+                with open(args.script, 'r') as handler:
+                    movie_app.run_batch(handler)
+            except FileNotFoundError:
+                print(f'Error: The file "{args.script}" was not found.')
+    else:
+        movie_app.execute(args)
 
 
 # The main function which is being executed upon running the program
 def main() -> None:
     """
-    This function runs the Movie App, which provides a menu to interact with
-    a movie database. It prompts the user to choose functions for managing
-    movies and performs the corresponding actions.
+    This function runs the Movie App. Without a command, it provides a
+    menu to interact with a movie database: it prompts the user to choose
+    functions for managing movies and performs the corresponding actions.
+    With a command, it runs that command and exits.
 
     Command-line arguments:
-    file_path (str): Path to the storage file (JSON or CSV)
+    file_path (str): Path to the storage file (JSON, JSON Lines with a
+    .jsonl extension, CSV, SQLite with a .db or .sqlite extension, or a
+    memory-mapped .mlib library)
+    --journal: Record changes to a JSON database in an append-only journal
+    that is compacted into the file from time to time.
+    --import (str): Same as the `import` command.
+    command: One of list, add, delete, update, stats, search, sort, filter,
+    histogram, build, import and refresh, followed by its arguments, or
+    `batch` followed by a script file with one command per line (standard
+    input if omitted). A batch loads the storage once and saves all its
+    changes in a single write.
+    `serve` serves the library as a JSON API over HTTP instead, and
+    `convert` copies it to a new memory-mapped .mlib library.
+    --profile: Print where the time of every command went: its phases
+    (reading, writing, HTTP calls, rendering) and counters such as bytes
+    read and written, HTTP calls and cache hits.
+    --profile-output (str): Also write cProfile data to a file, readable
+    with `python -m pstats`.
 
     Returns: None
     """
@@ -21,24 +94,77 @@ def main() -> None:
 
     # Define the command-line argument
     parser.add_argument('file_path',
-                        help='Path to the storage file (JSON or CSV)')
+                        help='Path to the storage file (JSON, JSON Lines '
+                             '.jsonl, CSV, SQLite .db/.sqlite or '
+                             'memory-mapped .mlib)')
+    parser.add_argument('--journal', action='store_true',
+                        help='Append changes to a journal instead of '
+                             'rewriting the JSON file (JSON only)')
+    parser.add_argument('--import', dest='import_path',
+                        help='Add the movies listed in a text file, '
+                             'one title per line')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print the time spent in each phase of every '
+                             'command and its counters')
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help='Also write cProfile data to FILE '
+                             '(implies --profile)')
+    commands = add_commands(parser)
+    batch = commands.add_parser(
+        'batch', help='run the commands of a script, one per line')
+    batch.add_argument('script', nargs='?', default='-',
+                       help='the script file, or - for standard input')
+    serve = commands.add_parser(
+        'serve', help='serve the library as a JSON API over HTTP')
+    serve.add_argument('--host', help='the address to listen on '
+                                      '(default 127.0.0.1)')
+    serve.add_argument('--port', type=int,
+                       help='the port to listen on (default 8000)')
+    convert = commands.add_parser(
+        'convert', help='copy the library to a memory-mapped .mlib library')
+    convert.add_argument('target', help='the path of the new library')
 
     # Parse the command-line arguments
     args = parser.parse_args()
+    if args.command is None and args.import_path:
+        args.command = 'import'
+    # Commands run without a user at the keyboard, so they never prompt
+    interactive = args.command is None
 
     # Access the value of the parsed argument
     file_path = args.file_path
 
-    if file_path.endswith('.json'):
-        storage = StorageJson(file_path)
-        movie_app = MovieApp(storage)
-        movie_app.run()
-    elif file_path.endswith('.csv'):
-        storage = StorageCsv(file_path)
-        movie_app = MovieApp(storage)
-        movie_app.run()
-    else:
-        print('Invalid file type. Only JSON or CSV files are supported.')
+    if not file_path.endswith(('.json', '.jsonl', '.csv', '.db', '.sqlite',
+                               '.mlib')):
+        print('Invalid file type. Only JSON, JSON Lines, CSV, SQLite or '
+              '.mlib files are supported.')
+        return
+
+    if args.command == 'serve':
+        import api_server
+
+        # The server opens the storage on its own worker thread
+        api_server.serve(
+            lambda: open_storage(file_path, args.journal, interactive),
+            api_server.HOST if args.host is None else args.host,
+            api_server.PORT if args.port is None else args.port)
+        return
+
+    if args.profile or args.profile_output:
+        profiler.enable(args.profile_output)
+
+    storage = open_storage(file_path, args.journal, interactive)
+
+    # The background refresh of the menu works on a storage of its own
+    def storage_factory():
+        return open_storage(file_path, args.journal, interactive)
+
+    if args.command is None:
+        # The menu profiles every choice on its own
+        MovieApp(storage, storage_factory).run()
+        return
+    with profiler.command(args.command):
+        run_command(args, storage, storage_factory)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+# The fields of a movie record, in the order they are stored
+FIELDS: tuple = ('title', 'rating', 'year', 'poster', 'imdbID', 'note',
+                 'country')
+# The fields as a set-like view, like the keys of a dictionary
+_KEYS = dict.fromkeys(FIELDS).keys()
+
+
+def _parse(value, number_type):
+    """
+    Converts a value read from a file to a number, keeping it unchanged if
+    it isn't one (for example a year range like "2001-2003").
+    """
+    if isinstance(value, number_type) and not isinstance(value, bool):
+        return value
+    try:
+        return number_type(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class Movie:
+    """
+    A movie record.
+
+    Movies are decoded once when a storage file is loaded: the rating is a
+    float and the year an int, so they never have to be parsed again. The
+    fields are kept in slots, which takes much less memory than a
+    dictionary per movie. Fields can still be read and written like
+    dictionary keys (`movie['title']`), so code written for dictionaries
+    keeps working.
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, title, rating, year, poster='', imdbID='', note='',
+                 country=''):
+        self.title = title
+        self.rating = rating
+        self.year = year
+        self.poster = poster
+        self.imdbID = imdbID
+        self.note = note
+        self.country = country
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a movie from a dictionary, such as a JSON object or a CSV
+        row, converting the rating and year to numbers. Unknown keys are
+        ignored and missing ones are left empty.
+        """
+        return cls(data.get('title', ''),
+                   _parse(data.get('rating'), float),
+                   _parse(data.get('year'), int),
+                   data.get('poster', ''),
+                   data.get('imdbID', ''),
+                   data.get('note') or '',
+                   data.get('country', ''))
+
+    def to_dict(self):
+        """
+        Returns the movie as a dictionary, for example to serialize it.
+        """
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def __getitem__(self, field):
+        if field not in FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __setitem__(self, field, value):
+        if field not in FIELDS:
+            raise KeyError(field)
+        setattr(self, field, value)
+
+    def __contains__(self, field):
+        return field in FIELDS
+
+    def get(self, field, default=None):
+        """
+        Returns the value of a field, or `default` if there is no such
+        field.
+        """
+        if field not in FIELDS:
+            return default
+        return getattr(self, field)
+
+    def keys(self):
+        return _KEYS
+
+    def values(self):
+        return [getattr(self, field) for field in FIELDS]
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in FIELDS]
+
+    def __eq__(self, other):
+        if not isinstance(other, Movie):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __repr__(self):
+        return f'Movie({self.to_dict()!r})'
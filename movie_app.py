@@ -1,3 +1,8 @@
+import argparse
+import shlex
+
+import profiler
+
 # Movie menu display dictionary
 MENU: dict = {
     0: 'Exit',
@@ -9,16 +14,140 @@ MENU: dict = {
     6: 'Random movie',
     7: 'Search movie',
     8: 'Movies sorted by rating',
-    9: 'Generate website'
+    9: 'Generate website',
+    10: 'Refresh movie data'
 }
 
 
+def positive_int(text):
+    """
+    Parses a command line argument that must be a whole number above zero.
+    """
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'{text} is not a positive number')
+    return value
+
+
+def add_commands(parser):
+    """
+    Adds the movie commands as subcommands of an argument parser. The
+    chosen command is stored as `command`, or None if there is none.
+    """
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.add_parser('list', help='list the movies')
+    add = commands.add_parser('add', help='add movies by title')
+    add.add_argument('titles', nargs='+', help='the titles to look up')
+    delete = commands.add_parser('delete', help='delete a movie')
+    delete.add_argument('title')
+    update = commands.add_parser('update', help='set the note of a movie')
+    update.add_argument('title')
+    update.add_argument('note')
+    commands.add_parser('stats', help='print the rating statistics')
+    search = commands.add_parser('search', help='search the movie titles')
+    search.add_argument('title')
+    sort = commands.add_parser('sort', help='list the movies by rating')
+    sort.add_argument('--limit', type=positive_int,
+                      help='the number of movies per page')
+    sort.add_argument('--page', type=positive_int, default=1,
+                      help='the page to print, starting at 1')
+    filter_command = commands.add_parser(
+        'filter', help='list the movies that match every given condition')
+    filter_command.add_argument('--min-rating', type=float,
+                                help='the lowest rating to include')
+    filter_command.add_argument('--max-rating', type=float,
+                                help='the highest rating to include')
+    filter_command.add_argument('--year-from', type=int,
+                                help='the first release year to include')
+    filter_command.add_argument('--year-to', type=int,
+                                help='the last release year to include')
+    filter_command.add_argument('--country',
+                                help='the country to match exactly')
+    histogram = commands.add_parser(
+        'histogram', help='count the movies per rating bucket')
+    histogram.add_argument('--bins', type=positive_int, default=10,
+                           help='the number of buckets between 0 and 10')
+    build = commands.add_parser('build', help='generate the website')
+    build.add_argument('--full', action='store_true',
+                       help='render every tile again')
+    build.add_argument('--assets', action='store_true',
+                       help='download the posters and flags and show the '
+                            'local copies')
+    build.add_argument('--thumbnails', type=positive_int, metavar='WIDTH',
+                       help='show the posters as thumbnails of this width '
+                            '(implies --assets, needs Pillow)')
+    build.add_argument('--page-size', type=positive_int, metavar='N',
+                       help='write a site of pages with N movies each, '
+                            'sorted by library order, rating and year, '
+                            'instead of a single page')
+    import_command = commands.add_parser(
+        'import', help='add the movies listed in a text file')
+    import_command.add_argument('import_path',
+                                help='a text file with one title per line')
+    refresh = commands.add_parser(
+        'refresh', help='fetch the movie data again and save the changes')
+    refresh.add_argument('--restart', action='store_true',
+                         help='ignore the progress of an interrupted refresh')
+    refresh.add_argument('--batch-size', type=positive_int,
+                         help='the number of movies saved together')
+    return commands
+
+
+class ScriptParser(argparse.ArgumentParser):
+    """
+    An argument parser for the lines of a batch script. Invalid lines raise
+    ValueError with the reason instead of printing the usage and exiting,
+    so the script goes on with the next line. The subcommand parsers are
+    of the same class.
+    """
+
+    def error(self, message):
+        raise ValueError(message)
+
+    def exit(self, status=0, message=None):
+        # Only reached after --help has printed the help of a command
+        raise ValueError(message.strip() if message else 'help shown')
+
+
+def command_parser():
+    """
+    Returns the parser of a single command line of a batch script.
+    """
+    parser = ScriptParser(prog='batch', add_help=False)
+    add_commands(parser)
+    return parser
+
+
+def read_titles(import_path):
+    """
+    Returns the titles listed in a text file, one per line, without blank
+    lines.
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist.
+    """
+    with open(import_path, 'r') as handler:
+        return [line.strip() for line in handler if line.strip()]
+
+
 class MovieApp:
-    def __init__(self, storage):
+    def __init__(self, storage, storage_factory=None):
+        """
+        Args:
+            storage (IStorage): The storage the commands work on.
+            storage_factory (callable): Opens another storage of the same
+            library, used by the background refresh. Without it the
+            refresh runs in the foreground.
+        """
         self._storage = storage
+        self._storage_factory = storage_factory
+        self._refresh_worker = None
 
     def _command_list_movies(self):
-        movies = self._storage.list_movies()
+        # Storages that can stream their movies print the first ones
+        # before the rest are read
+        iter_movies = getattr(self._storage, 'iter_movies', None)
+        movies = iter_movies() if iter_movies else self._storage.list_movies()
         for movie in movies:
             print(f'{movie["title"]}, Rating: {movie["rating"]}, '
                   f'Released: {movie["year"]}')
@@ -41,11 +170,215 @@ class MovieApp:
     def _command_search(self, title):
         self._storage.search_movie(title)
 
-    def _command_movie_sort(self):
-        self._storage.movies_sorted_by_rating()
+    def _command_filter(self, min_rating=None, max_rating=None,
+                        year_from=None, year_to=None, country=None):
+        try:
+            movies = self._storage.filter_movies(min_rating, max_rating,
+                                                 year_from, year_to, country)
+        except ValueError:
+            print("Error: The movie list contains an invalid rating.")
+            return
+        if not movies:
+            print("No movies match.")
+        for movie in movies:
+            print(f'{movie["title"]}, Rating: {movie["rating"]}, '
+                  f'Released: {movie["year"]}')
+
+    def _command_histogram(self, bins=10):
+        try:
+            buckets = self._storage.rating_histogram(bins)
+        except ValueError:
+            print("Error: The movie list contains an invalid rating.")
+            return
+        for low, high, count in buckets:
+            print(f'{low:4.1f} - {high:4.1f}: {count}')
+
+    def _command_movie_sort(self, limit=None):
+        """
+        Prints the movies sorted by rating. With a limit, the movies are
+        shown one page at a time until the user stops or the last page.
+        """
+        page = 1
+        pages = self._storage.movies_sorted_by_rating(limit, page)
+        while limit is not None and pages is not None and page < pages:
+            answer = input('\nPress Enter for the next page or q to stop:\n')
+            if answer.strip().lower() == 'q':
+                break
+            page += 1
+            self._storage.movies_sorted_by_rating(limit, page)
+
+    def _command_webpage_generator(self, incremental=True, assets=False,
+                                   thumbnail_width=None, page_size=None):
+        """
+        Generates the website. With assets, the images are downloaded and
+        the page shows the local copies. With a page size, the website is
+        split into pages of that many movies.
+        """
+        if not assets and thumbnail_width is None:
+            self._storage.generate_website(incremental, page_size=page_size)
+            return
+
+        from site_assets import HAVE_PILLOW, AssetCache
+
+        if thumbnail_width is not None and not HAVE_PILLOW:
+            print('Pillow is not installed; the posters are shown at full '
+                  'size.')
+        cache = AssetCache(thumbnail_width=thumbnail_width)
+        self._storage.generate_website(incremental, assets=cache,
+                                       page_size=page_size)
+        if cache.downloaded or cache.failed:
+            print(f'{cache.downloaded} images downloaded, '
+                  f'{cache.failed} failed.')
+
+    def _command_import_movies(self, import_path):
+        try:
+            titles = read_titles(import_path)
+        except FileNotFoundError:
+            print(f'Error: The file "{import_path}" was not found.')
+            return
+        self._storage.add_movies(titles)
+
+    def _command_refresh(self, restart=False, batch_size=None):
+        """
+        Fetches the data of every movie again and saves the changes,
+        printing the progress after every batch.
+        """
+        from refresh_worker import BATCH_SIZE, RefreshWorker
+
+        worker = RefreshWorker(lambda: self._storage,
+                               batch_size=batch_size or BATCH_SIZE,
+                               restart=restart, verbose=True)
+        if worker.run():
+            print('The movie data is up to date.')
+        else:
+            print('The refresh was not finished; run it again to continue.')
+
+    def _command_refresh_in_background(self):
+        """
+        Starts refreshing the movie data in the background, or shows how
+        far the refresh has come and, once it has ended, how it went.
+        """
+        worker = self._refresh_worker
+        if worker is not None:
+            if worker.running:
+                print(f'Refreshing: {worker.progress()}')
+                return
+            self._refresh_worker = None
+            if worker.error is not None:
+                print(f'The refresh failed: {worker.error}')
+            else:
+                print(f'The refresh has ended: {worker.progress()}')
+            return
+        if self._storage_factory is None:
+            self._command_refresh()
+            return
+
+        from refresh_worker import RefreshWorker
 
-    def _command_webpage_generator(self):
-        self._storage.generate_website()
+        self._refresh_worker = RefreshWorker(self._storage_factory)
+        self._refresh_worker.start()
+        print('Refreshing the movie data in the background. Choose this '
+              'option again to see the progress.')
+
+    def execute(self, args):
+        """
+        Runs one command parsed by a parser set up with `add_commands`.
+        """
+        if args.command == 'list':
+            self._command_list_movies()
+        elif args.command == 'add':
+            if len(args.titles) == 1:
+                self._command_add_movies(args.titles[0])
+            else:
+                self._storage.add_movies(args.titles)
+        elif args.command == 'delete':
+            self._command_delete_movies(args.title)
+        elif args.command == 'update':
+            self._command_update_movies(args.title, args.note)
+        elif args.command == 'stats':
+            self._command_movie_stats()
+        elif args.command == 'search':
+            self._command_search(args.title)
+        elif args.command == 'sort':
+            if args.limit is None:
+                self._storage.movies_sorted_by_rating()
+            else:
+                self._storage.movies_sorted_by_rating(args.limit, args.page)
+        elif args.command == 'filter':
+            self._command_filter(args.min_rating, args.max_rating,
+                                 args.year_from, args.year_to, args.country)
+        elif args.command == 'histogram':
+            self._command_histogram(args.bins)
+        elif args.command == 'build':
+            self._command_webpage_generator(not args.full, args.assets,
+                                            args.thumbnails, args.page_size)
+        elif args.command == 'import':
+            self._command_import_movies(args.import_path)
+        elif args.command == 'refresh':
+            self._command_refresh(args.restart, args.batch_size)
+
+    def run_batch(self, lines):
+        """
+        Runs a script of commands, one per line, written like the command
+        line subcommands (for example `add "The Matrix"`). Blank lines and
+        lines starting with # are skipped, and invalid lines are reported
+        and skipped.
+
+        The storage is loaded once and every command works on the loaded
+        movies; the changes are saved with a single write at the end.
+
+        Args:
+            lines (iterable): The lines of the script.
+        """
+        parser = command_parser()
+        with self._storage.batch():
+            for line_number, line in enumerate(lines, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                try:
+                    args = parser.parse_args(shlex.split(line))
+                except ValueError as err:
+                    print(f'Line {line_number}: invalid command "{line}": '
+                          f'{err}')
+                    continue
+                if args.command is None:
+                    print(f'Line {line_number}: invalid command "{line}"')
+                    continue
+                self.execute(args)
+
+    def _menu_command(self, choice):
+        """
+        Asks for the input of a menu choice from 1 to 10 and returns its
+        command, ready to run, or None if the input is invalid. The input
+        is read first so a profile of the command doesn't include the time
+        spent typing.
+        """
+        if choice in (2, 3, 4, 7):
+            title = input('Enter the movie title:\n')
+            if choice == 2:
+                return lambda: self._command_add_movies(title)
+            if choice == 3:
+                return lambda: self._command_delete_movies(title)
+            if choice == 7:
+                return lambda: self._command_search(title)
+            note = input('Enter the movie note:\n')
+            return lambda: self._command_update_movies(title, note)
+        if choice == 8:
+            limit = input('Enter the page size '
+                          '(leave empty to show all):\n').strip()
+            if limit and (not limit.isdigit() or int(limit) == 0):
+                print('The page size must be a positive number.')
+                return None
+            return lambda: self._command_movie_sort(
+                int(limit) if limit else None)
+        return {
+            1: self._command_list_movies,
+            5: self._command_movie_stats,
+            6: self._command_movie_random,
+            9: self._command_webpage_generator,
+            10: self._command_refresh_in_background,
+        }[choice]
 
     def run(self):
         """
@@ -53,7 +386,7 @@ class MovieApp:
         user-selected commands.
 
         The function repeatedly displays the movie menu and prompts the user
-        to enter a choice (0-9). Based on the user's input, the corresponding
+        to enter a choice (0-10). Based on the user's input, the corresponding
         command is executed to perform the desired operation.
         The program continues running until the user chooses to exit by
         entering '0'.
@@ -69,6 +402,10 @@ class MovieApp:
         7: Search movie
         8: Movies sorted by rating
         9: Generate website
+        10: Refresh movie data, in the background
+
+        A refresh still running when the user exits is stopped, and the
+        next refresh continues where it stopped.
 
         Raises:
             ValueError: If the user enters a non-integer choice.
@@ -80,37 +417,23 @@ class MovieApp:
             print('\n********** My Movies Database **********\n\nMenu:')
             for key, val in MENU.items():
                 print(f'{key}. {val}')
-            user_choice = input('\nEnter your choice (0-9):\n')
+            user_choice = input('\nEnter your choice (0-10):\n')
             try:
                 user_choice = int(user_choice)
                 if user_choice == 0:
+                    if self._refresh_worker is not None and \
+                            self._refresh_worker.running:
+                        print('Stopping the refresh...')
+                        self._refresh_worker.stop()
                     break
-                elif user_choice == 1:
-                    self._command_list_movies()
-                elif user_choice == 2:
-                    title = input('Enter the movie title:\n')
-                    self._command_add_movies(title)
-                elif user_choice == 3:
-                    title = input('Enter the movie title:\n')
-                    self._command_delete_movies(title)
-                elif user_choice == 4:
-                    title = input('Enter the movie title:\n')
-                    note = input('Enter the movie note:\n')
-                    self._command_update_movies(title, note)
-                elif user_choice == 5:
-                    self._command_movie_stats()
-
-                elif user_choice == 6:
-                    self._command_movie_random()
-                elif user_choice == 7:
-                    title = input('Enter the movie title:\n')
-                    self._command_search(title)
-                elif user_choice == 8:
-                    self._command_movie_sort()
-                elif user_choice == 9:
-                    self._command_webpage_generator()
+                elif user_choice in MENU:
+                    command = self._menu_command(user_choice)
+                    if command is not None:
+                        with profiler.command(MENU[user_choice]):
+                            command()
                 else:
                     print(
-                        'Invalid choice. Please select within the range 0 - 9')
+                        'Invalid choice. Please select within the range '
+                        '0 - 10')
             except ValueError:
-                print('Please select within the range 0 - 9')
+                print('Please select within the range 0 - 10')
@@ -0,0 +1,163 @@
+import os
+
+
+def file_signature(paths):
+    """
+    Returns a tuple that changes whenever one of the files is replaced or
+    modified: the inode, size and modification time of each. Missing files
+    are recorded as None.
+    """
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            signature.append(None)
+            continue
+        signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+class FileCache:
+    """
+    Keeps the parsed contents of a storage file in memory.
+
+    The file is loaded once and kept as the working set. Every later read
+    only compares the file's signature (inode, size and modification time)
+    with the one recorded at load time, so it costs a single `os.stat`
+    call. When another process changes the file, the signature no longer
+    matches and the file is loaded again.
+
+    Structures derived from the data, such as search indexes, can be kept
+    alongside it with `derived`. They are dropped whenever the file is
+    loaded again, and updated in place when a write reports which records
+    were added and removed.
+
+    Writes can be deferred with `defer_writes`: changes are then only made
+    to the working set, and `flush` writes them all at once.
+    """
+
+    def __init__(self, file_path, loader, extra_paths=()):
+        """
+        Args:
+            file_path (str): The path of the storage file.
+            loader (callable): Function that reads the file and returns the
+            parsed data.
+            extra_paths (tuple): Other files the data is loaded from, such
+            as a journal. A change to any of them reloads the data.
+        """
+        self.file_path = file_path
+        self._loader = loader
+        self._paths = (file_path,) + tuple(extra_paths)
+        self._data = None
+        self._signature = None
+        self._derived = {}
+        self._deferred = False
+        self._dirty = False
+
+    def _current_signature(self):
+        return file_signature(self._paths)
+
+    def load(self):
+        """
+        Returns the cached data, loading the file again only if it has
+        changed on disk since it was last read or written.
+        """
+        if self._deferred and self._data is not None:
+            # The working set holds changes that aren't written yet
+            return self._data
+        signature = self._current_signature()
+        if self._data is None or signature != self._signature:
+            # The signature is taken before reading, so a change made while
+            # the file is being read is picked up by the next call.
+            self._data = self._loader()
+            self._signature = signature
+            self._derived = {}
+        return self._data
+
+    @property
+    def loaded(self):
+        """Whether the data is held in memory."""
+        return self._data is not None
+
+    def derived(self, name, builder):
+        """
+        Returns the structure stored under `name`, building it from the
+        current data with `builder` if it doesn't exist yet.
+        """
+        data = self.load()
+        if name not in self._derived:
+            self._derived[name] = builder(data)
+        return self._derived[name]
+
+    def store(self, data, writer, added=None, removed=None):
+        """
+        Writes the data with the given writer and keeps it as the cached
+        working set.
+
+        Args:
+            data: The new contents of the storage.
+            writer (callable): Function that writes the data to the file.
+            added (list): The records added by this write.
+            removed (list): The records removed by this write. If neither
+            `added` nor `removed` is given, the change is unknown and all
+            derived structures are dropped. Derived structures without
+            `add` and `remove` methods are always dropped on a change.
+        """
+        if self._deferred:
+            self._dirty = True
+        else:
+            try:
+                writer(data)
+            except Exception:
+                # The working set may already hold changes that never
+                # reached the disk, so the next read has to load the file
+                # again.
+                self.invalidate()
+                raise
+            self._signature = self._current_signature()
+        self._data = data
+        if added is None and removed is None:
+            self._derived = {}
+        elif added or removed:
+            for name, structure in list(self._derived.items()):
+                if hasattr(structure, 'add') and hasattr(structure, 'remove'):
+                    for record in removed or ():
+                        structure.remove(record)
+                    for record in added or ():
+                        structure.add(record)
+                else:
+                    del self._derived[name]
+
+    def defer_writes(self):
+        """
+        Starts keeping changes in the working set only, without writing
+        them, until `flush` is called. The file isn't checked for changes
+        made by other processes in the meantime.
+        """
+        self.load()
+        self._deferred = True
+
+    def flush(self, writer):
+        """
+        Writes the changes kept since `defer_writes` with the given writer,
+        if there are any, and goes back to writing every change.
+        """
+        self._deferred = False
+        if not self._dirty:
+            return
+        self._dirty = False
+        try:
+            writer(self._data)
+        except Exception:
+            self.invalidate()
+            raise
+        self._signature = self._current_signature()
+
+    def invalidate(self):
+        """
+        Drops the cached data so the next read loads the file again.
+        """
+        self._data = None
+        self._signature = None
+        self._derived = {}
@@ -0,0 +1,214 @@
+import json
+import os
+
+import profiler
+from movie import Movie
+
+
+def snapshot_base(file_path):
+    """
+    Returns a value that identifies the current version of a snapshot
+    file. Replacing the file changes it.
+    """
+    stat = os.stat(file_path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def delete_op(movie):
+    """
+    Returns the journal operation that deletes the movie.
+    """
+    return {'op': 'delete', 'title': movie['title'],
+            'imdbID': movie.get('imdbID')}
+
+
+def update_op(movie):
+    """
+    Returns the journal operation that sets the movie's current note.
+    """
+    return {'op': 'update', 'title': movie['title'],
+            'imdbID': movie.get('imdbID'), 'note': movie['note']}
+
+
+def refresh_op(movie):
+    """
+    Returns the journal operation that replaces the data of the movie with
+    the same imdbID by the movie's data, keeping its note.
+    """
+    return {'op': 'refresh', 'imdbID': movie['imdbID'],
+            'movie': movie.to_dict()}
+
+
+def apply_ops(movies, ops):
+    """
+    Applies journal operations to a list of movies in place.
+
+    Operations are dictionaries:
+    {"op": "add", "movie": {...}}
+    {"op": "delete", "title": "...", "imdbID": "..."}
+    {"op": "update", "title": "...", "imdbID": "...", "note": "..."}
+    {"op": "refresh", "imdbID": "...", "movie": {...}}
+
+    Deletions and updates apply to the first movie with that exact title
+    and imdbID, and refreshes to the first movie with that imdbID.
+    """
+    for op in ops:
+        if op['op'] == 'add':
+            movies.append(Movie.from_dict(op['movie']))
+            continue
+        if op['op'] == 'refresh':
+            for index, movie in enumerate(movies):
+                if movie.get('imdbID') == op['imdbID']:
+                    fresh = Movie.from_dict(op['movie'])
+                    fresh['note'] = movie['note']
+                    movies[index] = fresh
+                    break
+            continue
+        for index, movie in enumerate(movies):
+            if movie['title'] == op['title'] and \
+                    movie.get('imdbID') == op.get('imdbID'):
+                if op['op'] == 'delete':
+                    del movies[index]
+                elif op['op'] == 'update':
+                    movie['note'] = op['note']
+                break
+
+
+def _targets(op, movie):
+    """
+    Returns whether a deletion, update or refresh applies to the movie.
+    """
+    if op['op'] == 'refresh':
+        return movie.get('imdbID') == op['imdbID']
+    return movie['title'] == op['title'] and \
+        movie.get('imdbID') == op.get('imdbID')
+
+
+def stream_ops(movies, ops):
+    """
+    Yields the movies with journal operations applied, like `apply_ops`,
+    without holding the movies in memory.
+
+    Each operation is applied to the first movie it targets at the time
+    it runs, which is the first movie of the stream whose state, after
+    the earlier operations, matches it. Added movies follow the others.
+
+    Args:
+        movies (iterable): The movies, in library order.
+        ops (list): The operations to apply.
+    """
+    pending = [op for op in ops if op['op'] != 'add']
+    used = set()  # positions in `ops` of the operations already applied
+
+    def apply(movie, first):
+        # Runs the operations from position `first` on one movie and
+        # returns it, or None once it is deleted
+        for position in range(first, len(ops)):
+            op = ops[position]
+            if op['op'] == 'add' or position in used or \
+                    not _targets(op, movie):
+                continue
+            used.add(position)
+            if op['op'] == 'delete':
+                return None
+            if op['op'] == 'update':
+                movie['note'] = op['note']
+            else:
+                fresh = Movie.from_dict(op['movie'])
+                fresh['note'] = movie['note']
+                movie = fresh
+        return movie
+
+    for movie in movies:
+        if pending:
+            movie = apply(movie, 0)
+        if movie is not None:
+            yield movie
+    for position, op in enumerate(ops):
+        if op['op'] == 'add':
+            movie = apply(Movie.from_dict(op['movie']), position + 1)
+            if movie is not None:
+                yield movie
+
+
+class Journal:
+    """
+    An append-only file of the changes made since the last snapshot.
+
+    Each line is one JSON operation. The first line records which snapshot
+    the operations apply to, so a journal left behind by an interrupted
+    compaction, whose changes are already in the new snapshot, is ignored.
+    A line cut short by a crash is dropped when the journal is read.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The path of the journal file.
+        """
+        self.path = path
+        self.entries = 0
+        self._valid = False
+
+    def read(self, base):
+        """
+        Returns the operations recorded on top of the snapshot identified by
+        `base`, or an empty list if the journal belongs to another snapshot.
+        """
+        self.entries = 0
+        self._valid = False
+        ops = []
+        try:
+            handler = open(self.path, 'r+b')
+        except FileNotFoundError:
+            return ops
+        with handler:
+            good_offset = 0
+            for line_number, line in enumerate(handler):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn write at the end of the file
+                    handler.truncate(good_offset)
+                    break
+                if not line.endswith(b'\n'):
+                    handler.truncate(good_offset)
+                    break
+                good_offset += len(line)
+                if line_number == 0:
+                    if record.get('op') != 'base' or record['base'] != base:
+                        return ops
+                    self._valid = True
+                else:
+                    ops.append(record)
+        self.entries = len(ops)
+        return ops
+
+    def append(self, ops, base):
+        """
+        Appends operations to the journal and flushes them to disk. A
+        journal that doesn't belong to the snapshot `base` is started over.
+        """
+        lines = [json.dumps(op) + '\n' for op in ops]
+        mode = 'a'
+        if not self._valid:
+            lines.insert(0, json.dumps({'op': 'base', 'base': base}) + '\n')
+            mode = 'w'
+            self.entries = 0
+        content = ''.join(lines)
+        with profiler.phase('write'), open(self.path, mode) as handler:
+            handler.write(content)
+            handler.flush()
+            os.fsync(handler.fileno())
+        profiler.count('bytes written', len(content))
+        self._valid = True
+        self.entries += len(ops)
+
+    def clear(self):
+        """
+        Empties the journal after its operations were saved in a snapshot.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.entries = 0
+        self._valid = False
@@ -0,0 +1,107 @@
+from bisect import bisect_left, insort
+from collections import defaultdict
+from fractions import Fraction
+
+from columnar import sort_ratings
+
+
+class RatingStats:
+    """
+    Running rating statistics of a movie list.
+
+    The statistics are computed in a single pass when the object is built
+    and then kept up to date with `add` and `remove`: the count and total
+    give the average, a sorted list of ratings gives the median, minimum
+    and maximum, and the movies are grouped by rating for the best and
+    worst movies. Reading the statistics never walks the movie list.
+
+    The total is kept as an exact fraction, so any number of additions and
+    removals gives the same average as computing it again. Movies are told
+    apart by identity, like in TitleIndex, so removing one of two movies
+    with the same title removes the right one.
+    """
+
+    def __init__(self, movies=()):
+        """
+        Args:
+            movies (iterable): The movies, in library order.
+
+        Raises:
+            ValueError: If a rating isn't a number.
+        """
+        # rating -> {id() of a movie record: record}, in library order
+        self._movies = defaultdict(dict)
+        ratings = []
+        for movie in movies:
+            rating = float(movie['rating'])
+            ratings.append(rating)
+            self._movies[rating][id(movie)] = movie
+        # Large lists are sorted with NumPy when it is installed
+        self._ratings = sort_ratings(ratings)
+        # One fraction per distinct rating rather than per movie
+        self._total = sum((Fraction(rating) * len(same_rating)
+                           for rating, same_rating in self._movies.items()),
+                          Fraction(0))
+
+    def __len__(self):
+        return len(self._ratings)
+
+    def add(self, movie):
+        """
+        Adds a movie's rating to the statistics.
+        """
+        rating = float(movie['rating'])
+        insort(self._ratings, rating)
+        self._total += Fraction(rating)
+        self._movies[rating][id(movie)] = movie
+
+    def remove(self, movie):
+        """
+        Removes a movie's rating from the statistics. Movies that aren't
+        part of them are ignored.
+        """
+        rating = float(movie['rating'])
+        same_rating = self._movies.get(rating)
+        if not same_rating or same_rating.pop(id(movie), None) is None:
+            return
+        if not same_rating:
+            del self._movies[rating]
+        del self._ratings[bisect_left(self._ratings, rating)]
+        self._total -= Fraction(rating)
+
+    def _titles(self, rating):
+        return [movie['title'] for movie in self._movies[rating].values()]
+
+    def summary(self):
+        """
+        Returns the statistics as a dictionary, for example:
+        {
+            "count": 3,
+            "average": 8.27,
+            "median": 8.4,
+            "highest": 8.5,
+            "lowest": 7.9,
+            "best": ["Alien"],
+            "worst": ["Titanic"]
+        }
+        When every movie has the same rating, "worst" is empty. An empty
+        movie list only has a count.
+        """
+        count = len(self._ratings)
+        if count == 0:
+            return {'count': 0}
+        middle = count // 2
+        if count % 2:
+            median = self._ratings[middle]
+        else:
+            median = (self._ratings[middle - 1] + self._ratings[middle]) / 2
+        highest = self._ratings[-1]
+        lowest = self._ratings[0]
+        return {'count': count,
+                'average': float(self._total / count),
+                'median': median,
+                'highest': highest,
+                'lowest': lowest,
+                'best': self._titles(highest),
+                'worst': [] if lowest == highest
+                else self._titles(lowest)}
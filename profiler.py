@@ -0,0 +1,168 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# The context returned by `phase` while profiling is off, shared so an
+# instrumented call costs one check and no allocation
+_NULL_PHASE = nullcontext()
+
+# The profile of the command being run, or None outside a profiled command,
+# per thread, so a background thread such as the menu's refresh doesn't add
+# its work to the command running meanwhile. Work that a command hands to
+# other threads is added to it through `bind`.
+_local = threading.local()
+# Whether the commands run from now on are profiled
+_enabled = False
+# The cProfile profiler and the file its data is written to, if requested
+_cprofile = None
+_output_path = None
+
+
+class Profile:
+    """
+    The time spent in the phases of a command and the counters it
+    collected.
+
+    Phases nest: the time of a save also counts as time of the command that
+    made it. Phases running on several threads at once, such as parallel
+    HTTP calls, add up their times, so a phase can take more time than the
+    command.
+    """
+
+    def __init__(self):
+        self.phases = {}  # name -> [calls, seconds]
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            entry = self.phases.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self, title, seconds):
+        """
+        Returns the phases, slowest first, and the counters as a table.
+        """
+        lines = [f'Profile of {title}: {seconds:.3f} s']
+        if self.phases:
+            lines.append(f'  {"phase":<28}{"calls":>8}{"seconds":>12}')
+            for name, (calls, total) in sorted(
+                    self.phases.items(), key=lambda item: -item[1][1]):
+                lines.append(f'  {name:<28}{calls:>8}{total:>12.3f}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'  {name:<28}{value:>20,}')
+        return '\n'.join(lines)
+
+
+def enable(output_path=None):
+    """
+    Turns profiling on for the commands run from now on.
+
+    Args:
+        output_path (str): A file to write cProfile data to after every
+        command, for `python -m pstats` or other viewers, or None.
+    """
+    global _enabled, _cprofile, _output_path
+    _enabled = True
+    if output_path is not None:
+        import cProfile
+
+        _cprofile = cProfile.Profile()
+        _output_path = output_path
+
+
+def enabled():
+    """
+    Returns whether profiling is on.
+    """
+    return _enabled
+
+
+def _active():
+    """
+    Returns the profile of the command running on this thread, or None.
+    """
+    return getattr(_local, 'profile', None)
+
+
+@contextmanager
+def _timed(profile, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_time(name, time.perf_counter() - start)
+
+
+def phase(name):
+    """
+    Returns a context that adds the time spent in it to the phase `name`
+    of the command running on this thread. Does nothing while no command
+    is profiled.
+    """
+    profile = _active()
+    if profile is None:
+        return _NULL_PHASE
+    return _timed(profile, name)
+
+
+def count(name, amount=1):
+    """
+    Adds `amount` to the counter `name` of the command running on this
+    thread. Does nothing while no command is profiled.
+    """
+    profile = _active()
+    if profile is not None:
+        profile.count(name, amount)
+
+
+def bind(function):
+    """
+    Returns a function that runs `function` as part of the command
+    profiled on the calling thread, for work handed to a pool of threads.
+    Returns `function` itself while no command is profiled.
+    """
+    profile = _active()
+    if profile is None:
+        return function
+
+    def bound(*args, **kwargs):
+        previous = _active()
+        _local.profile = profile
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.profile = previous
+
+    return bound
+
+
+@contextmanager
+def command(title):
+    """
+    Profiles a command when profiling is on: collects its phases and
+    counters and prints a summary when it ends. Commands run inside another
+    command, such as the lines of a batch, are part of its profile.
+    """
+    if not _enabled or _active() is not None:
+        yield
+        return
+    profile = _local.profile = Profile()
+    if _cprofile is not None:
+        _cprofile.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if _cprofile is not None:
+            _cprofile.disable()
+            # The data of every command so far, so the file stays complete
+            _cprofile.dump_stats(_output_path)
+        _local.profile = None
+        print(profile.summary(title, seconds))
@@ -0,0 +1,110 @@
+import math
+from bisect import bisect_left, insort
+from itertools import islice
+
+from columnar import rating_order
+
+
+class RatingIndex:
+    """
+    The movies kept in order of rating, highest first.
+
+    The order is a sorted list of (-rating, sequence number) keys, where
+    the sequence number follows library order, so movies with the same
+    rating stay in the order they were added. The list is sorted once when
+    the index is built and then kept sorted with `add` and `remove`, so
+    the best or worst movies and any page of the ranking are read without
+    sorting the library again.
+    """
+
+    def __init__(self, movies=()):
+        """
+        Args:
+            movies (iterable): The movies, in library order.
+
+        Raises:
+            ValueError: If a rating isn't a number.
+        """
+        movies = list(movies)
+        ratings = [float(movie['rating']) for movie in movies]
+        self._next_seq = len(movies)
+        self._movies = dict(enumerate(movies))  # sequence number -> movie
+        self._keys = {}  # id() of a movie record -> its key
+        self._order = []
+        for seq in rating_order(ratings):
+            key = (-ratings[seq], seq)
+            self._keys[id(movies[seq])] = key
+            self._order.append(key)
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return (self._movies[seq] for _, seq in self._order)
+
+    def add(self, movie):
+        """
+        Adds a movie after the movies already in the index with the same
+        rating.
+        """
+        key = (-float(movie['rating']), self._next_seq)
+        self._next_seq += 1
+        self._movies[key[1]] = movie
+        self._keys[id(movie)] = key
+        insort(self._order, key)
+
+    def remove(self, movie):
+        """
+        Removes a movie from the index. Movies that aren't indexed are
+        ignored.
+        """
+        key = self._keys.pop(id(movie), None)
+        if key is None:
+            return
+        del self._movies[key[1]]
+        del self._order[bisect_left(self._order, key)]
+
+    def top_k(self, k):
+        """
+        Returns the `k` movies with the highest ratings, highest first.
+        """
+        return list(islice(self, k))
+
+    def bottom_k(self, k):
+        """
+        Returns the `k` movies with the lowest ratings, lowest first.
+        Movies with the same rating are in library order.
+        """
+        k = min(k, len(self._order))
+        if k <= 0:
+            return []
+        # All the movies rated lower than the k-th lowest rating, and the
+        # first ones rated exactly that
+        threshold = self._order[-k][0]
+        start = bisect_left(self._order, (threshold,))
+        end = bisect_left(self._order, (threshold, math.inf))
+        lower = self._order[end:]
+        keys = self._order[start:start + k - len(lower)] + lower
+        keys.sort(key=lambda key: (-key[0], key[1]))
+        return [self._movies[seq] for _, seq in keys]
+
+    def page(self, number, size):
+        """
+        Returns one page of the movies sorted by rating.
+
+        Args:
+            number (int): The page number, starting at 1.
+            size (int): The number of movies per page.
+
+        Returns:
+            list: The movies of the page, empty past the last page.
+        """
+        start = (number - 1) * size
+        return [self._movies[seq]
+                for _, seq in self._order[start:start + size]]
+
+    def page_count(self, size):
+        """
+        Returns the number of pages of `size` movies.
+        """
+        return -(-len(self._order) // size)
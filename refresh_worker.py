@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+
+import profiler
+from api_client import MAX_WORKERS, RATE_LIMIT, FetchError, RateLimiter, \
+    get_client, movie_from_omdb
+from movie import FIELDS
+
+# Number of movies fetched and saved together
+BATCH_SIZE: int = 50
+# Ending of the checkpoint file kept next to the library during a refresh
+CHECKPOINT_SUFFIX: str = '.refresh'
+
+
+def data_changed(movie, fresh):
+    """
+    Returns whether the fresh OMDB data of a movie differs from the stored
+    data. The note is the user's own and isn't compared.
+    """
+    return any(movie[field] != fresh[field]
+               for field in FIELDS if field != 'note')
+
+
+class RefreshWorker:
+    """
+    Fetches the OMDB data of every movie in a library again, skipping the
+    cache, and saves the movies whose data changed, such as a new rating.
+
+    The library is refreshed in batches. The movies of a batch are fetched
+    by a pool of threads that start at most `rate_limit` calls per second,
+    and the changed ones are saved with a single write. After every batch
+    the imdbIDs done so far are recorded in a checkpoint file, so a refresh
+    that is stopped or interrupted continues where it left off. The
+    checkpoint is removed once the whole library is done.
+
+    The storage is opened with `storage_factory` on the thread the worker
+    runs on. Run in the background, the worker then has a storage of its
+    own, and its changes reach the application's storage like the changes
+    of another process.
+    """
+
+    def __init__(self, storage_factory, checkpoint_path=None, client=None,
+                 batch_size=BATCH_SIZE, max_workers=MAX_WORKERS,
+                 rate_limit=RATE_LIMIT, restart=False, verbose=False):
+        """
+        Args:
+            storage_factory (callable): Returns the IStorage to refresh.
+            checkpoint_path (str): The checkpoint file, by default the
+            storage file followed by CHECKPOINT_SUFFIX.
+            client (OmdbClient): The OMDB client, by default the shared one.
+            batch_size (int): The number of movies saved together.
+            max_workers (int): The number of parallel API calls.
+            rate_limit (float): Maximum calls per second, or None for no
+            limit.
+            restart (bool): Ignore the checkpoint of an earlier refresh and
+            refresh every movie.
+            verbose (bool): Print the progress after every batch.
+        """
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.rate_limit = rate_limit
+        self.restart = restart
+        self.verbose = verbose
+        self.total = 0
+        self.checked = 0
+        self.changed = 0
+        self.failed = 0
+        self.error = None
+        self._storage_factory = storage_factory
+        self._client = client or get_client()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read_checkpoint(self):
+        """
+        Returns the imdbIDs refreshed by an interrupted run.
+        """
+        if self.restart:
+            return set()
+        try:
+            with open(self.checkpoint_path, 'r') as handler:
+                return set(json.load(handler)['done'])
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return set()
+
+    def _write_checkpoint(self, done):
+        """
+        Records the imdbIDs refreshed so far, replacing the checkpoint file
+        atomically.
+        """
+        temp_path = f'{self.checkpoint_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as handler:
+            json.dump({'done': sorted(done)}, handler)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _fetch(self, movie, limiter):
+        """
+        Returns the OMDB data of a movie, the FetchError raised while
+        fetching it, or None if the worker was stopped first.
+        """
+        if self._stop.is_set():
+            return None
+        limiter.wait()
+        try:
+            return self._client.fetch_movie(imdb_id=movie['imdbID'],
+                                            refresh=True, save=False)
+        except FetchError as err:
+            return err
+
+    def run(self):
+        """
+        Refreshes the library on the calling thread, until every movie is
+        done or `stop` is called.
+
+        Movies that couldn't be fetched are left for the next run, and
+        movies that OMDB no longer describes completely are counted as
+        failed and left unchanged.
+
+        Returns:
+            bool: Whether every movie was refreshed. Otherwise the
+            checkpoint is kept for the next run.
+        """
+        storage = self._storage_factory()
+        if self.checkpoint_path is None:
+            self.checkpoint_path = storage.file_path + CHECKPOINT_SUFFIX
+        done = self._read_checkpoint()
+        pending = {}
+        for movie in storage.list_movies():
+            imdb_id = movie.get('imdbID')
+            if imdb_id and imdb_id not in done:
+                pending.setdefault(imdb_id, movie)
+        pending = list(pending.values())
+        self.total = len(pending)
+        self.checked = self.changed = self.failed = 0
+        limiter = RateLimiter(self.rate_limit)
+        # Part of the profile of a refresh command, but not of the menu
+        # command running while the refresh is in the background
+        fetch = profiler.bind(lambda movie: self._fetch(movie, limiter))
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for start in range(0, len(pending), self.batch_size):
+                if self._stop.is_set():
+                    return False
+                batch = pending[start:start + self.batch_size]
+                fresh_movies = []
+                for movie, result in zip(batch, executor.map(fetch, batch)):
+                    if result is None:
+                        continue
+                    if isinstance(result, FetchError):
+                        self.failed += 1
+                        continue
+                    done.add(movie['imdbID'])
+                    self.checked += 1
+                    try:
+                        fresh = movie_from_omdb(result)
+                    except (KeyError, ValueError):
+                        self.failed += 1
+                        continue
+                    if data_changed(movie, fresh):
+                        fresh_movies.append(fresh)
+                if fresh_movies:
+                    self.changed += storage.refresh_movies(fresh_movies)
+                self._client.cache.save()
+                self._write_checkpoint(done)
+                if self.verbose:
+                    print(self.progress())
+        if any(movie['imdbID'] not in done for movie in pending):
+            # The movies that couldn't be fetched are tried again next time
+            return False
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return True
+
+    def progress(self):
+        """
+        Returns a line describing how far the refresh has come.
+        """
+        return (f'{self.checked} of {self.total} movies refreshed, '
+                f'{self.changed} changed, {self.failed} failed.')
+
+    def _run_in_background(self):
+        try:
+            self.run()
+        except Exception as err:
+            self.error = err
+
+    def start(self):
+        """
+        Starts refreshing on a background thread and returns straight away.
+        """
+        self._stop.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run_in_background,
+                                        daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self):
+        """Whether the worker is refreshing on its background thread."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self, wait=True):
+        """
+        Asks the worker to stop after the movies being fetched, keeping the
+        checkpoint so a later refresh continues from there.
+
+        Args:
+            wait (bool): Wait until the background thread has stopped.
+        """
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,225 @@
+import hashlib
+import importlib.util
+import json
+import os
+import threading
+from urllib.parse import urlsplit
+
+import profiler
+from api_client import MAX_WORKERS, TIMEOUT, FetchError, create_session, \
+    get_bytes
+
+# Directory the images are downloaded to, next to the style sheet, so the
+# generated page finds them with a relative path
+ASSET_DIR: str = os.path.join('_static', 'assets')
+MANIFEST_NAME: str = 'manifest.json'
+# Extensions kept from image URLs; other images are stored as .img
+IMAGE_EXTENSIONS: tuple = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+# Pillow is only needed for thumbnails and is imported when one is made
+HAVE_PILLOW: bool = importlib.util.find_spec('PIL') is not None
+
+
+def is_remote(url):
+    """
+    Returns whether a value is an image address that can be downloaded.
+    OMDB uses "N/A" for movies without a poster.
+    """
+    return isinstance(url, str) and url.startswith(('http://', 'https://'))
+
+
+def make_thumbnail(data, width):
+    """
+    Returns the image scaled down to `width` pixels wide as JPEG bytes, or
+    None if Pillow isn't installed or can't read the image. Images that
+    are already narrow enough are returned as None too, so the original is
+    used.
+    """
+    if not HAVE_PILLOW:
+        return None
+    from io import BytesIO
+    from PIL import Image
+
+    try:
+        with Image.open(BytesIO(data)) as image:
+            if image.width <= width:
+                return None
+            height = max(1, round(image.height * width / image.width))
+            thumbnail = image.convert('RGB').resize((width, height))
+            output = BytesIO()
+            thumbnail.save(output, 'JPEG', quality=85, optimize=True)
+            return output.getvalue()
+    except (OSError, ValueError):
+        return None
+
+
+class AssetCache:
+    """
+    Local copies of the images shown on the generated page.
+
+    Images are stored under the hash of their content, so the same image
+    at several addresses is stored once, and a file never changes once it
+    is written. A manifest maps every downloaded address to its file and
+    its thumbnails, so later builds only download addresses they haven't
+    seen, and only make thumbnails of sizes they haven't made.
+
+    Downloads run on a pool of threads sharing one keep-alive session.
+    An image that can't be downloaded keeps its remote address on the
+    page and is tried again by the next build.
+    """
+
+    def __init__(self, directory=ASSET_DIR, thumbnail_width=None,
+                 max_workers=MAX_WORKERS, timeout=TIMEOUT):
+        """
+        Args:
+            directory (str): Where the images and the manifest are kept.
+            thumbnail_width (int): The width of the poster thumbnails, or
+            None to show the posters at full size.
+            max_workers (int): The number of parallel downloads.
+            timeout (tuple): Connect and read timeouts in seconds.
+        """
+        self.directory = directory
+        self.thumbnail_width = thumbnail_width
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.downloaded = 0
+        self.failed = 0
+        self._manifest_path = os.path.join(directory, MANIFEST_NAME)
+        try:
+            with open(self._manifest_path, 'r') as handler:
+                self._manifest = json.load(handler)
+        except (FileNotFoundError, ValueError):
+            self._manifest = {}
+        self._lock = threading.Lock()
+        self._session = None
+
+    def __getstate__(self):
+        # The lock and the session can't be sent to another process, such
+        # as the processes rendering the pages of a paginated site
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        state['_session'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _store(self, data, extension):
+        """
+        Writes the data under the hash of its content, unless a file with
+        that content already exists, and returns the file name.
+        """
+        name = hashlib.sha256(data).hexdigest()[:32] + extension
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            temp_path = (f'{path}.{os.getpid()}.'
+                         f'{threading.get_ident()}.tmp')
+            with open(temp_path, 'wb') as handler:
+                handler.write(data)
+            os.replace(temp_path, path)
+        return name
+
+    def _entry(self, url):
+        """
+        Returns the manifest entry of an address if its file is still on
+        disk, otherwise None.
+        """
+        entry = self._manifest.get(url)
+        if entry is None or not os.path.exists(
+                os.path.join(self.directory, entry['file'])):
+            return None
+        return entry
+
+    def _wants_thumbnail(self, entry, thumbnail):
+        return thumbnail and self.thumbnail_width and HAVE_PILLOW and \
+            str(self.thumbnail_width) not in entry.get('thumbnails', {})
+
+    def _download(self, url, thumbnail):
+        """
+        Downloads one image, or reads it from disk when only a thumbnail
+        is missing, and records it in the manifest.
+        """
+        entry = self._entry(url)
+        if entry is None:
+            try:
+                data = get_bytes(self._session, url, self.timeout)
+            except FetchError:
+                with self._lock:
+                    self.failed += 1
+                return
+            extension = os.path.splitext(urlsplit(url).path)[1].lower()
+            if extension not in IMAGE_EXTENSIONS:
+                extension = '.img'
+            entry = {'file': self._store(data, extension), 'thumbnails': {}}
+            with self._lock:
+                self.downloaded += 1
+        else:
+            with open(os.path.join(self.directory, entry['file']),
+                      'rb') as handler:
+                data = handler.read()
+        if self._wants_thumbnail(entry, thumbnail):
+            small = make_thumbnail(data, self.thumbnail_width)
+            # Images that are already small are shown as they are
+            entry['thumbnails'][str(self.thumbnail_width)] = \
+                self._store(small, '.jpg') if small else entry['file']
+        with self._lock:
+            self._manifest[url] = entry
+
+    def fetch(self, urls, thumbnail_urls=()):
+        """
+        Makes sure the images at the given addresses are on disk, in
+        parallel. Addresses that were downloaded before are skipped.
+
+        Args:
+            urls (iterable): The addresses of the images.
+            thumbnail_urls (iterable): The addresses among them that also
+            get a thumbnail, such as the posters.
+        """
+        thumbnail_urls = set(thumbnail_urls)
+        remote = [url for url in set(urls) if is_remote(url)]
+        missing = [url for url in remote
+                   if self._entry(url) is None or self._wants_thumbnail(
+                       self._entry(url), url in thumbnail_urls)]
+        profiler.count('image cache hits', len(remote) - len(missing))
+        if not missing:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self._session is None:
+            self._session = create_session()
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with profiler.phase('download images'), \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(profiler.bind(
+                lambda url: self._download(url, url in thumbnail_urls)),
+                missing))
+        self.save()
+
+    def local_url(self, url, thumbnail=False):
+        """
+        Returns the address of the local copy of an image relative to the
+        generated page, or None if there is no local copy.
+
+        Args:
+            url (str): The remote address.
+            thumbnail (bool): Prefer the thumbnail of the image.
+        """
+        entry = self._manifest.get(url)
+        if entry is None:
+            return None
+        name = entry['file']
+        if thumbnail and self.thumbnail_width:
+            name = entry.get('thumbnails', {}).get(str(self.thumbnail_width),
+                                                   name)
+        return '/'.join(self.directory.split(os.sep) + [name])
+
+    def save(self):
+        """
+        Writes the manifest atomically.
+        """
+        temp_path = f'{self._manifest_path}.{os.getpid()}.tmp'
+        with self._lock:
+            with open(temp_path, 'w') as handler:
+                json.dump(self._manifest, handler, indent=1, sort_keys=True)
+        os.replace(temp_path, self._manifest_path)
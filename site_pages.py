@@ -0,0 +1,289 @@
+import hashlib
+import json
+import math
+import os
+
+import profiler
+from country_codes import country_name, get_resolver
+from movie import FIELDS
+from website import PLACEHOLDER, TEMPLATE_PATH, fingerprint, flag_url, \
+    render_tile
+
+# Directory the pages of a paginated site are written to
+SITE_DIR: str = 'site'
+PAGE_SIZE: int = 100
+# Maps every page to the fingerprint of its content at the last build
+MANIFEST_NAME: str = 'pages.json'
+SEARCH_INDEX_NAME: str = 'search.json'
+# Change this whenever the page markup changes, so every page is written
+PAGE_VERSION: int = 1
+# The orders the movies are listed in, with the label of their link
+ORDERS: dict = {'library': 'Library', 'rating': 'By rating',
+                'year': 'By year'}
+# The fields of every movie in the search index, in order
+SEARCH_FIELDS: tuple = ('title', 'year', 'rating', 'country', 'imdbID')
+
+# The template and assets of a page rendering process, set once when the
+# process starts so they aren't sent with every page
+_worker_state = None
+
+
+def page_name(order, number):
+    """
+    Returns the file name of a page. The first page of the library is the
+    index of the site.
+    """
+    if order == 'library' and number == 1:
+        return 'index.html'
+    return f'{order}-{number}.html'
+
+
+def _number(value, number_type):
+    """
+    Returns a rating or year as a number, or None if it isn't one (such as
+    "N/A" or a year range like "2001-2003", which is read as its first
+    year).
+    """
+    try:
+        return number_type(value)
+    except (TypeError, ValueError):
+        try:
+            return number_type(str(value)[:4])
+        except ValueError:
+            return None
+
+
+def _descending(value):
+    # Sorts the highest numbers first and values that aren't numbers last
+    return (1, 0) if value is None else (0, -value)
+
+
+def order_movies(movies):
+    """
+    Returns the positions of the movies in every order of the site: the
+    library order, the best rated first and the newest first. Movies that
+    tie stay in library order.
+    """
+    positions = range(len(movies))
+    ratings = [_number(movie['rating'], float) for movie in movies]
+    years = [_number(movie['year'], int) for movie in movies]
+    return {
+        'library': list(positions),
+        'rating': sorted(positions, key=lambda i: _descending(ratings[i])),
+        'year': sorted(positions, key=lambda i: _descending(years[i])),
+    }
+
+
+def render_nav(order, number, pages, site_url):
+    """
+    Returns the HTML code of the links at the top of a page: the other
+    orders, and the previous and next pages of this one.
+
+    Args:
+        order (str): The order of the page.
+        number (int): The page number, starting at 1.
+        pages (int): The number of pages of every order.
+        site_url (str): The site directory, relative to the base of the
+        page.
+    """
+    def link(page_order, page_number, label):
+        return (f'<a href="{site_url}/{page_name(page_order, page_number)}">'
+                f'{label}</a>')
+
+    lines = ['<nav class="pages">\n', '<div class="orders">\n']
+    for other, label in ORDERS.items():
+        if other == order:
+            lines.append(f'<strong>{label}</strong>\n')
+        else:
+            lines.append(link(other, 1, label) + '\n')
+    lines.append('</div>\n<div class="page-links">\n')
+    if number > 1:
+        lines.append(link(order, number - 1, '&laquo; Previous') + '\n')
+    lines.append(f'<span>Page {number} of {pages}</span>\n')
+    if number < pages:
+        lines.append(link(order, number + 1, 'Next &raquo;') + '\n')
+    lines.append('</div>\n</nav>\n')
+    return ''.join(lines)
+
+
+def _with_nav(prefix, nav):
+    """
+    Returns the part of the template before the grid with the navigation
+    links at the start of the body.
+    """
+    head, body, rest = prefix.partition('<body>')
+    if not body:
+        return nav + prefix
+    return f'{head}{body}\n{nav}{rest}'
+
+
+def _write_atomic(path, text):
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as handler:
+        handler.write(text)
+    os.replace(temp_path, path)
+
+
+def _init_worker(prefix, suffix, assets):
+    global _worker_state
+    _worker_state = (prefix, suffix, assets)
+
+
+def _render_page(task):
+    """
+    Renders one page and writes it. Runs in a worker process.
+
+    Args:
+        task (tuple): The path of the page, its navigation links, and its
+        movies with their country codes.
+    """
+    path, nav, movies = task
+    prefix, suffix, assets = _worker_state
+    with_nav = _with_nav(prefix, nav)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as handler:
+        handler.write(with_nav)
+        for movie, country_code in movies:
+            handler.write(render_tile(movie, country_code, assets))
+        handler.write(suffix)
+    os.replace(temp_path, path)
+    return path
+
+
+def build_site(movies, page_size=PAGE_SIZE, incremental=True,
+               output_dir=SITE_DIR, template_path=TEMPLATE_PATH,
+               assets=None, max_workers=None):
+    """
+    Writes the website as pages of `page_size` movies each, in library
+    order, by rating and by year, with links between them, and a JSON
+    search index of every movie and its page in library order.
+
+    The country codes are resolved and the images downloaded once, then
+    the pages are rendered in parallel by a pool of processes. Every page
+    has a fingerprint of its content; in incremental mode the pages whose
+    fingerprint didn't change since the last build are left as they are,
+    and pages that are no longer needed are removed.
+
+    Args:
+        movies (iterable): The movies to show.
+        page_size (int): The number of movies per page.
+        incremental (bool): Only write the pages that changed.
+        output_dir (str): The directory of the pages.
+        template_path (str): The HTML template with the grid placeholder.
+        assets (AssetCache): Download the images and show the local
+        copies, or None to link to the remote images.
+        max_workers (int): The number of rendering processes, by default
+        one per CPU.
+
+    Returns:
+        int: The number of pages written.
+
+    Raises:
+        FileNotFoundError: If the template file is not found.
+        FetchError: If a country code couldn't be fetched.
+    """
+    # Plain dictionaries, which are cheap to send to other processes
+    movies = [{field: movie[field] for field in FIELDS} for movie in movies]
+    with open(template_path, "r") as handler:
+        template_str = handler.read()
+    template_digest = hashlib.sha1(template_str.encode('utf-8')).hexdigest()
+
+    country_codes = get_resolver().resolve(
+        {country_name(movie["country"]) for movie in movies})
+    codes = [country_codes[country_name(movie["country"])]
+             for movie in movies]
+    if assets is not None:
+        posters = {movie["poster"] for movie in movies}
+        flags = {flag_url(code) for code in country_codes.values()}
+        assets.fetch(posters | flags, thumbnail_urls=posters)
+
+    # Everything that goes into a tile, including where its images are
+    # shown from
+    tile_keys = []
+    for movie, code in zip(movies, codes):
+        variant = code
+        if assets is not None:
+            poster = assets.local_url(movie["poster"], thumbnail=True)
+            variant = f'{code} {poster} {assets.local_url(flag_url(code))}'
+        tile_keys.append(fingerprint(movie, variant))
+
+    # The pages link to each other and to the style sheet and images
+    # relative to the directory the program runs in
+    os.makedirs(output_dir, exist_ok=True)
+    base_url = os.path.relpath('.', output_dir).replace(os.sep, '/')
+    site_url = os.path.relpath(output_dir).replace(os.sep, '/')
+    prefix, _, suffix = template_str.partition(PLACEHOLDER)
+    head, found, rest = prefix.partition('<head>')
+    if found:
+        prefix = f'{head}{found}\n    <base href="{base_url}/">{rest}'
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r') as handler:
+            old_manifest = json.load(handler)
+    except (FileNotFoundError, ValueError):
+        old_manifest = {}
+
+    pages = max(1, math.ceil(len(movies) / page_size))
+    manifest = {}
+    tasks = []
+    for order, positions in order_movies(movies).items():
+        for number in range(1, pages + 1):
+            name = page_name(order, number)
+            path = os.path.join(output_dir, name)
+            nav = render_nav(order, number, pages, site_url)
+            chunk = positions[(number - 1) * page_size:number * page_size]
+            record = json.dumps([PAGE_VERSION, template_digest, base_url,
+                                 nav, [tile_keys[i] for i in chunk]])
+            digest = hashlib.sha1(record.encode('utf-8')).hexdigest()
+            manifest[name] = digest
+            if incremental and old_manifest.get(name) == digest and \
+                    os.path.exists(path):
+                continue
+            tasks.append((path, nav,
+                          [(movies[i], codes[i]) for i in chunk]))
+
+    profiler.count('pages written', len(tasks))
+    profiler.count('pages unchanged', len(manifest) - len(tasks))
+    workers = max_workers or os.cpu_count() or 1
+    if len(tasks) > 1 and workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Pages are sent in chunks, so each round trip to a process carries
+        # several pages
+        chunksize = max(1, len(tasks) // (4 * workers))
+        with profiler.phase('render pages'), \
+                ProcessPoolExecutor(max_workers=workers,
+                                    initializer=_init_worker,
+                                    initargs=(prefix, suffix, assets)) \
+                as executor:
+            list(executor.map(_render_page, tasks, chunksize=chunksize))
+    else:
+        _init_worker(prefix, suffix, assets)
+        with profiler.phase('render pages'):
+            for task in tasks:
+                _render_page(task)
+
+    for name in old_manifest.keys() - manifest.keys():
+        path = os.path.join(output_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    search_index = json.dumps({
+        'fields': list(SEARCH_FIELDS) + ['page'],
+        'movies': [[movie[field] for field in SEARCH_FIELDS]
+                   + [page_name('library', position // page_size + 1)]
+                   for position, movie in enumerate(movies)],
+    }, separators=(',', ':'))
+    search_path = os.path.join(output_dir, SEARCH_INDEX_NAME)
+    try:
+        with open(search_path, 'r') as handler:
+            unchanged = handler.read() == search_index
+    except FileNotFoundError:
+        unchanged = False
+    if not unchanged:
+        _write_atomic(search_path, search_index)
+
+    # Written last, so an interrupted build writes its pages again
+    _write_atomic(manifest_path, json.dumps(manifest, indent=1))
+    return len(tasks)
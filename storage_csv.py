@@ -1,31 +1,204 @@
 import json
 import csv
-import requests
-import statistics
-import random
 from istorage import IStorage
+from movie_cache import FileCache
+from api_client import get_client, movie_from_omdb, FetchError, \
+    HTTPFetchError, FetchConnectionError, FetchTimeout
+from title_index import TitleIndex
+from movie import FIELDS, Movie
+from movie_journal import apply_ops, delete_op, refresh_op, update_op
+from file_lock import VersionLock
+import profiler
 import os
-
-# OMDB API to get movie data
-API: str = 'http://www.omdbapi.com/?apikey=6f0c3bf6&t='
-# IMDB URL to redirect user to each movie IMDB page
-IMDB: str = 'https://www.imdb.com/title/'
-# The API to get country name from country code
-COUNTRY_API: str = "https://restcountries.com/v3.1/name/"
-FLAG_API: str = "https://flagsapi.com/"
+import threading
+from contextlib import contextmanager
 
 
 class StorageCsv(IStorage):
-    def __init__(self, file_path):
+    def __init__(self, file_path, client=None, interactive=True):
+        """
+        Args:
+            file_path (str): The path of the CSV file.
+            client (OmdbClient): The OMDB client, by default the shared one.
+            interactive (bool): Ask the user to pick a movie when a title
+            matches several. Otherwise the matches are only listed.
+        """
         self.file_path = file_path
+        self.interactive = interactive
+        self._client = client or get_client()
+        self._cache = FileCache(file_path, self._read_movies)
+        self._lock = VersionLock(file_path + '.lock')
+        self._generation = 0
+        self._stale = False
+        self._batching = False
+        self._batch_ops = []
+
+    def _read_movies(self):
+        """
+        Loads the movies from the CSV file, creating an empty database
+        if the file doesn't exist yet. The generation of the file is
+        recorded first, so a change published while it is being read is
+        noticed by the next write.
+        """
+        self._generation = self._lock.generation()
+        movies = []
+        if not os.path.exists(self.file_path):
+            with open(self.file_path, 'w', newline='') as handler:
+                writer = csv.writer(handler)
+                writer.writerow(["Title", "Rating", "Year"])  # Write headers
+                return movies
+
+        with profiler.phase('read'), open(self.file_path, 'r') as file:
+            reader = csv.DictReader(file)
+            for row in reader:
+                # Ratings and years are parsed once, here
+                movies.append(Movie.from_dict(row))
+            profiler.count('bytes read', os.fstat(file.fileno()).st_size)
+        return movies
+
+    def _prepare_snapshot(self, movies):
+        """
+        Writes the movies to a temporary file next to the CSV file and
+        returns its path.
+        """
+        # Storages of the same file on other threads use other names
+        temp_path = (f'{self.file_path}.{os.getpid()}.'
+                     f'{threading.get_ident()}.tmp')
+        try:
+            with profiler.phase('write'), \
+                    open(temp_path, 'w', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(movies)
+                profiler.count('bytes written', file.tell())
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return temp_path
+
+    def _write_movies(self, movies):
+        """
+        Replaces the CSV file with the given movies.
+
+        The rows are written to a temporary file that is renamed over the
+        CSV file, so a failed write never leaves a truncated database.
+        """
+        os.replace(self._prepare_snapshot(movies), self.file_path)
+
+    def _commit(self, movies, ops):
+        """
+        Publishes a change that was made to `movies` and is described by
+        the record operations `ops`, safely when other processes write the
+        same file.
+
+        The new file is prepared before taking the lock, so the lock is only
+        held for the rename. If the generation shows that another process
+        published a change since the movies were loaded, the file is loaded
+        again under the lock, the operations are applied to it and the
+        result is written instead, so neither change is lost.
+        """
+        temp_path = self._prepare_snapshot(movies)
+        try:
+            with self._lock.locked():
+                if self._lock.generation() == self._generation:
+                    os.replace(temp_path, self.file_path)
+                else:
+                    current = self._read_movies()
+                    apply_ops(current, ops)
+                    self._write_movies(current)
+                    # The working set misses the other process's changes
+                    self._stale = True
+                self._generation = self._lock.advance()
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _save_movies(self, movies, added=None, removed=None, ops=()):
+        """
+        Saves the movies to the CSV file and keeps them as the in-memory
+        working set. The movies added and removed by the change are passed
+        on so the indexes can be updated instead of rebuilt, and the
+        operations `ops` that describe the change are applied again if
+        another process changed the file meanwhile.
+        """
+        if self._batching:
+            self._batch_ops.extend(ops)
+        self._cache.store(movies, lambda data: self._commit(data, ops),
+                          added, removed)
+        if self._stale:
+            self._stale = False
+            self._cache.invalidate()
+
+    def version(self):
+        """
+        Returns a value that changes whenever the library changes. Every
+        writer advances the generation of the lock file, which also covers
+        changes too quick to show in the file's modification time.
+        """
+        return self._lock.generation(), super().version()
+
+    @contextmanager
+    def batch(self):
+        """
+        Runs a group of changes against the movies in memory and writes the
+        CSV file once when the group ends, even if it ends with an error.
+        """
+        if self._batching:
+            yield self
+            return
+        self._batching = True
+        self._batch_ops = []
+        self._cache.defer_writes()
+        try:
+            yield self
+        finally:
+            ops = self._batch_ops
+            self._batching = False
+            self._batch_ops = []
+            self._cache.flush(lambda data: self._commit(data, ops))
+            if self._stale:
+                self._stale = False
+                self._cache.invalidate()
+
+    def _title_index(self):
+        """
+        Returns the title index of the movies, built on first use.
+        """
+        return self._cache.derived('titles', TitleIndex)
+
+    def _find_targets(self, title):
+        """
+        Returns the movies that a deletion or update of `title` applies to:
+        the first movie with exactly that title if there is one, otherwise
+        all the movies whose title contains it. Movies that share a complete
+        title are changed one at a time, in library order.
+        """
+        exact_movie = self._find_exact(title)
+        if exact_movie is not None:
+            return [exact_movie]
+        return [movie for movie in self._title_index().search(title)
+                if title in movie['title']]
+
+    def _find_exact(self, title):
+        """
+        Returns the first movie with exactly the given title, or None.
+        """
+        for movie in self._title_index().exact(title):
+            if movie['title'] == title:
+                return movie
+        return None
 
     def list_movies(self):
         """
-        Returns a list of dictionaries that
-        contains the movies information in the database.
+        Returns a list of Movie records that
+        contains the movies information in the database. Fields can be
+        read like dictionary keys, and ratings and years are numbers.
 
         The function loads the information from the CSV
-        file and returns the data.
+        file the first time it is called and keeps it in memory. Later
+        calls only reload the file if it has changed on disk, so callers
+        must not modify the returned list.
 
         For example, the function may return:
         [
@@ -39,55 +212,74 @@ class StorageCsv(IStorage):
             }
         ]
         """
-        movies = []
-        if not os.path.exists(self.file_path):
-            with open(self.file_path, 'w', newline='') as handler:
-                writer = csv.writer(handler)
-                writer.writerow(["Title", "Rating", "Year"])  # Write headers
-                return movies
-
-        with open(self.file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                movies.append(row)
-        return movies
+        return self._cache.load()
 
     def add_movie(self, title):
         """
         Adds a movie to the movies' database.
-        Loads the information from the CSV file, adds the movie,
-        and saves it. The function doesn't need to validate the input.
+        Fetches the movie data through the shared OMDB client, which serves
+        movies fetched before from its cache, then adds the movie and saves
+        the CSV file. The function doesn't need to validate the input.
         """
         try:
-            response = requests.get(API + title)
-            response.raise_for_status()
-            movie_dict_data = response.json()
+            movie_dict_data = self._client.fetch_movie(title)
+            movie = movie_from_omdb(movie_dict_data)
             movies = self.list_movies()
-            movies.append({
-                'title': movie_dict_data['Title'],
-                'rating': float(movie_dict_data['imdbRating']),
-                'year': int(movie_dict_data['Year']),
-                'poster': movie_dict_data['Poster'],
-                'imdbID': movie_dict_data['imdbID'],
-                'note': '',
-                'country': movie_dict_data['Country']
-            })
-            fieldnames = movies[0].keys()
-            with open(self.file_path, 'w', newline='') as file:
-                writer = csv.DictWriter(file, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(movies)
+            movies.append(movie)
+            self._save_movies(movies, added=[movie],
+                              ops=[{'op': 'add', 'movie': movie.to_dict()}])
         except KeyError:
             print("The movie not found")
-        except requests.exceptions.HTTPError as errh:
+        except HTTPFetchError as errh:
             print("HTTP Error:", errh)
-        except requests.exceptions.ConnectionError as errc:
+        except FetchConnectionError as errc:
             print("Error Connecting:", errc)
-        except requests.exceptions.Timeout as errt:
+        except FetchTimeout as errt:
             print("Timeout Error:", errt)
-        except requests.exceptions.RequestException as err:
+        except FetchError as err:
             print("Error:", err)
 
+    def add_movies(self, titles):
+        """
+        Adds many movies to the movies' database at once.
+
+        The titles are looked up in parallel through the shared OMDB client
+        and all the movies that were found are saved to the CSV file in a
+        single write. Titles that couldn't be added are reported one by one.
+
+        Args:
+            titles (list): The titles of the movies to add.
+
+        Returns:
+            dict: Maps every title that couldn't be added to the reason.
+        """
+        failures = {}
+        new_movies = []
+        results = self._client.fetch_movies(titles)
+        for title in dict.fromkeys(titles):
+            result = results[title]
+            if isinstance(result, FetchError):
+                failures[title] = f"Error: {result}"
+                continue
+            try:
+                new_movies.append(movie_from_omdb(result))
+            except KeyError:
+                failures[title] = "The movie not found"
+            except ValueError:
+                failures[title] = "The movie data is incomplete"
+
+        if new_movies:
+            movies = self.list_movies()
+            movies.extend(new_movies)
+            self._save_movies(movies, added=new_movies,
+                              ops=[{'op': 'add', 'movie': movie.to_dict()}
+                                   for movie in new_movies])
+
+        for title, reason in failures.items():
+            print(f'"{title}": {reason}')
+        print(f'{len(new_movies)} of {len(titles)} movies added.')
+        return failures
+
     def delete_movie(self, title):
         """
         Deletes a movie from the movies' database.
@@ -109,24 +301,22 @@ class StorageCsv(IStorage):
             - If multiple movies are found with the given title, the user is
             prompted to enter the complete movie name for deletion.
 
+        Returns:
+            bool: Whether a movie was deleted.
         """
         try:
             movies = self.list_movies()
-            target_movies_for_deletion = []
-            for movie in movies:
-                if title in movie['title']:
-                    target_movies_for_deletion.append(movie)
+            target_movies_for_deletion = self._find_targets(title)
             if len(target_movies_for_deletion) == 1:
                 movies.remove(target_movies_for_deletion[0])
-                fieldnames = movies[0].keys()
-                with open(self.file_path, 'w', newline='') as file:
-                    writer = csv.DictWriter(file, fieldnames=fieldnames)
-                    writer.writeheader()
-                    writer.writerows(movies)
+                self._save_movies(movies,
+                                  removed=target_movies_for_deletion,
+                                  ops=[delete_op(
+                                      target_movies_for_deletion[0])])
                 print(
                     f'\nThe movie "{target_movies_for_deletion[0]["title"]}" '
                     f'has been removed from the movie list successfully.')
-                return
+                return True
             elif len(target_movies_for_deletion) == 0:
                 print("The movie not found")
             else:
@@ -135,20 +325,19 @@ class StorageCsv(IStorage):
                     f'found:')
                 for movie in target_movies_for_deletion:
                     print(movie['title'])
+                if not self.interactive:
+                    print('Give the complete title of one of these movies.')
+                    return False
                 new_title = input('Please enter the complete movie name: ')
-                for movie in movies:
-                    if new_title == movie['title']:
-                        movies.remove(movie)
-                        fieldnames = movie.keys()
-                        with open(self.file_path, 'w', newline='') as file:
-                            writer = csv.DictWriter(file,
-                                                    fieldnames=fieldnames)
-                            writer.writeheader()
-                            writer.writerows(movies)
-                        print(
-                            f'\nThe movie "{new_title}" has been removed from '
-                            f'the movie list successfully.')
-                        return
+                movie = self._find_exact(new_title)
+                if movie is not None:
+                    movies.remove(movie)
+                    self._save_movies(movies, removed=[movie],
+                                      ops=[delete_op(movie)])
+                    print(
+                        f'\nThe movie "{new_title}" has been removed from '
+                        f'the movie list successfully.')
+                    return True
             print(
                 f'\nError: The movie "{title}" does not exist in the '
                 f'movie list.')
@@ -158,6 +347,7 @@ class StorageCsv(IStorage):
         except Exception as e:
             print(f"An error occurred during the deletion process: {str(e)}")
             raise
+        return False
 
     def update_movie(self, title, note):
         """
@@ -169,42 +359,39 @@ class StorageCsv(IStorage):
         Args:
             title (str): The title of the movie to update.
             note (str): The note or comment to add to the movie.
+
+        Returns:
+            bool: Whether a movie was updated.
         """
         try:
             movies = self.list_movies()
-            target_movies_for_update = []
-            for movie in movies:
-                if title in movie['title']:
-                    target_movies_for_update.append(movie)
+            target_movies_for_update = self._find_targets(title)
             if len(target_movies_for_update) == 0:
                 print("The movie not found")
             elif len(target_movies_for_update) == 1:
                 target_movie = target_movies_for_update[0]
                 target_movie['note'] = note
-                fieldnames = target_movie.keys()
-                with open(self.file_path, 'w', newline='') as file:
-                    writer = csv.DictWriter(file, fieldnames=fieldnames)
-                    writer.writeheader()
-                    writer.writerows(movies)
+                # The note isn't indexed, so the indexes stay valid
+                self._save_movies(movies, added=[], removed=[],
+                                  ops=[update_op(target_movie)])
                 print(f'\nMovie "{title}" successfully updated')
-                return
+                return True
             else:
                 print(f'{len(target_movies_for_update)} movies '
                       f'with "{title}" found: ')
                 for movie in target_movies_for_update:
                     print(movie['title'])
+                if not self.interactive:
+                    print('Give the complete title of one of these movies.')
+                    return False
                 new_title = input('Please enter the complete movie name: ')
-                for movie in movies:
-                    if new_title == movie['title']:
-                        movie['note'] = note
-                        fieldnames = movie.keys()
-                        with open(self.file_path, 'w', newline='') as file:
-                            writer = csv.DictWriter(file,
-                                                    fieldnames=fieldnames)
-                            writer.writeheader()
-                            writer.writerows(movies)
-                        print(f'\nMovie "{new_title}" successfully updated')
-                        return
+                movie = self._find_exact(new_title)
+                if movie is not None:
+                    movie['note'] = note
+                    self._save_movies(movies, added=[], removed=[],
+                                      ops=[update_op(movie)])
+                    print(f'\nMovie "{new_title}" successfully updated')
+                    return True
             print(
                 f'\nError: The movie "{title}" does not exist in '
                 f'the movie list.'
@@ -213,6 +400,143 @@ class StorageCsv(IStorage):
             print("An error occurred while accessing the file.")
         except Exception as e:
             print(f"An error occurred: {str(e)}")
+        return False
+
+    def refresh_movies(self, fresh_movies):
+        """
+        Replaces the data of movies with newer data fetched from OMDB.
+
+        Every fresh movie replaces the first stored movie with the same
+        imdbID, keeping the stored note. Movies whose data didn't change
+        are left alone, and the file is written once if any did.
+
+        Args:
+            fresh_movies (list): The movie records built from the new data.
+
+        Returns:
+            int: The number of movies that changed.
+        """
+        movies = self.list_movies()
+        positions = {}
+        for index, movie in enumerate(movies):
+            if movie.get('imdbID'):
+                positions.setdefault(movie['imdbID'], index)
+        ops = []
+        for fresh in fresh_movies:
+            index = positions.get(fresh['imdbID'])
+            if index is None:
+                continue
+            fresh = Movie.from_dict(fresh)
+            fresh['note'] = movies[index]['note']
+            if fresh != movies[index]:
+                movies[index] = fresh
+                ops.append(refresh_op(fresh))
+        if ops:
+            # Ratings and titles may have changed, so the indexes are built
+            # again
+            self._save_movies(movies, ops=ops)
+        return len(ops)
+
+    def _columnar_view(self):
+        """
+        Returns the NumPy view of the movies, built on first use, or None if
+        NumPy isn't installed or the library is too small to benefit.
+        """
+        from columnar import ColumnarView, HAVE_NUMPY, MIN_ROWS
+
+        if not HAVE_NUMPY or len(self.list_movies()) < MIN_ROWS:
+            return None
+        return self._cache.derived('columns', ColumnarView)
+
+    def filter_movies(self, min_rating=None, max_rating=None, year_from=None,
+                      year_to=None, country=None):
+        """
+        Returns the movies that match every given condition, in library
+        order. Conditions left as None are ignored.
+
+        Args:
+            min_rating (float): The lowest rating to include.
+            max_rating (float): The highest rating to include.
+            year_from (int): The first release year to include.
+            year_to (int): The last release year to include.
+            country (str): The country to match.
+
+        Returns:
+            list: The matching movies.
+        """
+        from columnar import filter_movies
+
+        view = self._columnar_view()
+        if view is not None:
+            return view.filter(min_rating, max_rating, year_from, year_to,
+                               country)
+        return filter_movies(self.list_movies(), min_rating, max_rating,
+                             year_from, year_to, country)
+
+    def rating_histogram(self, bins=10):
+        """
+        Returns the number of movies per rating bucket between 0 and 10 as
+        (lower bound, upper bound, count) tuples.
+        """
+        from columnar import rating_histogram
+
+        view = self._columnar_view()
+        if view is not None:
+            return view.histogram(bins)
+        return rating_histogram(self.list_movies(), bins)
+
+    def _rating_index(self):
+        """
+        Returns the rating index of the movies, built on first use.
+        """
+        from rating_index import RatingIndex
+
+        return self._cache.derived('ratings', RatingIndex)
+
+    def sorted_movies(self, limit=None, page=1):
+        """
+        Returns the movies sorted by rating in descending order, movies
+        with the same rating in library order. Large libraries are sorted
+        by the NumPy view when NumPy is installed; otherwise the order is
+        read from the rating index, which is kept sorted as movies are
+        added and deleted.
+
+        Args:
+            limit (int): The number of movies per page, or None for all.
+            page (int): The page to return, starting at 1.
+
+        Returns:
+            list: The movies of the page.
+        """
+        view = self._columnar_view()
+        if view is not None:
+            rows = view.order_by_rating()
+            if limit is not None:
+                rows = rows[(page - 1) * limit:page * limit]
+            return [view.movies[row] for row in rows.tolist()]
+        if limit is None:
+            return list(self._rating_index())
+        return self._rating_index().page(page, limit)
+
+    def stats_summary(self):
+        """
+        Returns the rating statistics of the movies as a dictionary with
+        the count, average, median, highest and lowest rating and the best
+        and worst movies.
+
+        The ratings are parsed and the statistics computed in one pass the
+        first time, then updated as movies are added and deleted. Large
+        libraries use the NumPy view instead when NumPy is installed.
+
+        Raises:
+            ValueError: A rating in the CSV file isn't a number.
+        """
+        from movie_stats import RatingStats
+
+        view = self._columnar_view()
+        if view is not None:
+            return view.summary()
+        return self._cache.derived('stats', RatingStats).summary()
 
     def stats(self):
         """
@@ -226,22 +550,14 @@ class StorageCsv(IStorage):
 
         """
         try:
-            value_list: list = []
-            best_movie: list = []
-            worst_movie: list = []
-            movies: list = self.list_movies()
-            for movie in movies:
-                value_list.append(float(movie['rating']))
-            highest_rate: float = max(value_list)
-            lowest_rate: float = min(value_list)
-            for movie in movies:
-                if float(movie['rating']) == highest_rate:
-                    best_movie.append(movie['title'])
-                elif float(movie['rating']) == lowest_rate:
-                    worst_movie.append(movie['title'])
-
-            average_rating: float = statistics.mean(value_list)
-            median_rating: float = statistics.median(value_list)
+            summary: dict = self.stats_summary()
+            if summary['count'] == 0:
+                print("The movie list is empty.")
+                return
+            average_rating: float = summary['average']
+            median_rating: float = summary['median']
+            best_movie: list = summary['best']
+            worst_movie: list = summary['worst']
             print(f'The average movie rating is {average_rating}.')
             print(f'The median of movie ratings is {median_rating}.')
             if len(best_movie) == 1:
@@ -267,6 +583,8 @@ class StorageCsv(IStorage):
             IndexError: The movie list is empty.
 
         """
+        import random
+
         try:
             movies: list = self.list_movies()
             if len(movies) == 0:
@@ -279,41 +597,86 @@ class StorageCsv(IStorage):
             print(f"An error occurred while picking a random movie: {str(e)}")
             raise
 
+    def find_movies(self, title):
+        """
+        Returns the movies whose title contains the keyword, ignoring case,
+        in library order. The lookup uses the title index instead of
+        scanning every movie.
+
+        Args:
+            title (str): The keyword to search for in movie titles.
+
+        Returns:
+            list: The matching movies.
+        """
+        return self._title_index().search(title)
+
+    def fuzzy_search(self, title, limit=10):
+        """
+        Returns the movies whose titles are most similar to the given one,
+        best match first. Misspelled titles still find their movie.
+
+        Args:
+            title (str): The title to look for.
+            limit (int): The maximum number of results.
+
+        Returns:
+            list: (movie, score) tuples, where the score goes from 0 to 1.
+        """
+        return self._title_index().fuzzy(title, limit)
+
     def search_movie(self, title):
         """
-        Prints all movies that match the given keyword.
+        Prints all movies that match the given keyword. If there are none,
+        prints the movies with the most similar titles instead.
 
         Args:
             title (str): The keyword to search for in movie titles.
 
         """
         try:
-            movies: list = self.list_movies()
+            movies = self.find_movies(title)
             for movie in movies:
-                if title.lower() in movie['title'].lower():
-                    print(f'{movie["title"]}, {movie["rating"]}')
+                print(f'{movie["title"]}, {movie["rating"]}')
+            if not movies:
+                suggestions = self.fuzzy_search(title)
+                if suggestions:
+                    print(f'No movie contains "{title}". Did you mean:')
+                for movie, score in suggestions:
+                    print(f'{movie["title"]}, {movie["rating"]} '
+                          f'({score:.0%} match)')
         except Exception as e:
             print(f"An error occurred during the movie search: {str(e)}")
             raise
 
     # This function sorts the movie list  with descending ratings
-    def movies_sorted_by_rating(self):
+    def movies_sorted_by_rating(self, limit=None, page=1):
         """
         Prints the movies in the movie list sorted from highest to
-        lowest rating.
+        lowest rating, reading them from the rating index. With a limit,
+        only one page of that many movies is printed.
+
+        Args:
+            limit (int): The number of movies per page, or None for all.
+            page (int): The page to print, starting at 1.
+
+        Returns:
+            int: The number of pages.
 
         Raises:
             ValueError: An error occurred while sorting the movies.
 
         """
         try:
-            movies: list = self.list_movies()
-            sorted_movies: list = sorted(movies,
-                                         key=lambda item: item['rating'],
-                                         reverse=True)
-            print(f'{len(sorted_movies)} movies in total\n')
+            sorted_movies: list = self.sorted_movies(limit, page)
+            total: int = len(self.list_movies())
+            pages: int = 1 if limit is None else max(1, -(-total // limit))
+            print(f'{total} movies in total\n')
+            if limit is not None:
+                print(f'Page {page} of {pages}\n')
             for movie in sorted_movies:
                 print(f'{movie["title"]}, {movie["rating"]}')
+            return pages
         except ValueError as e:
             print(f"An error occurred while sorting the movies: {str(e)}")
             raise
@@ -327,76 +690,53 @@ class StorageCsv(IStorage):
             thumbnails.
 
         Raises:
-            requests.exceptions.RequestException: An error occurred while
-            making an API call.
+            FetchError: An error occurred while making an API call.
             json.JSONDecodeError: An error occurred while parsing the API
             response.
 
         """
+        from website import iter_tiles
+
         try:
             movies: list = self.list_movies()
-            movie_thumbnail_html: str = ''
-            for movie in movies:
-                imdb_url: str = IMDB + movie["imdbID"]
-                if 'United States' in movie["country"]:
-                    country: str = 'United States of America'
-                elif ',' in movie["country"]:
-                    country: str = movie["country"][
-                                   : movie["country"].index(',')]
-                else:
-                    country: str = movie["country"]
-                country_data_url: str = COUNTRY_API + country
-                country_raw_data = requests.get(country_data_url)
-                country_data: list = country_raw_data.json()
-                country_code: str = country_data[0]["cca2"]
-                flag_api_call: str = f'{FLAG_API}{country_code}/shiny/24.png'
-                movie_tile_template: list = [
-                    '<li>\n',
-                    '<div class = "movie">\n',
-                    f'<div class="parent">\n',
-                    f'<a href="{imdb_url}" target="blank">'
-                    f'<img class="movie-poster" '
-                    f'src="{movie["poster"]}" '
-                    f'alt="{movie["title"]} poster image" '
-                    f'title="{movie["note"]}"></a>\n',
-                    f'<img class="flag" src="{flag_api_call}">\n',
-                    '</div>\n',
-                    f'<div class="score">IMDB Rate: {movie["rating"]}</div>\n',
-                    f'<div class="movie-title">{movie["title"]}</div>\n',
-                    f'<div class="movie-year">{movie["year"]}</div>\n',
-                    '</div>\n',
-                    '</li>\n'
-                ]
-
-                for item in movie_tile_template:
-                    movie_thumbnail_html += item
-            return movie_thumbnail_html
-        except (requests.exceptions.RequestException,
-                json.JSONDecodeError) as e:
+            return ''.join(iter_tiles(movies))
+        except (FetchError, json.JSONDecodeError) as e:
             print(
                 f"An error occurred while generating movie "
                 f"thumbnails: {str(e)}")
             raise
 
-    def generate_website(self):
+    def generate_website(self, incremental=True, assets=None,
+                         page_size=None):
         """
         Generates a new webpage named "build.html" using a template and
         movie thumbnails.
 
+        Args:
+            incremental (bool): Only render the tiles of movies that changed
+            since the last build and reuse the others.
+            assets (AssetCache): Show local copies of the images.
+            page_size (int): Write a site of pages with this many movies
+            each instead of a single page.
+
         Raises:
             FileNotFoundError: The template file could not be found.
             IOError: An error occurred while reading or writing the template
             or output file.
+            FetchError: An error occurred while making an API call.
 
         """
+        from website import build_website
+
         try:
-            template_movie_grid = self.movie_thumbnail()
-            with open("./_static/index_template.html", "r") as handler:
-                template_str: str = handler.read()
-                output_str: str = template_str.replace(
-                    '__TEMPLATE_MOVIE_GRID__', f'{template_movie_grid}')
-            with open("build.html", "w") as file_output:
-                file_output.write(output_str)
+            if page_size is None:
+                build_website(self.list_movies(), incremental,
+                              assets=assets)
+            else:
+                from site_pages import build_site
+
+                build_site(self.list_movies(), page_size, incremental,
+                           assets=assets)
             print('Website was generated successfully.')
         except FileNotFoundError as e:
             print(f"An error occurred while generating the website: {str(e)}")
@@ -405,3 +745,8 @@ class StorageCsv(IStorage):
             print(
                 f"An error occurred while reading or writing files: {str(e)}")
             raise
+        except FetchError as e:
+            print(
+                f"An error occurred while generating movie "
+                f"thumbnails: {str(e)}")
+            raise
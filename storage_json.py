@@ -1,31 +1,278 @@
 from istorage import IStorage
-import requests
+from movie_cache import FileCache
+from api_client import get_client, movie_from_omdb, FetchError, \
+    HTTPFetchError, FetchConnectionError, FetchTimeout
+from title_index import TitleIndex
+from movie import Movie
+from file_lock import VersionLock
+from movie_journal import Journal, apply_ops, delete_op, refresh_op, \
+    snapshot_base, update_op
+import profiler
 import json
-import statistics
-import random
 import os
+import threading
+from contextlib import contextmanager
 
-
-# OMDB API to get movie data
-API: str = 'http://www.omdbapi.com/?apikey=6f0c3bf6&t='
-# IMDB URL to redirect user to each movie IMDB page
-IMDB: str = 'https://www.imdb.com/title/'
-# The API to get country name from country code
-COUNTRY_API: str = "https://restcountries.com/v3.1/name/"
-FLAG_API: str = "https://flagsapi.com/"
+# Number of journal entries that triggers a compaction into the JSON file
+COMPACT_THRESHOLD: int = 1000
 
 
 class StorageJson(IStorage):
-    def __init__(self, file_path):
+    def __init__(self, file_path, client=None, journal=False,
+                 compact_threshold=COMPACT_THRESHOLD, interactive=True):
+        """
+        Args:
+            file_path (str): The path of the JSON file.
+            client (OmdbClient): The OMDB client, by default the shared one.
+            journal (bool): Append changes to a journal next to the JSON
+            file instead of rewriting the whole file on every change.
+            compact_threshold (int): The number of journal entries after
+            which the journal is compacted into the JSON file.
+            interactive (bool): Ask the user to pick a movie when a title
+            matches several. Otherwise the matches are only listed.
+        """
         self.file_path = file_path
+        self.journal = journal
+        self.compact_threshold = compact_threshold
+        self.interactive = interactive
+        self._client = client or get_client()
+        self._journal = Journal(file_path + '.journal')
+        self._cache = FileCache(file_path, self._read_movies,
+                                extra_paths=(self._journal.path,))
+        self._lock = VersionLock(file_path + '.lock')
+        self._generation = 0
+        self._stale = False
+        self._batching = False
+        self._batch_ops = []
+        self._batch_snapshot = False
+
+    def _read_movies(self):
+        """
+        Loads the movies from the JSON file, creating an empty database
+        if the file doesn't exist yet, and replays the changes recorded in
+        the journal since the file was written. The generation of the file
+        is recorded first, so a change published while it is being read
+        is noticed by the next write.
+        """
+        self._generation = self._lock.generation()
+        if not os.path.exists(self.file_path):
+            # Create the file if it doesn't exist
+            with open(self.file_path, 'w') as handler:
+                handler.write(json.dumps([]))  # Write an empty dictionary
+
+        with profiler.phase('read'), open(self.file_path, 'r') as handler:
+            movies_data = handler.read()
+            movies = [Movie.from_dict(movie)
+                      for movie in json.loads(movies_data)]
+        profiler.count('bytes read', len(movies_data))
+        # The journal is replayed even when journal mode is off, so changes
+        # made in journal mode are never lost.
+        apply_ops(movies, self._journal.read(snapshot_base(self.file_path)))
+        return movies
+
+    def _prepare_snapshot(self, movies):
+        """
+        Serializes the movies to a temporary file next to the JSON file,
+        flushed to disk, and returns its path.
+        """
+        with profiler.phase('serialize'):
+            json_object = json.dumps([movie.to_dict() for movie in movies],
+                                     indent=4)  # Serializing json
+        # Storages of the same file on other threads use other names
+        temp_path = (f'{self.file_path}.{os.getpid()}.'
+                     f'{threading.get_ident()}.tmp')
+        with profiler.phase('write'), open(temp_path, "w") as outfile:
+            outfile.write(json_object)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        profiler.count('bytes written', len(json_object))
+        return temp_path
+
+    def _publish_snapshot(self, temp_path):
+        """
+        Renames a prepared snapshot over the JSON file and empties the
+        journal, whose changes are now part of the file.
+        """
+        os.replace(temp_path, self.file_path)
+        self._journal.clear()
+
+    def _write_movies(self, movies):
+        """
+        Serializes the movies and replaces the JSON file with them.
+
+        The data is written to a temporary file that is flushed to disk and
+        then renamed over the JSON file, so a crash never leaves a
+        half-written database. The journal is emptied afterwards because
+        its changes are now part of the file.
+        """
+        self._publish_snapshot(self._prepare_snapshot(movies))
+
+    def _append_journal(self, movies, ops):
+        """
+        Appends the operations to the journal, and compacts the journal into
+        the JSON file once it holds `compact_threshold` entries.
+        """
+        self._journal.append(ops, snapshot_base(self.file_path))
+        if self._journal.entries >= self.compact_threshold:
+            self._write_movies(movies)
+
+    def _commit(self, movies, ops, snapshot=False):
+        """
+        Publishes a change that was made to `movies` and is described by
+        the record operations `ops`, safely when other processes write the
+        same file.
+
+        The new snapshot is prepared before taking the lock, so the lock is
+        only held for the rename. If the generation shows that another
+        process published a change since the movies were loaded, the file
+        is loaded again under the lock, the operations are applied to it
+        and the result is written instead, so neither change is lost.
+
+        Args:
+            movies (list): The movies with the change applied.
+            ops (list): The operations that describe the change.
+            snapshot (bool): Write the whole file even in journal mode.
+        """
+        use_journal = self.journal and not snapshot
+        temp_path = None if use_journal else self._prepare_snapshot(movies)
+        try:
+            with self._lock.locked():
+                if self._lock.generation() == self._generation:
+                    if use_journal:
+                        self._append_journal(movies, ops)
+                    else:
+                        self._publish_snapshot(temp_path)
+                        temp_path = None
+                else:
+                    current = self._read_movies()
+                    apply_ops(current, ops)
+                    if use_journal:
+                        self._append_journal(current, ops)
+                    else:
+                        self._write_movies(current)
+                    # The working set misses the other process's changes
+                    self._stale = True
+                self._generation = self._lock.advance()
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _store(self, movies, ops, added=None, removed=None, snapshot=False):
+        """
+        Keeps the movies as the working set and publishes the change with
+        `_commit`. A working set that had to be merged with changes made
+        by another process is loaded again on the next read.
+        """
+        self._cache.store(
+            movies, lambda data: self._commit(data, ops, snapshot),
+            added, removed)
+        if self._stale:
+            self._stale = False
+            self._cache.invalidate()
+
+    def _save_movies(self, movies, added=None, removed=None, ops=None):
+        """
+        Saves the movies to the JSON file and keeps them as the in-memory
+        working set. The movies added and removed by the change are passed
+        on so the indexes can be updated instead of rebuilt.
+
+        In journal mode only the operations `ops` that describe the change
+        are appended to the journal. The operations are also what is
+        applied again when another process changed the file meanwhile.
+
+        Inside `batch`, nothing is written yet; the operations are collected
+        for the single write at the end of the batch.
+        """
+        if self._batching:
+            if ops is None:
+                # The change can't be journaled, so the batch ends with a
+                # full write
+                self._batch_snapshot = True
+            self._batch_ops.extend(ops or [])
+        self._store(movies, ops or [], added, removed, snapshot=ops is None)
+
+    def compact(self):
+        """
+        Writes all the changes recorded in the journal into the JSON file
+        and empties the journal.
+        """
+        self._save_movies(self.list_movies(), [], [])
+
+    def version(self):
+        """
+        Returns a value that changes whenever the library changes. Every
+        writer advances the generation of the lock file, which also covers
+        changes too quick to show in the file's modification time.
+        """
+        return self._lock.generation(), super().version()
+
+    @contextmanager
+    def batch(self):
+        """
+        Runs a group of changes against the movies in memory and saves them
+        with a single write when the group ends, even if it ends with an
+        error. In journal mode the operations of the whole group are
+        appended to the journal at once; otherwise the JSON file is written
+        once.
+        """
+        if self._batching:
+            yield self
+            return
+        self._batching = True
+        self._batch_ops = []
+        self._batch_snapshot = False
+        self._cache.defer_writes()
+        try:
+            yield self
+        finally:
+            ops = self._batch_ops
+            snapshot = self._batch_snapshot
+            self._batching = False
+            self._batch_ops = []
+            self._cache.flush(
+                lambda data: self._commit(data, ops, snapshot))
+            if self._stale:
+                self._stale = False
+                self._cache.invalidate()
+
+    def _title_index(self):
+        """
+        Returns the title index of the movies, built on first use.
+        """
+        return self._cache.derived('titles', TitleIndex)
+
+    def _find_targets(self, title):
+        """
+        Returns the movies that a deletion or update of `title` applies to:
+        the first movie with exactly that title if there is one, otherwise
+        all the movies whose title contains it. Movies that share a complete
+        title are changed one at a time, in library order.
+        """
+        exact_movie = self._find_exact(title)
+        if exact_movie is not None:
+            return [exact_movie]
+        return [movie for movie in self._title_index().search(title)
+                if title in movie['title']]
+
+    def _find_exact(self, title):
+        """
+        Returns the first movie with exactly the given title, or None.
+        """
+        for movie in self._title_index().exact(title):
+            if movie['title'] == title:
+                return movie
+        return None
 
     def list_movies(self):
         """
-        Returns a list of dictionaries that
-        contains the movies information in the database.
+        Returns a list of Movie records that
+        contains the movies information in the database. Fields can be
+        read like dictionary keys, and ratings and years are numbers.
 
         The function loads the information from the JSON
-        file and returns the data.
+        file the first time it is called and keeps it in memory. Later
+        calls only reload the file if it has changed on disk, so callers
+        must not modify the returned list.
 
         For example, the function may return:
         {
@@ -38,47 +285,74 @@ class StorageJson(IStorage):
             },
         }
         """
-        if not os.path.exists(self.file_path):
-            # Create the file if it doesn't exist
-            with open(self.file_path, 'w') as handler:
-                handler.write(json.dumps([]))  # Write an empty dictionary
-
-        with open(self.file_path, 'r') as handler:
-            movies_data = handler.read()
-            movies = json.loads(movies_data)
-        return movies
+        return self._cache.load()
 
     def add_movie(self, title):
         """
         Adds a movie to the movies' database.
-        Loads the information from the JSON file, add the movie,
-        and saves it. The function doesn't need to validate the input.
+        Fetches the movie data through the shared OMDB client, which serves
+        movies fetched before from its cache, then adds the movie and saves
+        the database. The function doesn't need to validate the input.
         """
         try:
-            response = requests.get(API + title)
-            response.raise_for_status()
-            movie_dict_data = json.loads(response.text)
+            movie_dict_data = self._client.fetch_movie(title)
+            movie = movie_from_omdb(movie_dict_data)
             movies = self.list_movies()
-            movies.append({'title': movie_dict_data['Title'],
-                           'rating': float(movie_dict_data['imdbRating']),
-                           'year': int(movie_dict_data['Year']),
-                           'poster': movie_dict_data['Poster'],
-                           'imdbID': movie_dict_data['imdbID'], 'note': '',
-                           'country': movie_dict_data['Country']})
-            json_object = json.dumps(movies, indent=4)  # Serializing json
-            with open(self.file_path, "w") as outfile:  # Writing to movie.json
-                outfile.write(json_object)
+            movies.append(movie)
+            self._save_movies(movies, added=[movie],
+                              ops=[{'op': 'add', 'movie': movie.to_dict()}])
         except KeyError:
             print("The movie not found")
-        except requests.exceptions.HTTPError as errh:
+        except HTTPFetchError as errh:
             print("HTTP Error:", errh)
-        except requests.exceptions.ConnectionError as errc:
+        except FetchConnectionError as errc:
             print("Error Connecting:", errc)
-        except requests.exceptions.Timeout as errt:
+        except FetchTimeout as errt:
             print("Timeout Error:", errt)
-        except requests.exceptions.RequestException as err:
+        except FetchError as err:
             print("Error:", err)
 
+    def add_movies(self, titles):
+        """
+        Adds many movies to the movies' database at once.
+
+        The titles are looked up in parallel through the shared OMDB client
+        and all the movies that were found are saved to the database in a
+        single write. Titles that couldn't be added are reported one by one.
+
+        Args:
+            titles (list): The titles of the movies to add.
+
+        Returns:
+            dict: Maps every title that couldn't be added to the reason.
+        """
+        failures = {}
+        new_movies = []
+        results = self._client.fetch_movies(titles)
+        for title in dict.fromkeys(titles):
+            result = results[title]
+            if isinstance(result, FetchError):
+                failures[title] = f"Error: {result}"
+                continue
+            try:
+                new_movies.append(movie_from_omdb(result))
+            except KeyError:
+                failures[title] = "The movie not found"
+            except ValueError:
+                failures[title] = "The movie data is incomplete"
+
+        if new_movies:
+            movies = self.list_movies()
+            movies.extend(new_movies)
+            self._save_movies(movies, added=new_movies,
+                              ops=[{'op': 'add', 'movie': movie.to_dict()}
+                                   for movie in new_movies])
+
+        for title, reason in failures.items():
+            print(f'"{title}": {reason}')
+        print(f'{len(new_movies)} of {len(titles)} movies added.')
+        return failures
+
     def delete_movie(self, title):
         """
         Deletes a movie from the movies' database.
@@ -100,25 +374,22 @@ class StorageJson(IStorage):
             IOError: If there is an error reading or writing the JSON file.
 
         Returns:
-            None
+            bool: Whether a movie was deleted.
         """
         try:
             movies = self.list_movies()
-            target_movies_for_deletion = []
-            for movie in movies:
-                if title in movie['title']:
-                    target_movies_for_deletion.append(movie)
+            target_movies_for_deletion = self._find_targets(title)
 
             if len(target_movies_for_deletion) == 1:  # If only one movie found
                 movies.remove(target_movies_for_deletion[0])
-                json_object = json.dumps(movies, indent=4)  # Serializing json
-                with open(self.file_path,
-                          "w") as outfile:  # Writing to movie.json
-                    outfile.write(json_object)
+                self._save_movies(movies,
+                                  removed=target_movies_for_deletion,
+                                  ops=[delete_op(
+                                      target_movies_for_deletion[0])])
                 print(
                     f'\nThe movie "{target_movies_for_deletion[0]["title"]}" '
                     f'has been removed from the movie list successfully.')
-                return
+                return True
 
             elif len(target_movies_for_deletion) == 0:  # If no movie found
                 print("The movie was not found.")
@@ -128,19 +399,19 @@ class StorageJson(IStorage):
                       f'with "{title}" found: ')
                 for movie in target_movies_for_deletion:
                     print(movie['title'])
+                if not self.interactive:
+                    print('Give the complete title of one of these movies.')
+                    return False
                 new_title = input('Please enter the complete movie name: ')
-                for movie in movies:
-                    if new_title == movie['title']:
-                        movies.remove(movie)
-                        json_object = json.dumps(movies,
-                                                 indent=4)  # Serializing json
-                        with open(self.file_path,
-                                  "w") as outfile:  # Writing to movie.json
-                            outfile.write(json_object)
-                        print(
-                            f'\nThe movie "{new_title}" has been removed from '
-                            f'the movie list successfully.')
-                        return
+                movie = self._find_exact(new_title)
+                if movie is not None:
+                    movies.remove(movie)
+                    self._save_movies(movies, removed=[movie],
+                                      ops=[delete_op(movie)])
+                    print(
+                        f'\nThe movie "{new_title}" has been removed from '
+                        f'the movie list successfully.')
+                    return True
 
             print(f'\nError: The movie "{title}" does not exist '
                   f'in the movie list.')
@@ -159,6 +430,7 @@ class StorageJson(IStorage):
         except IOError:
             print(
                 "Error: There was an error reading or writing the JSON file.")
+        return False
 
     def update_movie(self, title, note):
         """
@@ -182,46 +454,40 @@ class StorageJson(IStorage):
             IOError: If there is an error reading or writing the JSON file.
 
         Returns:
-            None
+            bool: Whether a movie was updated.
         """
         try:
             movies = self.list_movies()
-            target_movies_for_update = []
-            for movie in movies:
-                if title in movie['title']:
-                    target_movies_for_update.append(movie)
+            target_movies_for_update = self._find_targets(title)
 
             if len(target_movies_for_update) == 0:  # If no movie found
                 print("The movie was not found.")
 
             elif len(target_movies_for_update) == 1:  # If only one movie found
-                val_list = list(target_movies_for_update[0].values())
-                for movie in movies:
-                    if list(movie.values()) == val_list:
-                        movie['note'] = note
-                json_object = json.dumps(movies, indent=4)  # Serializing json
-                with open(self.file_path,
-                          "w") as outfile:  # Writing to movie.json
-                    outfile.write(json_object)
+                target_movies_for_update[0]['note'] = note
+                # The note isn't indexed, so the indexes stay valid
+                self._save_movies(movies, added=[], removed=[],
+                                  ops=[update_op(
+                                      target_movies_for_update[0])])
                 print(f'\nMovie "{title}" successfully updated.')
-                return
+                return True
 
             else:  # If multiple movies found
                 print(f'{len(target_movies_for_update)} movies '
                       f'with "{title}" found: ')
                 for movie in target_movies_for_update:
                     print(movie['title'])
+                if not self.interactive:
+                    print('Give the complete title of one of these movies.')
+                    return False
                 new_title = input('Please enter the complete movie name: ')
-                for movie in movies:
-                    if new_title == movie['title']:
-                        movie['note'] = note
-                        json_object = json.dumps(movies,
-                                                 indent=4)  # Serializing json
-                        with open(self.file_path,
-                                  "w") as outfile:  # Writing to movie.json
-                            outfile.write(json_object)
-                        print(f'\nMovie "{new_title}" successfully updated.')
-                        return
+                movie = self._find_exact(new_title)
+                if movie is not None:
+                    movie['note'] = note
+                    self._save_movies(movies, added=[], removed=[],
+                                      ops=[update_op(movie)])
+                    print(f'\nMovie "{new_title}" successfully updated.')
+                    return True
 
             print(f'\nError: The movie "{title}" does not exist '
                   f'in the movie list.')
@@ -240,6 +506,141 @@ class StorageJson(IStorage):
         except IOError:
             print(
                 "Error: There was an error reading or writing the JSON file.")
+        return False
+
+    def refresh_movies(self, fresh_movies):
+        """
+        Replaces the data of movies with newer data fetched from OMDB.
+
+        Every fresh movie replaces the first stored movie with the same
+        imdbID, keeping the stored note. Movies whose data didn't change
+        are left alone, and the file is written once if any did.
+
+        Args:
+            fresh_movies (list): The movie records built from the new data.
+
+        Returns:
+            int: The number of movies that changed.
+        """
+        movies = self.list_movies()
+        positions = {}
+        for index, movie in enumerate(movies):
+            if movie.get('imdbID'):
+                positions.setdefault(movie['imdbID'], index)
+        ops = []
+        for fresh in fresh_movies:
+            index = positions.get(fresh['imdbID'])
+            if index is None:
+                continue
+            fresh = Movie.from_dict(fresh)
+            fresh['note'] = movies[index]['note']
+            if fresh != movies[index]:
+                movies[index] = fresh
+                ops.append(refresh_op(fresh))
+        if ops:
+            # Ratings and titles may have changed, so the indexes are built
+            # again
+            self._save_movies(movies, ops=ops)
+        return len(ops)
+
+    def _columnar_view(self):
+        """
+        Returns the NumPy view of the movies, built on first use, or None if
+        NumPy isn't installed or the library is too small to benefit.
+        """
+        from columnar import ColumnarView, HAVE_NUMPY, MIN_ROWS
+
+        if not HAVE_NUMPY or len(self.list_movies()) < MIN_ROWS:
+            return None
+        return self._cache.derived('columns', ColumnarView)
+
+    def filter_movies(self, min_rating=None, max_rating=None, year_from=None,
+                      year_to=None, country=None):
+        """
+        Returns the movies that match every given condition, in library
+        order. Conditions left as None are ignored.
+
+        Args:
+            min_rating (float): The lowest rating to include.
+            max_rating (float): The highest rating to include.
+            year_from (int): The first release year to include.
+            year_to (int): The last release year to include.
+            country (str): The country to match.
+
+        Returns:
+            list: The matching movies.
+        """
+        from columnar import filter_movies
+
+        view = self._columnar_view()
+        if view is not None:
+            return view.filter(min_rating, max_rating, year_from, year_to,
+                               country)
+        return filter_movies(self.list_movies(), min_rating, max_rating,
+                             year_from, year_to, country)
+
+    def rating_histogram(self, bins=10):
+        """
+        Returns the number of movies per rating bucket between 0 and 10 as
+        (lower bound, upper bound, count) tuples.
+        """
+        from columnar import rating_histogram
+
+        view = self._columnar_view()
+        if view is not None:
+            return view.histogram(bins)
+        return rating_histogram(self.list_movies(), bins)
+
+    def _rating_index(self):
+        """
+        Returns the rating index of the movies, built on first use.
+        """
+        from rating_index import RatingIndex
+
+        return self._cache.derived('ratings', RatingIndex)
+
+    def sorted_movies(self, limit=None, page=1):
+        """
+        Returns the movies sorted by rating in descending order, movies
+        with the same rating in library order. Large libraries are sorted
+        by the NumPy view when NumPy is installed; otherwise the order is
+        read from the rating index, which is kept sorted as movies are
+        added and deleted.
+
+        Args:
+            limit (int): The number of movies per page, or None for all.
+            page (int): The page to return, starting at 1.
+
+        Returns:
+            list: The movies of the page.
+        """
+        view = self._columnar_view()
+        if view is not None:
+            rows = view.order_by_rating()
+            if limit is not None:
+                rows = rows[(page - 1) * limit:page * limit]
+            return [view.movies[row] for row in rows.tolist()]
+        if limit is None:
+            return list(self._rating_index())
+        return self._rating_index().page(page, limit)
+
+    def stats_summary(self):
+        """
+        Returns the rating statistics of the movies as a dictionary with
+        the count, average, median, highest and lowest rating and the best
+        and worst movies.
+
+        The statistics are computed in one pass the first time and then
+        updated as movies are added and deleted, so later calls don't walk
+        the movie list. Large libraries use the NumPy view instead when
+        NumPy is installed.
+        """
+        from movie_stats import RatingStats
+
+        view = self._columnar_view()
+        if view is not None:
+            return view.summary()
+        return self._cache.derived('stats', RatingStats).summary()
 
     # Function to report statistical information
     def stats(self):
@@ -264,23 +665,14 @@ class StorageJson(IStorage):
             None
         """
         try:
-            value_list = []
-            best_movie = []
-            worst_movie = []
-            movies = self.list_movies()
-            for movie in movies:
-                value_list.append(movie['rating'])
-
-            highest_rate = max(value_list)
-            lowest_rate = min(value_list)
-            for movie in movies:
-                if movie['rating'] == highest_rate:
-                    best_movie.append(movie['title'])
-                elif movie['rating'] == lowest_rate:
-                    worst_movie.append(movie['title'])
-
-            average_rating = statistics.mean(value_list)
-            median_rating = statistics.median(value_list)
+            summary = self.stats_summary()
+            if summary['count'] == 0:
+                print("The movie list is empty.")
+                return
+            average_rating = summary['average']
+            median_rating = summary['median']
+            best_movie = summary['best']
+            worst_movie = summary['worst']
 
             print(f'The average movie rating is {average_rating}.')
             print(f'The median movie rating is {median_rating}.')
@@ -319,6 +711,8 @@ class StorageJson(IStorage):
         Returns:
             None
         """
+        import random
+
         try:
             movies = self.list_movies()
             movie = random.choice(movies)
@@ -338,6 +732,34 @@ class StorageJson(IStorage):
         except IOError:
             print("Error: There was an error reading the JSON file.")
 
+    def find_movies(self, title):
+        """
+        Returns the movies whose title contains the keyword, ignoring case,
+        in library order. The lookup uses the title index instead of
+        scanning every movie.
+
+        Args:
+            title (str): The keyword to search for in movie titles.
+
+        Returns:
+            list: The matching movies.
+        """
+        return self._title_index().search(title)
+
+    def fuzzy_search(self, title, limit=10):
+        """
+        Returns the movies whose titles are most similar to the given one,
+        best match first. Misspelled titles still find their movie.
+
+        Args:
+            title (str): The title to look for.
+            limit (int): The maximum number of results.
+
+        Returns:
+            list: (movie, score) tuples, where the score goes from 0 to 1.
+        """
+        return self._title_index().fuzzy(title, limit)
+
     # This function allows user to search for a movie by using a keyword
     def search_movie(self, title):
         """
@@ -346,6 +768,8 @@ class StorageJson(IStorage):
         This function takes a movie title keyword as input from the user and
         searches for all the movies in the list that contain the keyword.
         It prints the title and rating of each matching movie in the terminal.
+        If no title contains the keyword, the closest titles are suggested
+        instead, best match first.
 
         Args:
             title (str): The keyword to search for in movie titles.
@@ -354,10 +778,16 @@ class StorageJson(IStorage):
             None
         """
         try:
-            movies = self.list_movies()
+            movies = self.find_movies(title)
             for movie in movies:
-                if title.lower() in movie['title'].lower():
-                    print(f'{movie["title"]}, {movie["rating"]}')
+                print(f'{movie["title"]}, {movie["rating"]}')
+            if not movies:
+                suggestions = self.fuzzy_search(title)
+                if suggestions:
+                    print(f'No movie contains "{title}". Did you mean:')
+                for movie, score in suggestions:
+                    print(f'{movie["title"]}, {movie["rating"]} '
+                          f'({score:.0%} match)')
 
         except FileNotFoundError:
             print("Error: The JSON file was not found.")
@@ -372,25 +802,33 @@ class StorageJson(IStorage):
             print("Error: There was an error reading the JSON file.")
 
     # This function sorts the movie list  with descending ratings
-    def movies_sorted_by_rating(self):
+    def movies_sorted_by_rating(self, limit=None, page=1):
         """
         Sorts and prints the movies in the movie list by rating in
         descending order.
 
-        This function retrieves the movies from the list, sorts them based on
-        their rating in descending order, and then prints the sorted list in
-        the terminal. Each movie is displayed with its title and rating.
+        This function reads the movies from the rating index, which is
+        already sorted, and prints them in the terminal. Each movie is
+        displayed with its title and rating. With a limit, only one page of
+        that many movies is printed.
+
+        Args:
+            limit (int): The number of movies per page, or None for all.
+            page (int): The page to print, starting at 1.
 
         Returns:
-            None
+            int: The number of pages.
         """
         try:
-            movies = self.list_movies()
-            sorted_movies = sorted(movies, key=lambda item: item['rating'],
-                                   reverse=True)
-            print(f'{len(sorted_movies)} movies in total\n')
+            sorted_movies = self.sorted_movies(limit, page)
+            total = len(self.list_movies())
+            pages = 1 if limit is None else max(1, -(-total // limit))
+            print(f'{total} movies in total\n')
+            if limit is not None:
+                print(f'Page {page} of {pages}\n')
             for movie in sorted_movies:
                 print(f'{movie["title"]}, {movie["rating"]}')
+            return pages
 
         except FileNotFoundError:
             print("Error: The JSON file was not found.")
@@ -409,52 +847,21 @@ class StorageJson(IStorage):
         """
         Generates HTML code for movie thumbnails using API data.
 
-        This function retrieves the movie data from the list, calls an API
-        to get the full country name from the country code, and generates HTML
-        code for each movie thumbnail. The movie thumbnail includes the movie
-        poster, IMDb rating, title, year, and flag representing the movie's
-        country.
+        This function retrieves the movie data from the list, resolves the
+        code of every distinct country once through the shared country
+        resolver (which caches codes in memory and on disk), and renders the
+        HTML code of each movie thumbnail with `website.render_tile`. The
+        movie thumbnail includes the movie poster, IMDb rating, title, year,
+        and flag representing the movie's country.
 
         Returns:
             movie_thumbnail_html (str): HTML code for the movie thumbnails.
         """
+        from website import iter_tiles
+
         try:
             movies = self.list_movies()
-            movie_thumbnail_html = ''
-            for movie in movies:
-                imdb_url = IMDB + movie["imdbID"]
-                if 'United States' in movie["country"]:
-                    country = 'United States of America'
-                elif ',' in movie["country"]:
-                    country = movie["country"][:movie["country"].index(',')]
-                else:
-                    country = movie["country"]
-                country_data_url = COUNTRY_API + country
-                country_raw_data = requests.get(country_data_url)
-                country_data = country_raw_data.json()
-                country_code = country_data[0]["cca2"]
-                flag_api_call = f'{FLAG_API}{country_code}/shiny/24.png'
-                movie_tile_template = [
-                    '<li>\n',
-                    '<div class="movie">\n',
-                    f'<div class="parent">\n',
-                    f'<a href="{imdb_url}" target="blank">'
-                    f'<img class="movie-poster" '
-                    f'src="{movie["poster"]}" '
-                    f'alt="{movie["title"]} poster image" '
-                    f'title="{movie["note"]}"></a>\n',
-                    f'<img class="flag" src="{flag_api_call}">\n',
-                    '</div>\n',
-                    f'<div class="score"> IMDB Rate: {movie["rating"]}</div>\n',
-                    f'<div class="movie-title">{movie["title"]}</div>\n',
-                    f'<div class="movie-year">{movie["year"]}</div>\n',
-                    '</div>\n',
-                    '</li>\n'
-                ]
-
-                for item in movie_tile_template:
-                    movie_thumbnail_html += item
-            return movie_thumbnail_html
+            return ''.join(iter_tiles(movies))
 
         except FileNotFoundError:
             print("Error: The JSON file was not found.")
@@ -465,7 +872,7 @@ class StorageJson(IStorage):
         except json.JSONDecodeError:
             print("Error: The JSON file contains invalid data.")
 
-        except requests.exceptions.RequestException:
+        except FetchError:
             print("Error: Failed to connect to the API or retrieve data.")
 
         except KeyError:
@@ -475,14 +882,22 @@ class StorageJson(IStorage):
             print("Error: Country data not found for a movie.")
 
     # This function generate a html webpage
-    def generate_website(self):
+    def generate_website(self, incremental=True, assets=None,
+                         page_size=None):
         """
         Generates a new webpage by incorporating movie thumbnails into a template.
 
-        This function calls the `movie_thumbnail()` function to generate HTML code
-        for movie thumbnails. It then includes the generated HTML code in a
+        This function renders the movie thumbnails and includes them in a
         template file named `index_template.html` to create a new webpage named
         `build.html`. The webpage represents a grid of movie thumbnails.
+        In incremental mode, only the thumbnails of movies that changed since
+        the last build are rendered again; the others are reused.
+
+        Args:
+            incremental (bool): Reuse the thumbnails of unchanged movies.
+            assets (AssetCache): Show local copies of the images.
+            page_size (int): Write a site of pages with this many movies
+            each instead of a single page.
 
         Returns:
             None
@@ -491,14 +906,17 @@ class StorageJson(IStorage):
             FileNotFoundError: If the template file `index_template.html` is not found.
             PermissionError: If permission is denied while accessing the files.
         """
+        from website import build_website
+
         try:
-            template_movie_grid = self.movie_thumbnail()
-            with open("./_static/index_template.html", "r") as handler:
-                template_str = handler.read()
-                output_str = template_str.replace('__TEMPLATE_MOVIE_GRID__',
-                                                  f'{template_movie_grid}')
-            with open("build.html", "w") as file_output:
-                file_output.write(output_str)
+            if page_size is None:
+                build_website(self.list_movies(), incremental,
+                              assets=assets)
+            else:
+                from site_pages import build_site
+
+                build_site(self.list_movies(), page_size, incremental,
+                           assets=assets)
             print('Website was generated successfully.')
 
         except FileNotFoundError:
@@ -507,3 +925,12 @@ class StorageJson(IStorage):
 
         except PermissionError:
             print("Error: Permission denied while accessing the files.")
+
+        except FetchError:
+            print("Error: Failed to connect to the API or retrieve data.")
+
+        except KeyError:
+            print("Error: Invalid data format received from the API.")
+
+        except IndexError:
+            print("Error: Country data not found for a movie.")
@@ -0,0 +1,666 @@
+from istorage import IStorage
+from api_client import get_client, movie_from_omdb, FetchError, \
+    HTTPFetchError, FetchConnectionError, FetchTimeout
+from movie import Movie
+from file_lock import VersionLock
+from movie_journal import delete_op, refresh_op, stream_ops, update_op
+import profiler
+import heapq
+import json
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from fractions import Fraction
+
+
+class MovieStream:
+    """
+    The movies of a JSON Lines library as an iterable that reads the file
+    again every time it is iterated, so it can be passed to code that goes
+    over the movies more than once without holding them in memory.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def __iter__(self):
+        return self._storage.iter_movies()
+
+
+class StorageJsonl(IStorage):
+    """
+    Stores the movies in a JSON Lines file, one JSON object per line.
+
+    Nothing is kept in memory: every read streams the file one line at a
+    time, so listing, searching, the statistics and the website produce
+    their first results straight away and use the same memory for any size
+    of library. Adding movies appends lines to the end of the file, while
+    deletions, updates and refreshes stream the file through the change
+    into a temporary file that replaces it.
+
+    Every change is made while holding the library's lock, to the latest
+    version of the file, so several processes can share a library.
+    """
+
+    def __init__(self, file_path, client=None, interactive=True):
+        """
+        Args:
+            file_path (str): The path of the JSON Lines file.
+            client (OmdbClient): The OMDB client, by default the shared one.
+            interactive (bool): Ask the user to pick a movie when a title
+            matches several. Otherwise the matches are only listed.
+        """
+        self.file_path = file_path
+        self.interactive = interactive
+        self._client = client or get_client()
+        self._lock = VersionLock(file_path + '.lock')
+        self._batching = False
+        self._batch_ops = []
+
+    def _read_movies(self):
+        """
+        Yields the movies stored in the file, creating an empty file if it
+        doesn't exist yet. A last line cut short by a crash is skipped.
+        """
+        if not os.path.exists(self.file_path):
+            open(self.file_path, 'a').close()
+        with open(self.file_path, 'r', encoding='utf-8') as handler:
+            profiler.count('bytes read', os.fstat(handler.fileno()).st_size)
+            for line in handler:
+                if not line.endswith('\n'):
+                    break
+                if line.strip():
+                    yield Movie.from_dict(json.loads(line))
+
+    def iter_movies(self):
+        """
+        Yields the movies one by one as they are read from the file, in
+        library order. Inside `batch`, the changes that aren't written yet
+        are applied on the way.
+        """
+        if self._batch_ops:
+            return stream_ops(self._read_movies(), list(self._batch_ops))
+        return self._read_movies()
+
+    def list_movies(self):
+        """
+        Returns a list of Movie records with the movies information in the
+        database. Prefer `iter_movies`, which doesn't read the whole file
+        into memory first.
+        """
+        return list(self.iter_movies())
+
+    def _append(self, ops):
+        """
+        Appends the movies added by the operations to the end of the file.
+        Must be called while holding the lock. A last line cut short by a
+        crash is removed first.
+        """
+        data = b''.join((json.dumps(op['movie']) + '\n').encode('utf-8')
+                        for op in ops)
+        with profiler.phase('write'), open(self.file_path, 'ab+') as handler:
+            size = handler.seek(0, os.SEEK_END)
+            if size:
+                handler.seek(size - 1)
+                if handler.read(1) != b'\n':
+                    handler.seek(0)
+                    content = handler.read()
+                    handler.truncate(content.rfind(b'\n') + 1)
+            handler.write(data)
+            handler.flush()
+            os.fsync(handler.fileno())
+        profiler.count('bytes written', len(data))
+
+    def _rewrite(self, ops):
+        """
+        Streams the file through the operations into a temporary file,
+        flushed to disk, and renames it over the file. Must be called
+        while holding the lock.
+        """
+        temp_path = (f'{self.file_path}.{os.getpid()}.'
+                     f'{threading.get_ident()}.tmp')
+        try:
+            with profiler.phase('write'), \
+                    open(temp_path, 'w', encoding='utf-8') as handler:
+                for movie in stream_ops(self._read_movies(), ops):
+                    handler.write(json.dumps(movie.to_dict()) + '\n')
+                handler.flush()
+                os.fsync(handler.fileno())
+                profiler.count('bytes written', handler.tell())
+            os.replace(temp_path, self.file_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _commit(self, ops):
+        """
+        Writes the record operations `ops` to the file under the lock:
+        additions are appended, and any other change rewrites the file.
+        """
+        if not ops:
+            return
+        with self._lock.locked():
+            if not os.path.exists(self.file_path):
+                open(self.file_path, 'a').close()
+            if all(op['op'] == 'add' for op in ops):
+                self._append(ops)
+            else:
+                self._rewrite(ops)
+            self._lock.advance()
+
+    def _save(self, ops):
+        """
+        Saves a change described by record operations, or keeps it for the
+        single write at the end of the current batch.
+        """
+        if self._batching:
+            self._batch_ops.extend(ops)
+        else:
+            self._commit(ops)
+
+    def version(self):
+        """
+        Returns a value that changes whenever the library changes. Every
+        writer advances the generation of the lock file, which also covers
+        changes too quick to show in the file's modification time.
+        """
+        return self._lock.generation(), super().version()
+
+    @contextmanager
+    def batch(self):
+        """
+        Runs a group of changes and writes them all at once when the group
+        ends, even if it ends with an error. Reads inside the group see the
+        changes made so far.
+        """
+        if self._batching:
+            yield self
+            return
+        self._batching = True
+        self._batch_ops = []
+        try:
+            yield self
+        finally:
+            ops = self._batch_ops
+            self._batching = False
+            self._batch_ops = []
+            self._commit(ops)
+
+    def add_movie(self, title):
+        """
+        Adds a movie to the movies' database by appending one line to the
+        file. Fetches the movie data through the shared OMDB client, which
+        serves movies fetched before from its cache. The function doesn't
+        need to validate the input.
+        """
+        try:
+            movie_dict_data = self._client.fetch_movie(title)
+            movie = movie_from_omdb(movie_dict_data)
+            self._save([{'op': 'add', 'movie': movie.to_dict()}])
+        except KeyError:
+            print("The movie not found")
+        except HTTPFetchError as errh:
+            print("HTTP Error:", errh)
+        except FetchConnectionError as errc:
+            print("Error Connecting:", errc)
+        except FetchTimeout as errt:
+            print("Timeout Error:", errt)
+        except FetchError as err:
+            print("Error:", err)
+
+    def add_movies(self, titles):
+        """
+        Adds many movies to the movies' database at once.
+
+        The titles are looked up in parallel through the shared OMDB client
+        and all the movies that were found are appended to the file in a
+        single write. Titles that couldn't be added are reported one by one.
+
+        Args:
+            titles (list): The titles of the movies to add.
+
+        Returns:
+            dict: Maps every title that couldn't be added to the reason.
+        """
+        failures = {}
+        new_movies = []
+        results = self._client.fetch_movies(titles)
+        for title in dict.fromkeys(titles):
+            result = results[title]
+            if isinstance(result, FetchError):
+                failures[title] = f"Error: {result}"
+                continue
+            try:
+                new_movies.append(movie_from_omdb(result))
+            except KeyError:
+                failures[title] = "The movie not found"
+            except ValueError:
+                failures[title] = "The movie data is incomplete"
+
+        self._save([{'op': 'add', 'movie': movie.to_dict()}
+                    for movie in new_movies])
+
+        for title, reason in failures.items():
+            print(f'"{title}": {reason}')
+        print(f'{len(new_movies)} of {len(titles)} movies added.')
+        return failures
+
+    def _find_targets(self, title):
+        """
+        Returns the movies that a deletion or update of `title` applies to:
+        the first movie with exactly that title if there is one, otherwise
+        all the movies whose title contains it. Movies that share a complete
+        title are changed one at a time, in library order. The file is read
+        at most once.
+        """
+        containing = []
+        for movie in self.iter_movies():
+            if movie['title'] == title:
+                return [movie]
+            if title in movie['title']:
+                containing.append(movie)
+        return containing
+
+    def _pick_target(self, title, targets):
+        """
+        Returns the single movie a deletion or update of `title` applies
+        to. When several movies match, the user is asked for the complete
+        title; when the storage isn't interactive, the matches are only
+        listed. Returns None if no single movie was chosen.
+        """
+        if not targets:
+            print("The movie was not found.")
+            return None
+        if len(targets) == 1:
+            return targets[0]
+        print(f'{len(targets)} movies with "{title}" found: ')
+        for movie in targets:
+            print(movie['title'])
+        if not self.interactive:
+            print('Give the complete title of one of these movies.')
+            return None
+        new_title = input('Please enter the complete movie name: ')
+        for movie in self._find_targets(new_title):
+            if movie['title'] == new_title:
+                return movie
+        print(f'\nError: The movie "{title}" does not exist '
+              f'in the movie list.')
+        return None
+
+    def delete_movie(self, title):
+        """
+        Deletes a movie from the movies' database.
+
+        The movies matching the title are looked up while streaming the
+        file, and if there are several the user is prompted to enter the
+        complete movie name. The file is then rewritten without the movie.
+
+        Args:
+            title (str): The title of the movie to delete.
+
+        Returns:
+            bool: Whether a movie was deleted.
+        """
+        try:
+            movie = self._pick_target(title, self._find_targets(title))
+            if movie is None:
+                return False
+            self._save([delete_op(movie)])
+            print(f'\nThe movie "{movie["title"]}" has been removed from '
+                  f'the movie list successfully.')
+            return True
+        except ValueError:
+            print("Error: The JSON Lines file contains invalid data.")
+        except IOError:
+            print("Error: There was an error reading or writing the "
+                  "JSON Lines file.")
+        return False
+
+    def update_movie(self, title, note):
+        """
+        Updates the note of a movie in the movies' database.
+
+        The movie is looked up the same way as in `delete_movie`.
+
+        Args:
+            title (str): The title of the movie to update.
+            note (str): The new note for the movie.
+
+        Returns:
+            bool: Whether a movie was updated.
+        """
+        try:
+            movie = self._pick_target(title, self._find_targets(title))
+            if movie is None:
+                return False
+            movie['note'] = note
+            self._save([update_op(movie)])
+            print(f'\nMovie "{movie["title"]}" successfully updated.')
+            return True
+        except ValueError:
+            print("Error: The JSON Lines file contains invalid data.")
+        except IOError:
+            print("Error: There was an error reading or writing the "
+                  "JSON Lines file.")
+        return False
+
+    def refresh_movies(self, fresh_movies):
+        """
+        Replaces the data of movies with newer data fetched from OMDB.
+
+        Every fresh movie replaces the first stored movie with the same
+        imdbID, keeping the stored note. Movies whose data didn't change
+        are left alone, and the file is rewritten once if any did.
+
+        Args:
+            fresh_movies (list): The movie records built from the new data.
+
+        Returns:
+            int: The number of movies that changed.
+        """
+        fresh_by_id = {movie['imdbID']: movie for movie in fresh_movies}
+        ops = []
+        for movie in self.iter_movies():
+            fresh = fresh_by_id.pop(movie.get('imdbID'), None)
+            if fresh is None:
+                continue
+            fresh = Movie.from_dict(fresh)
+            fresh['note'] = movie['note']
+            if fresh != movie:
+                ops.append(refresh_op(fresh))
+            if not fresh_by_id:
+                break
+        self._save(ops)
+        return len(ops)
+
+    def filter_movies(self, min_rating=None, max_rating=None, year_from=None,
+                      year_to=None, country=None):
+        """
+        Returns the movies that match every given condition, in library
+        order. Conditions left as None are ignored. Only the matching
+        movies are kept in memory.
+        """
+        from columnar import filter_movies
+
+        return filter_movies(self.iter_movies(), min_rating, max_rating,
+                             year_from, year_to, country)
+
+    def rating_histogram(self, bins=10):
+        """
+        Returns the number of movies per rating bucket between 0 and 10 as
+        (lower bound, upper bound, count) tuples.
+        """
+        from columnar import rating_histogram
+
+        return rating_histogram(self.iter_movies(), bins)
+
+    def sorted_movies(self, limit=None, page=1):
+        """
+        Returns the movies sorted by rating in descending order, movies
+        with the same rating in library order. For one page only the
+        movies up to the end of that page are kept while streaming.
+
+        Args:
+            limit (int): The number of movies per page, or None for all.
+            page (int): The page to return, starting at 1.
+
+        Returns:
+            list: The movies of the page.
+        """
+        ranked = ((-float(movie['rating']), position, movie)
+                  for position, movie in enumerate(self.iter_movies()))
+        if limit is None:
+            return [movie for _, _, movie in sorted(ranked)]
+        best = heapq.nsmallest(page * limit, ranked,
+                               key=lambda item: item[:2])
+        return [movie for _, _, movie in best[(page - 1) * limit:]]
+
+    def stats_summary(self):
+        """
+        Returns the rating statistics of the movies as a dictionary with
+        the count, average, median, highest and lowest rating and the best
+        and worst movies, in the same form as RatingStats.summary.
+
+        The file is streamed once. Only the number of movies with each
+        rating, for the median, and the titles of the best and worst movies
+        are kept, so the memory used doesn't grow with the file: ratings
+        have one decimal, so there are at most a hundred of them.
+        """
+        counts = Counter()
+        best_rating = worst_rating = None
+        best = []
+        worst = []
+        for movie in self.iter_movies():
+            rating = float(movie['rating'])
+            if best_rating is None or rating > best_rating:
+                best_rating, best = rating, []
+            if worst_rating is None or rating < worst_rating:
+                worst_rating, worst = rating, []
+            if rating == best_rating:
+                best.append(movie['title'])
+            if rating == worst_rating:
+                worst.append(movie['title'])
+            counts[rating] += 1
+        count = sum(counts.values())
+        if count == 0:
+            return {'count': 0}
+        # Exact, so the average is the same as RatingStats gives
+        total = sum(Fraction(rating) * number
+                    for rating, number in counts.items())
+        # The ratings in the middle of the sorted list, the same one when
+        # the count is odd
+        low = high = None
+        seen = 0
+        for rating in sorted(counts):
+            seen += counts[rating]
+            if low is None and seen > (count - 1) // 2:
+                low = rating
+            if seen > count // 2:
+                high = rating
+                break
+        median = high if count % 2 else (low + high) / 2
+        return {'count': count,
+                'average': float(total / count),
+                'median': median,
+                'highest': best_rating,
+                'lowest': worst_rating,
+                'best': best,
+                'worst': [] if best_rating == worst_rating else worst}
+
+    def stats(self):
+        """
+        Prints the average and median rating and the best and worst movies.
+        """
+        try:
+            summary = self.stats_summary()
+            if summary['count'] == 0:
+                print("The movie list is empty.")
+                return
+            print(f'The average movie rating is {summary["average"]}.')
+            print(f'The median movie rating is {summary["median"]}.')
+
+            best_movie = summary['best']
+            if len(best_movie) == 1:
+                print(f'The best movie is: {best_movie[0]}.')
+            else:
+                print(f'The best movies are: {", ".join(best_movie)}')
+
+            worst_movie = summary['worst']
+            if len(worst_movie) == 1:
+                print(f'The worst movie is: {worst_movie[0]}.')
+            else:
+                print(f'The worst movies are: {", ".join(worst_movie)}')
+
+        except ValueError:
+            print("Error: The JSON Lines file contains invalid data.")
+        except IOError:
+            print("Error: There was an error reading the JSON Lines file.")
+
+    def random_movie(self) -> None:
+        """
+        Prints a randomly selected movie. The movie is picked by reservoir
+        sampling while streaming the file, so the movies aren't collected
+        in memory first.
+        """
+        import random
+
+        try:
+            chosen = None
+            for count, movie in enumerate(self.iter_movies(), 1):
+                if random.randrange(count) == 0:
+                    chosen = movie
+            if chosen is None:
+                print("The movie list is empty.")
+                return
+            print(f'Your random movie is "{chosen["title"]}" with '
+                  f'rating {chosen["rating"]}')
+        except ValueError:
+            print("Error: The JSON Lines file contains invalid data.")
+        except IOError:
+            print("Error: There was an error reading the JSON Lines file.")
+
+    def iter_found_movies(self, title):
+        """
+        Yields the movies whose title contains the keyword, ignoring case,
+        as they are read from the file.
+        """
+        query = title.casefold()
+        return (movie for movie in self.iter_movies()
+                if query in movie['title'].casefold())
+
+    def find_movies(self, title):
+        """
+        Returns the movies whose title contains the keyword, ignoring case,
+        in library order.
+        """
+        return list(self.iter_found_movies(title))
+
+    def fuzzy_search(self, title, limit=10, min_score=0.5):
+        """
+        Returns the movies whose titles are most similar to the given one,
+        best match first, as (movie, score) tuples. Only the best `limit`
+        matches are kept while streaming.
+        """
+        from difflib import SequenceMatcher
+
+        matcher = SequenceMatcher(b=title.casefold(), autojunk=False)
+        best = []
+        for position, movie in enumerate(self.iter_movies()):
+            matcher.set_seq1(movie['title'].casefold())
+            if matcher.real_quick_ratio() < min_score or \
+                    matcher.quick_ratio() < min_score:
+                continue
+            score = matcher.ratio()
+            if score < min_score:
+                continue
+            entry = (score, -position, movie)
+            if len(best) < limit:
+                heapq.heappush(best, entry)
+            elif entry[:2] > best[0][:2]:
+                heapq.heapreplace(best, entry)
+        best.sort(key=lambda entry: entry[:2], reverse=True)
+        return [(movie, round(score, 3)) for score, _, movie in best]
+
+    def search_movie(self, title):
+        """
+        Prints the title and rating of every movie whose title contains the
+        keyword, as soon as it is read. If no title contains the keyword,
+        the closest titles are suggested instead, best match first.
+        """
+        try:
+            found = False
+            for movie in self.iter_found_movies(title):
+                found = True
+                print(f'{movie["title"]}, {movie["rating"]}')
+            if not found:
+                suggestions = self.fuzzy_search(title)
+                if suggestions:
+                    print(f'No movie contains "{title}". Did you mean:')
+                for movie, score in suggestions:
+                    print(f'{movie["title"]}, {movie["rating"]} '
+                          f'({score:.0%} match)')
+        except ValueError:
+            print("Error: The JSON Lines file contains invalid data.")
+        except IOError:
+            print("Error: There was an error reading the JSON Lines file.")
+
+    def movies_sorted_by_rating(self, limit=None, page=1):
+        """
+        Prints the movies sorted by rating in descending order, with their
+        title and rating. With a limit, only one page of that many movies
+        is printed.
+
+        Args:
+            limit (int): The number of movies per page, or None for all.
+            page (int): The page to print, starting at 1.
+
+        Returns:
+            int: The number of pages.
+        """
+        try:
+            sorted_movies = self.sorted_movies(limit, page)
+            total = sum(1 for _ in self.iter_movies())
+            pages = 1 if limit is None else max(1, -(-total // limit))
+            print(f'{total} movies in total\n')
+            if limit is not None:
+                print(f'Page {page} of {pages}\n')
+            for movie in sorted_movies:
+                print(f'{movie["title"]}, {movie["rating"]}')
+            return pages
+        except ValueError:
+            print("Error: The JSON Lines file contains invalid data.")
+        except IOError:
+            print("Error: There was an error reading the JSON Lines file.")
+
+    def movie_thumbnail(self):
+        """
+        Returns the HTML code of the movie thumbnails, rendered with
+        `website.iter_tiles` from the streamed movies.
+        """
+        from website import iter_tiles
+
+        try:
+            return ''.join(iter_tiles(MovieStream(self)))
+        except ValueError:
+            print("Error: The JSON Lines file contains invalid data.")
+        except FetchError:
+            print("Error: Failed to connect to the API or retrieve data.")
+        except KeyError:
+            print("Error: Invalid data format received from the API.")
+
+    def generate_website(self, incremental=True, assets=None,
+                         page_size=None):
+        """
+        Generates the web page with the grid of movie thumbnails. The
+        movies are streamed from the file while the page is streamed to
+        disk, so neither is held in memory.
+
+        Args:
+            incremental (bool): Reuse the thumbnails of unchanged movies.
+            assets (AssetCache): Show local copies of the images.
+            page_size (int): Write a site of pages with this many movies
+            each instead of a single page.
+        """
+        from website import build_website
+
+        try:
+            if page_size is None:
+                build_website(MovieStream(self), incremental,
+                              assets=assets)
+            else:
+                from site_pages import build_site
+
+                build_site(MovieStream(self), page_size, incremental,
+                           assets=assets)
+            print('Website was generated successfully.')
+        except FileNotFoundError:
+            print(
+                "Error: The template file 'index_template.html' was not "
+                "found.")
+        except PermissionError:
+            print("Error: Permission denied while accessing the files.")
+        except FetchError:
+            print("Error: Failed to connect to the API or retrieve data.")
+        except KeyError:
+            print("Error: Invalid data format received from the API.")
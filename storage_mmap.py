@@ -0,0 +1,651 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import uuid
+
+import profiler
+from storage_json import StorageJson
+from movie_cache import FileCache
+from movie import Movie
+from file_lock import VersionLock
+from movie_journal import apply_ops, delete_op, update_op
+
+# Extension of the library files of this format
+EXTENSION: str = '.mlib'
+# Header of every index file: a magic string and the id of the data file
+# the index belongs to
+HEADER: struct.Struct = struct.Struct('<8s16s')
+MAGIC: bytes = b'MOVIEIX1'
+# An entry of the offset index: where a record starts and its length in
+# bytes, 0 for a deleted record
+SLOT: struct.Struct = struct.Struct('<QI')
+# An entry of a key index: the hash of the key and the slot of the record.
+# The entries are sorted.
+KEY: struct.Struct = struct.Struct('<QI')
+# Endings of the index files next to the data file
+INDEX_SUFFIXES: dict = {'slots': '.idx', 'imdbID': '.ids',
+                        'title': '.titles'}
+# Dead records are dropped from the data file once they are this share of
+# all records
+COMPACT_RATIO: float = 0.5
+# Random slots tried by random_movie before it lists the live ones
+RANDOM_TRIES: int = 32
+
+
+def key_hash(text):
+    """
+    Returns the 64 bit hash under which a key is stored in a key index.
+    Titles are case folded first, so the index also finds titles written
+    with other capitals.
+    """
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def title_hash(title):
+    return key_hash(title.casefold())
+
+
+def encode_record(movie):
+    """
+    Returns a movie as one line of JSON, ready to be written to the data
+    file.
+    """
+    return (json.dumps(movie.to_dict()) + '\n').encode('utf-8')
+
+
+def write_library(file_path, movies):
+    """
+    Writes the movies as a new library: the data file and its indexes are
+    written to temporary files, flushed to disk and renamed over the old
+    ones. Readers that see a new data file with old indexes, or the other
+    way around, notice it from the data file id and wait for the writer.
+
+    This is also how libraries in other formats are converted, and how
+    the dead records are dropped.
+    """
+    data_id = uuid.uuid4().bytes
+    header = HEADER.pack(MAGIC, data_id)
+    data = [(json.dumps({'format': 'movie-mmap', 'id': data_id.hex()})
+             + '\n').encode('ascii')]
+    slots = []
+    keys = {'imdbID': [], 'title': []}
+    offset = len(data[0])
+    for slot, movie in enumerate(movies):
+        record = encode_record(movie)
+        data.append(record)
+        slots.append(SLOT.pack(offset, len(record)))
+        offset += len(record)
+        if movie.get('imdbID'):
+            keys['imdbID'].append((key_hash(movie['imdbID']), slot))
+        keys['title'].append((title_hash(movie['title']), slot))
+
+    contents = {file_path: b''.join(data),
+                file_path + INDEX_SUFFIXES['slots']:
+                    header + b''.join(slots)}
+    for name, entries in keys.items():
+        entries.sort()
+        contents[file_path + INDEX_SUFFIXES[name]] = header + b''.join(
+            KEY.pack(*entry) for entry in entries)
+    temp_paths = {}
+    try:
+        for path, content in contents.items():
+            temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            temp_paths[path] = temp_path
+            with open(temp_path, 'wb') as handler:
+                handler.write(content)
+                handler.flush()
+                os.fsync(handler.fileno())
+            profiler.count('bytes written', len(content))
+        for path, temp_path in temp_paths.items():
+            os.replace(temp_path, path)
+    finally:
+        for temp_path in temp_paths.values():
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def convert_library(movies, target_path):
+    """
+    Writes movies loaded from a library in another format, such as JSON or
+    CSV, as a new library of this format, holding the library's lock.
+    """
+    lock = VersionLock(target_path + '.lock')
+    with lock.locked(), profiler.phase('write'):
+        # SQLite rows are dictionaries
+        write_library(target_path,
+                      [Movie.from_dict(movie) for movie in movies])
+        lock.advance()
+
+
+class StaleIndexError(Exception):
+    """Raised when the index files don't belong to the data file."""
+
+
+class MappedLibrary:
+    """
+    A read-only, memory-mapped view of one version of a library.
+
+    The offset index holds one fixed-width entry per record, so record
+    number n is found without reading the records before it. The key
+    indexes are sorted arrays of (hash, slot) entries that are searched by
+    bisection. Only the records that are asked for are read and parsed.
+
+    Slots are numbered in the order the records were added. A deleted
+    record leaves an empty slot until the library is compacted.
+    """
+
+    def __init__(self, file_path):
+        """
+        Raises:
+            StaleIndexError: If the indexes belong to another version of
+            the data file, which happens while a writer replaces them.
+        """
+        self._maps = {}
+        try:
+            with open(file_path, 'rb') as handler:
+                header = json.loads(handler.readline())
+                self._maps['data'] = mmap.mmap(handler.fileno(), 0,
+                                               access=mmap.ACCESS_READ)
+            data_id = bytes.fromhex(header['id'])
+            for name, suffix in INDEX_SUFFIXES.items():
+                with open(file_path + suffix, 'rb') as handler:
+                    index = mmap.mmap(handler.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+                self._maps[name] = index
+                if index[:HEADER.size] != HEADER.pack(MAGIC, data_id):
+                    raise StaleIndexError(file_path + suffix)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+
+    def __len__(self):
+        """The number of slots, deleted records included."""
+        return (len(self._maps['slots']) - HEADER.size) // SLOT.size
+
+    def _entry(self, slot):
+        return SLOT.unpack_from(self._maps['slots'],
+                                HEADER.size + slot * SLOT.size)
+
+    def is_live(self, slot):
+        """Whether the slot holds a record that wasn't deleted."""
+        return 0 <= slot < len(self) and self._entry(slot)[1] > 0
+
+    def record(self, slot):
+        """
+        Returns the movie in a slot, or None if the slot is empty or out
+        of range.
+        """
+        if not 0 <= slot < len(self):
+            return None
+        offset, length = self._entry(slot)
+        if not length:
+            return None
+        data = self._maps['data'][offset:offset + length]
+        return Movie.from_dict(json.loads(data))
+
+    def live_slots(self):
+        """Returns the slots of every record that wasn't deleted."""
+        slots = self._maps['slots']
+        return [slot for slot, (_, length) in enumerate(
+            SLOT.iter_unpack(slots[HEADER.size:])) if length]
+
+    def live_bytes(self):
+        """Returns the size of the records that weren't deleted."""
+        slots = self._maps['slots']
+        return sum(length
+                   for _, length in SLOT.iter_unpack(slots[HEADER.size:]))
+
+    def records(self):
+        """Returns every movie that wasn't deleted, in slot order."""
+        data = self._maps['data']
+        return [Movie.from_dict(json.loads(data[offset:offset + length]))
+                for offset, length in SLOT.iter_unpack(
+                    self._maps['slots'][HEADER.size:]) if length]
+
+    def header(self):
+        """Returns the header that the index files of this version share."""
+        return self._maps['slots'][:HEADER.size]
+
+    def key_entries(self, name):
+        """Returns the raw entries of a key index, without the header."""
+        return self._maps[name][HEADER.size:]
+
+    def slots_for(self, name, key):
+        """
+        Returns the live slots stored under a key in a key index, in slot
+        order. Different keys can share a hash, so callers check the
+        records they read.
+        """
+        index = self._maps[name]
+        target = key_hash(key) if name == 'imdbID' else title_hash(key)
+        low, high = 0, (len(index) - HEADER.size) // KEY.size
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(index, HEADER.size
+                               + middle * KEY.size)[0] < target:
+                low = middle + 1
+            else:
+                high = middle
+        slots = []
+        for position in range(low, (len(index) - HEADER.size) // KEY.size):
+            found, slot = KEY.unpack_from(index,
+                                          HEADER.size + position * KEY.size)
+            if found != target:
+                break
+            if self.is_live(slot):
+                slots.append(slot)
+        return slots
+
+    def data_size(self):
+        return len(self._maps['data'])
+
+
+def insert_keys(entries, new_entries):
+    """
+    Returns the raw entries of a key index with new (hash, slot) entries
+    inserted in order. The existing entries are copied as bytes, not
+    decoded, so adding a few keys to a large index stays cheap.
+    """
+    count = len(entries) // KEY.size
+    chunks = []
+    start = 0
+    for entry in sorted(new_entries):
+        low, high = start, count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(entries, middle * KEY.size) < entry:
+                low = middle + 1
+            else:
+                high = middle
+        chunks.append(entries[start * KEY.size:low * KEY.size])
+        chunks.append(KEY.pack(*entry))
+        start = low
+    chunks.append(entries[start * KEY.size:])
+    return b''.join(chunks)
+
+
+class StorageMmap(StorageJson):
+    """
+    Stores the movies in a line-delimited data file with fixed-width
+    index files that are memory-mapped.
+
+    The data file holds one JSON record per line after a header line. Next
+    to it, the offset index (.idx) has one entry per record with its
+    position in the data file, and the key indexes (.ids and .titles) map
+    the hashes of imdbIDs and case folded titles to records. A random
+    movie, a movie by imdbID or by position, and a deletion or update of an
+    exact title read only the records they need, without loading the
+    library.
+
+    Changes are appended to the data file and recorded in the indexes; a
+    changed record is written again at the end and the old copy is left as
+    a dead record. Once dead records make up COMPACT_RATIO of the data
+    file, the library is written again without them.
+
+    Commands that need every movie, such as listing, statistics, searches
+    by part of a title and the website, load the library once and keep it
+    in memory like StorageJson, whose methods they share.
+    """
+
+    def __init__(self, file_path, client=None, interactive=True):
+        """
+        Args:
+            file_path (str): The path of the data file.
+            client (OmdbClient): The OMDB client, by default the shared one.
+            interactive (bool): Ask the user to pick a movie when a title
+            matches several. Otherwise the matches are only listed.
+        """
+        super().__init__(file_path, client, journal=False,
+                         interactive=interactive)
+        self._index_path = file_path + INDEX_SUFFIXES['slots']
+        # Changes are recorded in the index files rather than a journal
+        self._cache = FileCache(file_path, self._read_movies,
+                                extra_paths=(self._index_path,))
+        self._mapped = None
+        self._mapped_signature = None
+
+    def _signature(self):
+        signature = []
+        for path in (self.file_path, self._index_path):
+            stat = os.stat(path)
+            signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def _library(self):
+        """
+        Returns the memory-mapped view of the current version of the files,
+        creating an empty library if there is none. The view is kept until
+        the files change.
+        """
+        if not os.path.exists(self._index_path):
+            with self._lock.locked():
+                if not os.path.exists(self._index_path):
+                    write_library(self.file_path, [])
+        signature = self._signature()
+        if self._mapped is not None and signature == self._mapped_signature:
+            return self._mapped
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+        try:
+            mapped = MappedLibrary(self.file_path)
+        except StaleIndexError:
+            # A writer is replacing the files; they are complete once it
+            # releases the lock
+            with self._lock.locked():
+                signature = self._signature()
+                mapped = MappedLibrary(self.file_path)
+        self._mapped = mapped
+        self._mapped_signature = signature
+        return mapped
+
+    def _read_movies(self):
+        """
+        Loads every movie from the data file, in the order they were added.
+        The generation of the library is recorded first, so a change
+        published while it is being read is noticed by the next write.
+        """
+        self._generation = self._lock.generation()
+        library = self._library()
+        with profiler.phase('read'):
+            movies = library.records()
+        profiler.count('bytes read', library.data_size())
+        return movies
+
+    def _apply_to_files(self, ops):
+        """
+        Applies record operations to the files. Must be called while
+        holding the lock.
+
+        New and changed records are appended to the data file and flushed
+        before the indexes point to them, so an interrupted write leaves at
+        most some unused bytes at the end of the data file.
+        """
+        library = self._library()
+        slot_count = len(library)
+        appended = []  # encoded records to append
+        new_slots = []  # (offset, length) of the slots to add
+        patches = {}  # slot -> new (offset, length)
+        new_keys = {'imdbID': [], 'title': []}
+        current = {}  # slot -> movie as changed by earlier operations
+        offset = library.data_size()
+
+        def append(movie):
+            nonlocal offset
+            record = encode_record(movie)
+            appended.append(record)
+            offset += len(record)
+            return offset - len(record), len(record)
+
+        def find(op):
+            # The first live record with the title (or the imdbID for a
+            # refresh), taking earlier operations of this write into account
+            if op['op'] == 'refresh':
+                candidates = library.slots_for('imdbID', op['imdbID'])
+            else:
+                candidates = library.slots_for('title', op['title'])
+            candidates += [slot for slot in current if slot >= slot_count]
+            for slot in sorted(set(candidates)):
+                movie = current.get(slot) or library.record(slot)
+                if movie is None or slot in patches and not patches[slot][1]:
+                    continue
+                if op['op'] == 'refresh':
+                    if movie.get('imdbID') == op['imdbID']:
+                        return slot, movie
+                elif movie['title'] == op['title'] and \
+                        movie.get('imdbID') == op.get('imdbID'):
+                    return slot, movie
+            return None, None
+
+        for op in ops:
+            if op['op'] == 'add':
+                movie = Movie.from_dict(op['movie'])
+                slot = slot_count + len(new_slots)
+                new_slots.append(append(movie))
+                current[slot] = movie
+                if movie.get('imdbID'):
+                    new_keys['imdbID'].append((key_hash(movie['imdbID']),
+                                               slot))
+                new_keys['title'].append((title_hash(movie['title']), slot))
+                continue
+            slot, movie = find(op)
+            if slot is None:
+                continue
+            if op['op'] == 'delete':
+                entry = (0, 0)
+                current.pop(slot, None)
+            else:
+                if op['op'] == 'update':
+                    movie = Movie.from_dict(movie)
+                    movie['note'] = op['note']
+                else:
+                    fresh = Movie.from_dict(op['movie'])
+                    fresh['note'] = movie['note']
+                    if title_hash(fresh['title']) != \
+                            title_hash(movie['title']):
+                        new_keys['title'].append(
+                            (title_hash(fresh['title']), slot))
+                    movie = fresh
+                entry = append(movie)
+                current[slot] = movie
+            if slot >= slot_count:
+                new_slots[slot - slot_count] = entry
+            else:
+                patches[slot] = entry
+
+        if appended:
+            data = b''.join(appended)
+            with open(self.file_path, 'ab') as handler:
+                handler.write(data)
+                handler.flush()
+                os.fsync(handler.fileno())
+            profiler.count('bytes written', len(data))
+        for name, entries in new_keys.items():
+            if not entries:
+                continue
+            path = self.file_path + INDEX_SUFFIXES[name]
+            content = library.header() + insert_keys(
+                library.key_entries(name), entries)
+            temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'wb') as handler:
+                handler.write(content)
+            os.replace(temp_path, path)
+            profiler.count('bytes written', len(content))
+        with open(self._index_path, 'r+b') as handler:
+            for slot, entry in sorted(patches.items()):
+                handler.seek(HEADER.size + slot * SLOT.size)
+                handler.write(SLOT.pack(*entry))
+            handler.seek(0, os.SEEK_END)
+            handler.write(b''.join(SLOT.pack(*entry) for entry in new_slots))
+            handler.flush()
+            os.fsync(handler.fileno())
+
+        if patches:
+            library = self._library()
+            live = library.live_bytes()
+            if library.data_size() - live > COMPACT_RATIO * \
+                    library.data_size():
+                write_library(self.file_path, library.records())
+
+    def _commit(self, movies, ops, snapshot=False):
+        """
+        Publishes a change described by the record operations `ops`,
+        safely when other processes write the same library.
+
+        The operations are applied to the files under the lock, so they
+        always apply to the latest version. A snapshot, as written by
+        `compact`, writes `movies` as the whole library instead; if another
+        process changed it meanwhile, the library is loaded again and the
+        operations are applied to it first.
+        """
+        with self._lock.locked():
+            changed_elsewhere = self._lock.generation() != self._generation
+            if snapshot:
+                if changed_elsewhere:
+                    movies = self._read_movies()
+                    apply_ops(movies, ops)
+                with profiler.phase('write'):
+                    write_library(self.file_path, movies)
+            else:
+                with profiler.phase('write'):
+                    self._apply_to_files(ops)
+            if changed_elsewhere:
+                # The working set misses the other process's changes
+                self._stale = True
+            self._generation = self._lock.advance()
+
+    def compact(self):
+        """
+        Writes the library again without the dead records left behind by
+        deletions and updates.
+        """
+        self._save_movies(self.list_movies(), [], [])
+
+    def movie_at(self, position):
+        """
+        Returns the movie stored at a position, counted from 0 in the order
+        the movies were added, or None if there is none. Positions of
+        deleted movies stay empty until the library is compacted.
+        """
+        return self._library().record(position)
+
+    def find_by_imdb_id(self, imdb_id):
+        """
+        Returns the first movie with the given imdbID, or None.
+        """
+        library = self._library()
+        for slot in library.slots_for('imdbID', imdb_id):
+            movie = library.record(slot)
+            if movie['imdbID'] == imdb_id:
+                return movie
+        return None
+
+    def find_by_title(self, title):
+        """
+        Returns the movies with exactly the given title, in the order they
+        were added.
+        """
+        library = self._library()
+        movies = (library.record(slot)
+                  for slot in library.slots_for('title', title))
+        return [movie for movie in movies if movie['title'] == title]
+
+    def _uses_working_set(self):
+        """
+        Whether changes have to go through the movies in memory: inside a
+        batch, whose changes aren't written yet, or when the library is
+        loaded anyway.
+        """
+        return self._batching or self._cache.loaded
+
+    def _change_exact(self, title, op_builder):
+        """
+        Applies a change to the first movie with exactly the given title
+        straight to the files, like `_find_targets` does for the working
+        set. Returns the changed movie, or None if there is no such movie.
+        """
+        matches = self.find_by_title(title)
+        if not matches:
+            return None
+        self._commit(None, [op_builder(matches[0])])
+        self._stale = False
+        return matches[0]
+
+    def delete_movie(self, title):
+        """
+        Deletes a movie from the movies' database.
+
+        A movie with exactly the given title is found through the title
+        index and deleted without loading the library. Other titles are
+        matched against every movie like in StorageJson.
+
+        Args:
+            title (str): The title of the movie to delete.
+
+        Returns:
+            bool: Whether a movie was deleted.
+        """
+        if self._uses_working_set():
+            return super().delete_movie(title)
+        try:
+            movie = self._change_exact(title, delete_op)
+        except OSError as err:
+            print("Error: There was an error reading or writing the "
+                  "library:", err)
+            return False
+        if movie is None:
+            return super().delete_movie(title)
+        print(f'\nThe movie "{movie["title"]}" has been removed from the '
+              f'movie list successfully.')
+        return True
+
+    def update_movie(self, title, note):
+        """
+        Updates the note of a movie in the movies' database.
+
+        The movie is found the same way as in `delete_movie`.
+
+        Args:
+            title (str): The title of the movie to update.
+            note (str): The new note for the movie.
+
+        Returns:
+            bool: Whether a movie was updated.
+        """
+        if self._uses_working_set():
+            return super().update_movie(title, note)
+
+        def note_op(movie):
+            movie['note'] = note
+            return update_op(movie)
+
+        try:
+            movie = self._change_exact(title, note_op)
+        except OSError as err:
+            print("Error: There was an error reading or writing the "
+                  "library:", err)
+            return False
+        if movie is None:
+            return super().update_movie(title, note)
+        print(f'\nMovie "{title}" successfully updated.')
+        return True
+
+    def random_movie(self) -> None:
+        """
+        Prints a randomly selected movie, reading only that movie from the
+        data file.
+        """
+        import random
+
+        if self._batching:
+            super().random_movie()
+            return
+        try:
+            library = self._library()
+            movie = None
+            for _ in range(RANDOM_TRIES):
+                if not len(library):
+                    break
+                movie = library.record(random.randrange(len(library)))
+                if movie is not None:
+                    break
+            if movie is None:
+                # Mostly empty slots; pick among the live ones
+                slots = library.live_slots()
+                if not slots:
+                    print("The movie list is empty.")
+                    return
+                movie = library.record(random.choice(slots))
+            print(f'Your random movie is "{movie["title"]}" with '
+                  f'rating {movie["rating"]}')
+        except OSError as err:
+            print("Error: There was an error reading the library:", err)
@@ -0,0 +1,610 @@
+from istorage import IStorage
+from api_client import get_client, movie_from_omdb, FetchError, \
+    HTTPFetchError, FetchConnectionError, FetchTimeout
+from title_index import TitleIndex
+import profiler
+import sqlite3
+from contextlib import contextmanager, nullcontext
+
+# Columns of the movies table, in the order of a movie record
+COLUMNS: tuple = ('title', 'rating', 'year', 'poster', 'imdbID', 'note',
+                  'country')
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS movies (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    rating REAL,
+    year INTEGER,
+    poster TEXT,
+    imdbID TEXT,
+    note TEXT NOT NULL DEFAULT '',
+    country TEXT
+);
+CREATE INDEX IF NOT EXISTS movies_title ON movies (title);
+CREATE INDEX IF NOT EXISTS movies_rating ON movies (rating);
+CREATE INDEX IF NOT EXISTS movies_year ON movies (year);
+CREATE INDEX IF NOT EXISTS movies_imdb_id ON movies (imdbID);
+"""
+SELECT_MOVIES: str = f"SELECT id, {', '.join(COLUMNS)} FROM movies"
+INSERT_MOVIE: str = (f"INSERT INTO movies ({', '.join(COLUMNS)}) "
+                     f"VALUES ({', '.join('?' * len(COLUMNS))})")
+
+
+def escape_like(text):
+    """
+    Escapes the wildcard characters of a LIKE pattern.
+    """
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class StorageSqlite(IStorage):
+    """
+    Stores the movies in an SQLite database.
+
+    Title, rating, year and imdbID are indexed columns, so adding, updating
+    or deleting one movie only touches that row and its index entries
+    instead of rewriting the whole file.
+    """
+
+    def __init__(self, file_path, client=None, interactive=True):
+        """
+        Args:
+            file_path (str): The path of the database file.
+            client (OmdbClient): The OMDB client, by default the shared one.
+            interactive (bool): Ask the user to pick a movie when a title
+            matches several. Otherwise the matches are only listed.
+        """
+        self.file_path = file_path
+        self.interactive = interactive
+        self._client = client or get_client()
+        self._connection = sqlite3.connect(file_path)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(SCHEMA)
+        self._title_index_cache = None
+        self._title_index_version = None
+        self._batching = False
+
+    def _transaction(self):
+        """
+        Returns the context in which a change is made: its own transaction,
+        or the transaction of the current batch.
+        """
+        return nullcontext() if self._batching else self._connection
+
+    @contextmanager
+    def batch(self):
+        """
+        Runs a group of changes in a single transaction that is committed
+        when the group ends, even if it ends with an error.
+        """
+        if self._batching:
+            yield self
+            return
+        self._batching = True
+        try:
+            yield self
+        finally:
+            self._batching = False
+            self._connection.commit()
+
+    def _query(self, sql, parameters=()):
+        """
+        Runs a SELECT statement and returns the rows as movie dictionaries.
+        The row id is kept under the `id` key.
+        """
+        with profiler.phase('query'):
+            rows = self._connection.execute(sql, parameters).fetchall()
+        profiler.count('rows read', len(rows))
+        return [dict(row) for row in rows]
+
+    def _data_version(self):
+        """
+        Returns a value that changes whenever this or another connection
+        commits a change to the database.
+        """
+        data_version = self._connection.execute(
+            'PRAGMA data_version').fetchone()[0]
+        return data_version, self._connection.total_changes
+
+    def _title_index(self):
+        """
+        Returns the title index of the movies. It is built on first use and
+        rebuilt after the database has changed.
+        """
+        version = self._data_version()
+        if self._title_index_version != version:
+            self._title_index_cache = TitleIndex(self.list_movies())
+            self._title_index_version = version
+        return self._title_index_cache
+
+    def _find_targets(self, title):
+        """
+        Returns the movies that a deletion or update of `title` applies to:
+        the first movie with exactly that title if there is one, otherwise
+        all the movies whose title contains it. Movies that share a complete
+        title are changed one at a time, in the order they were added.
+        """
+        exact_movies = self._query(f'{SELECT_MOVIES} WHERE title = ? '
+                                   f'ORDER BY id LIMIT 1', (title,))
+        if exact_movies:
+            return exact_movies
+        return self._query(f'{SELECT_MOVIES} WHERE instr(title, ?) > 0 '
+                           f'ORDER BY id', (title,))
+
+    def list_movies(self):
+        """
+        Returns a list of dictionaries that contains the movies information
+        in the database, in the order they were added.
+        """
+        return self._query(f'{SELECT_MOVIES} ORDER BY id')
+
+    def _insert_movies(self, movies):
+        with self._transaction():
+            self._connection.executemany(
+                INSERT_MOVIE,
+                [tuple(movie[column] for column in COLUMNS)
+                 for movie in movies])
+
+    def add_movie(self, title):
+        """
+        Adds a movie to the movies' database.
+        Fetches the movie data through the shared OMDB client and inserts
+        a single row. The function doesn't need to validate the input.
+        """
+        try:
+            movie_dict_data = self._client.fetch_movie(title)
+            self._insert_movies([movie_from_omdb(movie_dict_data)])
+        except KeyError:
+            print("The movie not found")
+        except HTTPFetchError as errh:
+            print("HTTP Error:", errh)
+        except FetchConnectionError as errc:
+            print("Error Connecting:", errc)
+        except FetchTimeout as errt:
+            print("Timeout Error:", errt)
+        except FetchError as err:
+            print("Error:", err)
+        except sqlite3.Error as err:
+            print("Database Error:", err)
+
+    def add_movies(self, titles):
+        """
+        Adds many movies to the movies' database at once.
+
+        The titles are looked up in parallel through the shared OMDB client
+        and all the movies that were found are inserted in one transaction.
+        Titles that couldn't be added are reported one by one.
+
+        Args:
+            titles (list): The titles of the movies to add.
+
+        Returns:
+            dict: Maps every title that couldn't be added to the reason.
+        """
+        failures = {}
+        new_movies = []
+        results = self._client.fetch_movies(titles)
+        for title in dict.fromkeys(titles):
+            result = results[title]
+            if isinstance(result, FetchError):
+                failures[title] = f"Error: {result}"
+                continue
+            try:
+                new_movies.append(movie_from_omdb(result))
+            except KeyError:
+                failures[title] = "The movie not found"
+            except ValueError:
+                failures[title] = "The movie data is incomplete"
+
+        if new_movies:
+            self._insert_movies(new_movies)
+
+        for title, reason in failures.items():
+            print(f'"{title}": {reason}')
+        print(f'{len(new_movies)} of {len(titles)} movies added.')
+        return failures
+
+    def _pick_target(self, title, targets):
+        """
+        Asks the user for the complete title when several movies match and
+        returns the chosen movie, or None. When the storage isn't
+        interactive, the matches are only listed.
+        """
+        print(f'{len(targets)} movies with "{title}" found: ')
+        for movie in targets:
+            print(movie['title'])
+        if not self.interactive:
+            return None
+        new_title = input('Please enter the complete movie name: ')
+        for movie in targets:
+            if movie['title'] == new_title:
+                return movie
+        return None
+
+    def delete_movie(self, title):
+        """
+        Deletes a movie from the movies' database.
+
+        A movie with exactly the given title is deleted directly. Otherwise
+        the movies whose title contains it are looked up, and if there are
+        several the user is prompted to enter the complete movie name.
+
+        Args:
+            title (str): The title of the movie to delete.
+
+        Returns:
+            bool: Whether a movie was deleted.
+        """
+        try:
+            targets = self._find_targets(title)
+            if not targets:
+                print("The movie was not found.")
+                return False
+            movie = targets[0] if len(targets) == 1 else \
+                self._pick_target(title, targets)
+            if movie is None:
+                if self.interactive:
+                    print(f'\nError: The movie "{title}" does not exist '
+                          f'in the movie list.')
+                else:
+                    print('Give the complete title of one of these movies.')
+                return False
+            with self._transaction():
+                self._connection.execute('DELETE FROM movies WHERE id = ?',
+                                         (movie['id'],))
+            print(f'\nThe movie "{movie["title"]}" has been removed from '
+                  f'the movie list successfully.')
+            return True
+        except sqlite3.Error as err:
+            print("Database Error:", err)
+        return False
+
+    def update_movie(self, title, note):
+        """
+        Updates the note of a movie in the movies' database.
+
+        The movie is looked up the same way as in `delete_movie`.
+
+        Args:
+            title (str): The title of the movie to update.
+            note (str): The new note for the movie.
+
+        Returns:
+            bool: Whether a movie was updated.
+        """
+        try:
+            targets = self._find_targets(title)
+            if not targets:
+                print("The movie was not found.")
+                return False
+            movie = targets[0] if len(targets) == 1 else \
+                self._pick_target(title, targets)
+            if movie is None:
+                if self.interactive:
+                    print(f'\nError: The movie "{title}" does not exist '
+                          f'in the movie list.')
+                else:
+                    print('Give the complete title of one of these movies.')
+                return False
+            with self._transaction():
+                self._connection.execute(
+                    'UPDATE movies SET note = ? WHERE id = ?',
+                    (note, movie['id']))
+            print(f'\nMovie "{movie["title"]}" successfully updated.')
+            return True
+        except sqlite3.Error as err:
+            print("Database Error:", err)
+        return False
+
+    def refresh_movies(self, fresh_movies):
+        """
+        Replaces the data of movies with newer data fetched from OMDB.
+
+        Every fresh movie replaces the first row with the same imdbID,
+        keeping its note. Rows whose data didn't change are left alone,
+        and all the changes are made in one transaction.
+
+        Args:
+            fresh_movies (list): The movie records built from the new data.
+
+        Returns:
+            int: The number of movies that changed.
+        """
+        columns = [column for column in COLUMNS if column != 'note']
+        changed = 0
+        with self._transaction():
+            for fresh in fresh_movies:
+                rows = self._query(f'{SELECT_MOVIES} WHERE imdbID = ? '
+                                   f'ORDER BY id LIMIT 1', (fresh['imdbID'],))
+                if not rows:
+                    continue
+                values = [fresh[column] for column in columns]
+                if values == [rows[0][column] for column in columns]:
+                    continue
+                self._connection.execute(
+                    f"UPDATE movies SET "
+                    f"{', '.join(f'{column} = ?' for column in columns)} "
+                    f"WHERE id = ?", values + [rows[0]['id']])
+                changed += 1
+        return changed
+
+    def filter_movies(self, min_rating=None, max_rating=None, year_from=None,
+                      year_to=None, country=None):
+        """
+        Returns the movies that match every given condition, in the order
+        they were added. Conditions left as None are ignored. The rating
+        and year conditions use their indexes.
+        """
+        conditions = []
+        parameters = []
+        for sql, value in (('rating >= ?', min_rating),
+                           ('rating <= ?', max_rating),
+                           ("typeof(year) = 'integer' AND year >= ?",
+                            year_from),
+                           ("typeof(year) = 'integer' AND year <= ?",
+                            year_to),
+                           ('country = ?', country)):
+            if value is not None:
+                conditions.append(sql)
+                parameters.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        return self._query(f'{SELECT_MOVIES}{where} ORDER BY id', parameters)
+
+    def rating_histogram(self, bins=10):
+        """
+        Returns the number of movies per rating bucket between 0 and 10 as
+        (lower bound, upper bound, count) tuples. The counting is done by
+        the database.
+        """
+        width = 10 / bins
+        counts = [0] * bins
+        rows = self._connection.execute(
+            'SELECT MIN(CAST(rating / ? AS INTEGER), ?), COUNT(*) '
+            'FROM movies WHERE rating BETWEEN 0 AND 10 GROUP BY 1',
+            (width, bins - 1)).fetchall()
+        for bucket, count in rows:
+            counts[bucket] = count
+        return [(i * width, (i + 1) * width, counts[i]) for i in range(bins)]
+
+    def stats_summary(self):
+        """
+        Returns the rating statistics of the movies as a dictionary with
+        the count, average, median, highest and lowest rating and the best
+        and worst movies.
+
+        Everything is computed by the database. The median is read from the
+        rating index instead of sorting the movies. Movies without a rating
+        are left out.
+        """
+        count, average_rating, highest_rate, lowest_rate = \
+            self._connection.execute(
+                'SELECT COUNT(*), AVG(rating), MAX(rating), MIN(rating) '
+                'FROM movies WHERE rating IS NOT NULL').fetchone()
+        if count == 0:
+            return {'count': 0}
+        middle = self._connection.execute(
+            'SELECT rating FROM movies WHERE rating IS NOT NULL '
+            'ORDER BY rating LIMIT ? OFFSET ?',
+            (2 - count % 2, (count - 1) // 2)).fetchall()
+        best_movie = [row['title'] for row in self._query(
+            f'{SELECT_MOVIES} WHERE rating = ? ORDER BY id',
+            (highest_rate,))]
+        worst_movie = [] if lowest_rate == highest_rate else [
+            row['title'] for row in self._query(
+                f'{SELECT_MOVIES} WHERE rating = ? ORDER BY id',
+                (lowest_rate,))]
+        return {'count': count,
+                'average': average_rating,
+                'median': sum(row[0] for row in middle) / len(middle),
+                'highest': highest_rate,
+                'lowest': lowest_rate,
+                'best': best_movie,
+                'worst': worst_movie}
+
+    def stats(self):
+        """
+        Prints statistical data for the movies in the movie list: the
+        average and median rating and the best and worst movies.
+
+        Returns:
+            None
+        """
+        try:
+            summary = self.stats_summary()
+            if summary['count'] == 0:
+                print("The movie list is empty.")
+                return
+            best_movie = summary['best']
+            worst_movie = summary['worst']
+
+            print(f'The average movie rating is {summary["average"]}.')
+            print(f'The median movie rating is {summary["median"]}.')
+
+            if len(best_movie) == 1:
+                print(f'The best movie is: {best_movie[0]}.')
+            else:
+                print(f'The best movies are: {", ".join(best_movie)}')
+
+            if len(worst_movie) == 1:
+                print(f'The worst movie is: {worst_movie[0]}.')
+            else:
+                print(f'The worst movies are: {", ".join(worst_movie)}')
+        except sqlite3.Error as err:
+            print("Database Error:", err)
+
+    def random_movie(self) -> None:
+        """
+        Prints a randomly selected movie from the movie list.
+
+        A random position is drawn and the movie at it is read in row id
+        order, so every movie is equally likely even when the ids have gaps
+        left by deleted movies.
+
+        Returns:
+            None
+        """
+        import random
+
+        try:
+            count = self._connection.execute(
+                'SELECT COUNT(*) FROM movies').fetchone()[0]
+            if count == 0:
+                print("The movie list is empty.")
+                return
+            movie = self._query(
+                f'{SELECT_MOVIES} ORDER BY id LIMIT 1 OFFSET ?',
+                (random.randrange(count),))[0]
+            print(f'Your random movie is "{movie["title"]}" with '
+                  f'rating {movie["rating"]}')
+        except sqlite3.Error as err:
+            print("Database Error:", err)
+
+    def find_movies(self, title):
+        """
+        Returns the movies whose title contains the keyword, ignoring case,
+        in library order.
+
+        Args:
+            title (str): The keyword to search for in movie titles.
+
+        Returns:
+            list: The matching movies.
+        """
+        return self._query(f"{SELECT_MOVIES} WHERE title LIKE ? ESCAPE '\\' "
+                           f"ORDER BY id", (f'%{escape_like(title)}%',))
+
+    def fuzzy_search(self, title, limit=10):
+        """
+        Returns the movies whose titles are most similar to the given one,
+        best match first. Misspelled titles still find their movie.
+
+        Args:
+            title (str): The title to look for.
+            limit (int): The maximum number of results.
+
+        Returns:
+            list: (movie, score) tuples, where the score goes from 0 to 1.
+        """
+        return self._title_index().fuzzy(title, limit)
+
+    def search_movie(self, title):
+        """
+        Prints all movies that match the given keyword. If there are none,
+        prints the movies with the most similar titles instead.
+
+        Args:
+            title (str): The keyword to search for in movie titles.
+
+        Returns:
+            None
+        """
+        try:
+            movies = self.find_movies(title)
+            for movie in movies:
+                print(f'{movie["title"]}, {movie["rating"]}')
+            if not movies:
+                suggestions = self.fuzzy_search(title)
+                if suggestions:
+                    print(f'No movie contains "{title}". Did you mean:')
+                for movie, score in suggestions:
+                    print(f'{movie["title"]}, {movie["rating"]} '
+                          f'({score:.0%} match)')
+        except sqlite3.Error as err:
+            print("Database Error:", err)
+
+    def sorted_movies(self, limit=None, page=1):
+        """
+        Returns the movies sorted by rating in descending order, movies
+        with the same rating in the order they were added. Pages are read
+        straight from the rating index with LIMIT and OFFSET.
+
+        Args:
+            limit (int): The number of movies per page, or None for all.
+            page (int): The page to return, starting at 1.
+
+        Returns:
+            list: The movies of the page.
+        """
+        if limit is None:
+            return self._query(f'{SELECT_MOVIES} ORDER BY rating DESC, id')
+        return self._query(
+            f'{SELECT_MOVIES} ORDER BY rating DESC, id LIMIT ? OFFSET ?',
+            (limit, (page - 1) * limit))
+
+    def movies_sorted_by_rating(self, limit=None, page=1):
+        """
+        Prints the movies sorted by rating in descending order. With a
+        limit, only one page of that many movies is printed.
+
+        Args:
+            limit (int): The number of movies per page, or None for all.
+            page (int): The page to print, starting at 1.
+
+        Returns:
+            int: The number of pages.
+        """
+        try:
+            sorted_movies = self.sorted_movies(limit, page)
+            total = self._connection.execute(
+                'SELECT COUNT(*) FROM movies').fetchone()[0]
+            pages = 1 if limit is None else max(1, -(-total // limit))
+            print(f'{total} movies in total\n')
+            if limit is not None:
+                print(f'Page {page} of {pages}\n')
+            for movie in sorted_movies:
+                print(f'{movie["title"]}, {movie["rating"]}')
+            return pages
+        except sqlite3.Error as err:
+            print("Database Error:", err)
+
+    def movie_thumbnail(self):
+        """
+        Generates HTML code for the movie thumbnails.
+
+        Returns:
+            movie_thumbnail_html (str): HTML code for the movie thumbnails.
+        """
+        from website import iter_tiles
+
+        return ''.join(iter_tiles(self.list_movies()))
+
+    def generate_website(self, incremental=True, assets=None,
+                         page_size=None):
+        """
+        Generates the `build.html` webpage with a grid of movie thumbnails.
+
+        Args:
+            incremental (bool): Only render the thumbnails of movies that
+            changed since the last build and reuse the others.
+            assets (AssetCache): Show local copies of the images.
+            page_size (int): Write a site of pages with this many movies
+            each instead of a single page.
+
+        Returns:
+            None
+        """
+        from website import build_website
+
+        try:
+            if page_size is None:
+                build_website(self.list_movies(), incremental,
+                              assets=assets)
+            else:
+                from site_pages import build_site
+
+                build_site(self.list_movies(), page_size, incremental,
+                           assets=assets)
+            print('Website was generated successfully.')
+
+        except FileNotFoundError:
+            print("Error: The template file 'index_template.html' was not "
+                  "found.")
+
+        except PermissionError:
+            print("Error: Permission denied while accessing the files.")
+
+        except FetchError:
+            print("Error: Failed to connect to the API or retrieve data.")
+
+        except sqlite3.Error as err:
+            print("Database Error:", err)
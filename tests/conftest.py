@@ -0,0 +1,56 @@
+import os
+import sys
+import zlib
+
+import pytest
+
+# The modules of the application live in the directory above
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from movie import FIELDS  # noqa: E402
+
+COUNTRIES: tuple = ('United States', 'UK', 'France', 'Japan')
+
+
+def omdb_response(title):
+    """
+    Returns a made-up OMDB answer for a title. The same title always gets
+    the same answer; titles starting with "Missing" aren't found.
+    """
+    if title.startswith('Missing'):
+        return {'Response': 'False', 'Error': 'Movie not found!'}
+    number = zlib.crc32(title.casefold().encode('utf-8'))
+    return {'Title': title,
+            'Year': str(1950 + number % 70),
+            'imdbRating': str(1 + number % 90 / 10),
+            'Poster': f'https://example.com/{number}.jpg',
+            'imdbID': f'tt{number % 10 ** 7:07d}',
+            'Country': COUNTRIES[number % len(COUNTRIES)],
+            'Response': 'True'}
+
+
+class StubClient:
+    """
+    Stands in for OmdbClient, answering from `omdb_response` without the
+    network.
+    """
+
+    def fetch_movie(self, title=None, imdb_id=None, refresh=False,
+                    save=True):
+        return omdb_response(title)
+
+    def fetch_movies(self, titles, max_workers=None, rate_limit=None):
+        return {title: omdb_response(title) for title in titles}
+
+
+def records(movies):
+    """
+    Returns the movies as plain dictionaries of their fields, so records of
+    every storage can be compared.
+    """
+    return [{field: movie[field] for field in FIELDS} for movie in movies]
+
+
+@pytest.fixture
+def client():
+    return StubClient()
@@ -0,0 +1,93 @@
+import pytest
+
+from conftest import records
+from storage_csv import StorageCsv
+from storage_json import StorageJson
+from storage_jsonl import StorageJsonl
+from storage_mmap import StorageMmap
+
+# Every storage whose writers merge the changes of other writers, with the
+# extension of its files
+STORAGES: dict = {
+    'json': (lambda path, client: StorageJson(path, client,
+                                              interactive=False), '.json'),
+    'journal': (lambda path, client: StorageJson(
+        path, client, journal=True, interactive=False), '.json'),
+    'csv': (lambda path, client: StorageCsv(path, client,
+                                            interactive=False), '.csv'),
+    'jsonl': (lambda path, client: StorageJsonl(path, client,
+                                                interactive=False), '.jsonl'),
+    'mlib': (lambda path, client: StorageMmap(path, client,
+                                              interactive=False), '.mlib'),
+}
+
+
+@pytest.fixture(params=list(STORAGES))
+def open_library(request, tmp_path, client):
+    """
+    Returns a function that opens the same library every time, which
+    starts with three movies.
+    """
+    factory, extension = STORAGES[request.param]
+    path = str(tmp_path / f'library{extension}')
+
+    def open_library():
+        return factory(path, client)
+
+    open_library().add_movies(['Alien', 'Heat', 'Up'])
+    return open_library
+
+
+def titles(storage):
+    return [movie['title'] for movie in storage.list_movies()]
+
+
+def test_stale_writer_keeps_the_other_writers_add(open_library):
+    first, second = open_library(), open_library()
+    first.list_movies()
+    second.list_movies()
+
+    second.add_movie('Jaws')
+    first.add_movie('Se7en')
+
+    assert titles(open_library()) == ['Alien', 'Heat', 'Up', 'Jaws', 'Se7en']
+    # The stale writer sees the merged library on its next read
+    assert titles(first) == ['Alien', 'Heat', 'Up', 'Jaws', 'Se7en']
+
+
+def test_stale_writer_keeps_the_other_writers_update(open_library):
+    first, second = open_library(), open_library()
+    first.list_movies()
+    second.list_movies()
+
+    second.update_movie('Heat', 'Best heist')
+    first.update_movie('Up', 'Balloons')
+
+    notes = {movie['title']: movie['note']
+             for movie in open_library().list_movies()}
+    assert notes == {'Alien': '', 'Heat': 'Best heist', 'Up': 'Balloons'}
+
+
+def test_stale_writer_keeps_the_other_writers_delete(open_library):
+    first, second = open_library(), open_library()
+    first.list_movies()
+    second.list_movies()
+
+    second.delete_movie('Alien')
+    first.delete_movie('Up')
+    first.update_movie('Heat', 'Still here')
+
+    library = records(open_library().list_movies())
+    assert [movie['title'] for movie in library] == ['Heat']
+    assert library[0]['note'] == 'Still here'
+
+
+def test_change_of_a_movie_deleted_elsewhere_is_dropped(open_library):
+    first, second = open_library(), open_library()
+    first.list_movies()
+    second.list_movies()
+
+    second.delete_movie('Heat')
+    first.update_movie('Heat', 'Too late')
+
+    assert titles(open_library()) == ['Alien', 'Up']
@@ -0,0 +1,114 @@
+import json
+import os
+
+from conftest import records
+from movie_journal import delete_op
+from storage_json import StorageJson
+
+
+def open_journaled(path, client, compact_threshold=1000):
+    return StorageJson(path, client, journal=True,
+                       compact_threshold=compact_threshold,
+                       interactive=False)
+
+
+def read_json(path):
+    with open(path, 'r') as handler:
+        return json.load(handler)
+
+
+def test_changes_are_appended_to_the_journal(tmp_path, client):
+    path = str(tmp_path / 'library.json')
+    storage = open_journaled(path, client)
+    storage.add_movies(['Alien', 'Heat'])
+    storage.update_movie('Heat', 'Best heist')
+    storage.delete_movie('Alien')
+
+    with open(path + '.journal', 'r') as handler:
+        ops = [json.loads(line)['op'] for line in handler]
+    assert ops == ['base', 'add', 'add', 'update', 'delete']
+    reopened = open_journaled(path, client)
+    assert records(reopened.list_movies()) == records(storage.list_movies())
+    assert [movie['note'] for movie in reopened.list_movies()] == \
+        ['Best heist']
+
+
+def test_torn_line_is_dropped_and_truncated(tmp_path, client):
+    path = str(tmp_path / 'library.json')
+    storage = open_journaled(path, client)
+    storage.add_movies(['Alien', 'Heat'])
+    storage.update_movie('Alien', 'Chestburster')
+    journal_path = path + '.journal'
+    good_size = os.path.getsize(journal_path)
+    # A crash in the middle of writing the next operation
+    with open(journal_path, 'a') as handler:
+        handler.write(json.dumps(delete_op(storage.list_movies()[1]))[:20])
+
+    reopened = open_journaled(path, client)
+    assert [(movie['title'], movie['note'])
+            for movie in reopened.list_movies()] == \
+        [('Alien', 'Chestburster'), ('Heat', '')]
+    assert os.path.getsize(journal_path) == good_size
+
+    # The journal goes on after the cut
+    reopened.delete_movie('Heat')
+    assert [movie['title']
+            for movie in open_journaled(path, client).list_movies()] == \
+        ['Alien']
+
+
+def test_line_without_newline_is_dropped(tmp_path, client):
+    path = str(tmp_path / 'library.json')
+    storage = open_journaled(path, client)
+    storage.add_movies(['Alien', 'Heat'])
+    journal_path = path + '.journal'
+    good_size = os.path.getsize(journal_path)
+    # A complete operation whose newline never reached the disk
+    with open(journal_path, 'a') as handler:
+        handler.write(json.dumps(delete_op(storage.list_movies()[1])))
+
+    assert len(open_journaled(path, client).list_movies()) == 2
+    assert os.path.getsize(journal_path) == good_size
+
+
+def test_journal_is_compacted_at_the_threshold(tmp_path, client):
+    path = str(tmp_path / 'library.json')
+    storage = open_journaled(path, client, compact_threshold=3)
+    storage.add_movies(['Alien', 'Heat'])
+    assert os.path.exists(path + '.journal')
+
+    storage.update_movie('Heat', 'Best heist')
+
+    assert not os.path.exists(path + '.journal')
+    assert read_json(path) == records(storage.list_movies())
+    assert read_json(path)[1]['note'] == 'Best heist'
+
+
+def test_compact_writes_the_journal_into_the_file(tmp_path, client):
+    path = str(tmp_path / 'library.json')
+    storage = open_journaled(path, client)
+    storage.add_movies(['Alien', 'Heat', 'Up'])
+    storage.delete_movie('Heat')
+
+    storage.compact()
+
+    assert not os.path.exists(path + '.journal')
+    assert [movie['title'] for movie in read_json(path)] == ['Alien', 'Up']
+    assert records(open_journaled(path, client).list_movies()) == \
+        read_json(path)
+
+
+def test_journal_of_an_older_snapshot_is_ignored(tmp_path, client):
+    path = str(tmp_path / 'library.json')
+    storage = open_journaled(path, client)
+    storage.add_movies(['Alien', 'Heat'])
+    storage.compact()
+    with open(path + '.journal', 'w') as handler:
+        # Left behind by a compaction interrupted after the rename
+        handler.write(json.dumps({'op': 'base', 'base': 'older'}) + '\n')
+        handler.write(json.dumps(delete_op(storage.list_movies()[0]))
+                      + '\n')
+
+    assert [movie['title']
+            for movie in open_journaled(path, client).list_movies()] == \
+        ['Alien', 'Heat']
@@ -0,0 +1,42 @@
+import random
+from fractions import Fraction
+
+from movie import Movie
+from movie_stats import RatingStats
+
+
+def test_remove_takes_out_the_given_record():
+    alien = Movie('Alien', 8.5, 1979)
+    remake = Movie('Alien', 6.0, 2030)
+    up = Movie('Up', 8.5, 2009)
+    stats = RatingStats([alien, remake, up])
+
+    # An equal copy isn't part of the statistics
+    stats.remove(Movie('Alien', 8.5, 1979))
+    assert stats.summary()['count'] == 3
+
+    stats.remove(remake)
+    summary = stats.summary()
+    assert summary['count'] == 2
+    assert summary['best'] == ['Alien', 'Up']
+    assert summary['worst'] == []
+
+    stats.remove(alien)
+    assert stats.summary()['best'] == ['Up']
+
+
+def test_average_stays_exact_after_many_changes():
+    generator = random.Random(0)
+    movies = [Movie(f'Movie {number}', round(generator.uniform(1, 10), 1),
+                    2000)
+              for number in range(3000)]
+    stats = RatingStats(movies[:100])
+    for movie in movies[100:]:
+        stats.add(movie)
+    for movie in movies[:2500]:
+        stats.remove(movie)
+
+    summary = stats.summary()
+    assert summary == RatingStats(movies[2500:]).summary()
+    exact_total = sum(Fraction(movie['rating']) for movie in movies[2500:])
+    assert summary['average'] == float(exact_total / 500)
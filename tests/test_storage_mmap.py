@@ -0,0 +1,107 @@
+import pytest
+
+from conftest import records
+from movie import Movie
+from storage_mmap import StorageMmap, convert_library
+
+
+def make_movies(count):
+    return [Movie(f'Movie {number}', 1 + number % 90 / 10,
+                  1950 + number % 70, f'https://example.com/{number}.jpg',
+                  f'tt{number:07d}', '', 'UK')
+            for number in range(count)]
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'library.mlib')
+    convert_library(make_movies(100), path)
+    return path
+
+
+def open_mmap(path, client):
+    return StorageMmap(path, client, interactive=False)
+
+
+def dead_bytes(library, path):
+    """
+    Returns the size of the records of a library that were deleted or
+    replaced. The data file starts with a header line.
+    """
+    with open(path, 'rb') as handler:
+        header_size = len(handler.readline())
+    return library.data_size() - header_size - library.live_bytes()
+
+
+def test_lookups_read_single_records(path, client):
+    storage = open_mmap(path, client)
+
+    assert storage.movie_at(7)['title'] == 'Movie 7'
+    assert storage.movie_at(100) is None
+    assert storage.find_by_imdb_id('tt0000042')['title'] == 'Movie 42'
+    assert storage.find_by_imdb_id('tt9999999') is None
+    assert [movie['imdbID'] for movie in storage.find_by_title('Movie 5')] \
+        == ['tt0000005']
+    assert storage.find_by_title('movie 5') == []
+    # None of the lookups loaded the library
+    assert not storage._cache.loaded
+
+
+def test_delete_and_update_round_trip(path, client):
+    storage = open_mmap(path, client)
+    storage.delete_movie('Movie 3')
+    storage.update_movie('Movie 4', 'Seen twice')
+    assert not storage._cache.loaded
+
+    reopened = open_mmap(path, client)
+    assert reopened.find_by_title('Movie 3') == []
+    assert reopened.movie_at(3) is None
+    assert reopened.find_by_title('Movie 4')[0]['note'] == 'Seen twice'
+    assert reopened.movie_at(4)['note'] == 'Seen twice'
+    movies = reopened.list_movies()
+    assert len(movies) == 99
+    assert 'Movie 3' not in [movie['title'] for movie in movies]
+
+
+def test_add_and_refresh_round_trip(path, client):
+    storage = open_mmap(path, client)
+    storage.add_movie('Alien')
+    storage.refresh_movies([Movie('Movie 9 Remastered', 9.9, 1959,
+                                  imdbID='tt0000009', country='UK')])
+
+    reopened = open_mmap(path, client)
+    assert reopened.find_by_title('Alien')[0]['title'] == 'Alien'
+    assert reopened.find_by_title('Movie 9') == []
+    assert reopened.find_by_imdb_id('tt0000009')['rating'] == 9.9
+    assert reopened.list_movies()[-1]['title'] == 'Alien'
+
+
+def test_compact_drops_dead_records(path, client):
+    storage = open_mmap(path, client)
+    for number in range(10):
+        storage.update_movie(f'Movie {number}', f'Note {number}')
+    before = records(storage.list_movies())
+    assert dead_bytes(storage._library(), path) > 0
+
+    storage.compact()
+
+    reopened = open_mmap(path, client)
+    library = reopened._library()
+    assert dead_bytes(library, path) == 0
+    assert len(library) == 100
+    assert records(reopened.list_movies()) == before
+    assert reopened.find_by_title('Movie 2')[0]['note'] == 'Note 2'
+
+
+def test_many_deletions_compact_the_library(path, client):
+    storage = open_mmap(path, client)
+    for number in range(60):
+        storage.delete_movie(f'Movie {number}')
+
+    library = open_mmap(path, client)._library()
+    # Compacted once the dead records made up half of the data file
+    assert len(library) < 100
+    assert dead_bytes(library, path) <= library.data_size() / 2
+    assert [movie['title'] for movie in
+            open_mmap(path, client).list_movies()] == \
+        [f'Movie {number}' for number in range(60, 100)]
@@ -0,0 +1,115 @@
+import pytest
+
+from conftest import omdb_response, records
+from api_client import movie_from_omdb
+from storage_csv import StorageCsv
+from storage_json import StorageJson
+from storage_jsonl import StorageJsonl
+from storage_sqlite import StorageSqlite
+
+TITLES: list = ['Alien', 'Aliens', 'Heat', 'Up', 'Pulp Fiction', 'Se7en',
+                'Missing Movie', 'The Thing', 'Thing']
+# The storages compared with StorageJson, with the extension of their files
+STORAGES: dict = {
+    'jsonl': (StorageJsonl, '.jsonl'),
+    'sqlite': (StorageSqlite, '.db'),
+    'csv': (StorageCsv, '.csv'),
+}
+
+
+def fill(storage):
+    """
+    Makes the same changes to a new library of any storage.
+    """
+    failures = storage.add_movies(TITLES)
+    storage.add_movie('Jaws')
+    storage.add_movie('Missing Too')
+    storage.update_movie('Heat', 'Best heist')
+    storage.delete_movie('Aliens')
+    fresh = movie_from_omdb(omdb_response('Alien'))
+    fresh['rating'] = 9.9
+    storage.refresh_movies([fresh])
+    return failures
+
+
+@pytest.fixture(params=list(STORAGES))
+def libraries(request, tmp_path, client):
+    """
+    Returns a JSON library and a library of another storage with the same
+    changes made to both.
+    """
+    storage_class, extension = STORAGES[request.param]
+    expected = StorageJson(str(tmp_path / 'library.json'), client,
+                           interactive=False)
+    actual = storage_class(str(tmp_path / f'library{extension}'), client,
+                           interactive=False)
+    assert fill(expected) == fill(actual)
+    return expected, actual
+
+
+def test_same_movies(libraries):
+    expected, actual = libraries
+    assert records(actual.list_movies()) == records(expected.list_movies())
+    assert [movie['title'] for movie in expected.list_movies()] == \
+        ['Alien', 'Heat', 'Up', 'Pulp Fiction', 'Se7en', 'The Thing',
+         'Thing', 'Jaws']
+
+
+@pytest.mark.parametrize('text', ['al', 'THING', 'e', 'zz'])
+def test_same_search_results(libraries, text):
+    expected, actual = libraries
+    assert records(actual.find_movies(text)) == \
+        records(expected.find_movies(text))
+
+
+@pytest.mark.parametrize('text', ['alein', 'pu', 'thnig', 'zzzz'])
+def test_same_fuzzy_results(libraries, text):
+    expected, actual = libraries
+    assert [(movie['title'], score)
+            for movie, score in actual.fuzzy_search(text)] == \
+        [(movie['title'], score)
+         for movie, score in expected.fuzzy_search(text)]
+
+
+def test_short_fuzzy_query_suggests_short_titles(libraries):
+    for storage in libraries:
+        assert [movie['title'] for movie, _ in storage.fuzzy_search('pu')] \
+            == ['Up']
+
+
+@pytest.mark.parametrize('limit, page', [(None, 1), (3, 1), (3, 3), (3, 4)])
+def test_same_order_by_rating(libraries, limit, page):
+    expected, actual = libraries
+    assert records(actual.sorted_movies(limit, page)) == \
+        records(expected.sorted_movies(limit, page))
+
+
+def test_same_statistics(libraries):
+    expected, actual = libraries
+    expected_summary = expected.stats_summary()
+    actual_summary = actual.stats_summary()
+    assert actual_summary.pop('average') == \
+        pytest.approx(expected_summary.pop('average'))
+    assert actual_summary == expected_summary
+    assert expected_summary['highest'] == 9.9
+    assert expected_summary['best'] == ['Alien']
+
+
+@pytest.mark.parametrize('conditions', [
+    {},
+    {'min_rating': 5},
+    {'max_rating': 5, 'year_from': 1980},
+    {'year_to': 1990},
+    {'country': 'UK'},
+    {'country': 'Nowhere'},
+])
+def test_same_filter_results(libraries, conditions):
+    expected, actual = libraries
+    assert records(actual.filter_movies(**conditions)) == \
+        records(expected.filter_movies(**conditions))
+
+
+@pytest.mark.parametrize('bins', [1, 5, 10])
+def test_same_histogram(libraries, bins):
+    expected, actual = libraries
+    assert actual.rating_histogram(bins) == expected.rating_histogram(bins)
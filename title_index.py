@@ -0,0 +1,201 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+
+# Number of candidates per requested result that are scored by fuzzy search
+CANDIDATES_PER_RESULT: int = 20
+# Queries shorter than this share too few trigrams with the titles they
+# resemble, so fuzzy search picks its candidates by length instead
+MIN_TRIGRAM_QUERY: int = 4
+
+
+def trigrams(text):
+    """
+    Returns the set of three-character substrings of the text.
+    """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def padded_trigrams(text):
+    """
+    Returns the trigrams of the text padded with spaces, so even short
+    titles have trigrams and the start and end of a title get their own.
+    """
+    return trigrams(f'  {text} ')
+
+
+class TitleIndex:
+    """
+    An index over movie titles for fast lookups.
+
+    Titles are case folded once when a movie is added. Exact titles are
+    found in a dictionary, and substring searches intersect the posting
+    sets of the query's trigrams, so only titles sharing every trigram of
+    the query are compared with it.
+
+    The index can be kept up to date with `add` and `remove` instead of
+    being rebuilt when the movie list changes.
+
+    Fuzzy searches use the same trigrams to pick the titles that share the
+    most trigrams with the query, and only those are scored. Short queries,
+    and queries that share no trigram with any title, are compared with
+    every title of a length that can reach the minimum score instead.
+    """
+
+    def __init__(self, movies=()):
+        """
+        Args:
+            movies (iterable): The movies to index, in library order.
+        """
+        self._next_id = 0
+        self._ids = {}  # id() of a movie record -> index id
+        self._movies = {}  # index id -> movie record
+        self._folded = {}  # index id -> case folded title
+        self._exact = defaultdict(list)  # case folded title -> index ids
+        self._trigrams = defaultdict(set)  # trigram -> index ids
+        self._lengths = defaultdict(set)  # title length -> index ids
+        for movie in movies:
+            self.add(movie)
+
+    def __len__(self):
+        return len(self._movies)
+
+    def add(self, movie):
+        """
+        Adds a movie to the index.
+        """
+        movie_id = self._next_id
+        self._next_id += 1
+        folded = movie['title'].casefold()
+        self._ids[id(movie)] = movie_id
+        self._movies[movie_id] = movie
+        self._folded[movie_id] = folded
+        self._exact[folded].append(movie_id)
+        for gram in padded_trigrams(folded):
+            self._trigrams[gram].add(movie_id)
+        self._lengths[len(folded)].add(movie_id)
+
+    def remove(self, movie):
+        """
+        Removes a movie from the index. Movies that aren't indexed are
+        ignored.
+        """
+        movie_id = self._ids.pop(id(movie), None)
+        if movie_id is None:
+            return
+        del self._movies[movie_id]
+        folded = self._folded.pop(movie_id)
+        same_title = self._exact[folded]
+        same_title.remove(movie_id)
+        if not same_title:
+            del self._exact[folded]
+        for gram in padded_trigrams(folded):
+            postings = self._trigrams[gram]
+            postings.discard(movie_id)
+            if not postings:
+                del self._trigrams[gram]
+        same_length = self._lengths[len(folded)]
+        same_length.discard(movie_id)
+        if not same_length:
+            del self._lengths[len(folded)]
+
+    def _to_movies(self, movie_ids):
+        return [self._movies[movie_id] for movie_id in sorted(movie_ids)]
+
+    def exact(self, title):
+        """
+        Returns the movies whose title equals the given one, ignoring case.
+        """
+        return self._to_movies(self._exact.get(title.casefold(), ()))
+
+    def search(self, text):
+        """
+        Returns the movies whose title contains the text, ignoring case,
+        in library order.
+        """
+        query = text.casefold()
+        grams = trigrams(query)
+        if grams:
+            postings = sorted((self._trigrams.get(gram, set())
+                               for gram in grams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+        else:
+            # Queries shorter than a trigram are matched against the
+            # trigrams that contain them instead of against every title.
+            candidates = set()
+            for gram, movie_ids in self._trigrams.items():
+                if query in gram:
+                    candidates |= movie_ids
+        return self._to_movies(movie_id for movie_id in candidates
+                               if query in self._folded[movie_id])
+
+    def prefix(self, text):
+        """
+        Returns the movies whose title starts with the text, ignoring case,
+        in library order.
+        """
+        query = text.casefold()
+        return [movie for movie in self.search(text)
+                if movie['title'].casefold().startswith(query)]
+
+    def _similar_lengths(self, length, min_score):
+        """
+        Returns the ids of the titles whose length allows a similarity
+        ratio of at least `min_score` with a query of the given length.
+        The ratio is at most 2 * shorter / (shorter + longer).
+        """
+        if min_score <= 0:
+            return list(self._movies)
+        shortest = math.ceil(length * min_score / (2 - min_score))
+        longest = math.floor(length * (2 - min_score) / min_score)
+        return [movie_id
+                for title_length, movie_ids in self._lengths.items()
+                if shortest <= title_length <= longest
+                for movie_id in movie_ids]
+
+    def fuzzy(self, text, limit=10, min_score=0.5):
+        """
+        Returns the movies whose titles are most similar to the text, best
+        match first, so misspelled queries still find their movie.
+
+        Titles sharing the most trigrams with the query are picked from the
+        index first, and only those candidates are scored with
+        difflib's similarity ratio. Short queries, and queries without a
+        trigram in common with any title, are scored against every title
+        whose length allows a ratio of `min_score`, so "pu" still finds
+        "Up".
+
+        Args:
+            text (str): The (possibly misspelled) title to look for.
+            limit (int): The maximum number of results.
+            min_score (float): The minimum similarity, from 0 to 1.
+
+        Returns:
+            list: (movie, score) tuples, sorted by descending score.
+        """
+        from difflib import SequenceMatcher
+
+        query = text.casefold()
+        shared = Counter()
+        if len(query) >= MIN_TRIGRAM_QUERY:
+            for gram in padded_trigrams(query):
+                shared.update(self._trigrams.get(gram, ()))
+        if shared:
+            candidates = [movie_id for movie_id, _ in heapq.nlargest(
+                limit * CANDIDATES_PER_RESULT, shared.items(),
+                key=lambda item: item[1])]
+        else:
+            candidates = self._similar_lengths(len(query), min_score)
+        matcher = SequenceMatcher(b=query, autojunk=False)
+        results = []
+        for movie_id in candidates:
+            matcher.set_seq1(self._folded[movie_id])
+            # The cheap upper bounds skip titles that can't reach min_score
+            if matcher.real_quick_ratio() < min_score or \
+                    matcher.quick_ratio() < min_score:
+                continue
+            score = matcher.ratio()
+            if score >= min_score:
+                results.append((score, -movie_id))
+        return [(self._movies[-neg_id], round(score, 3))
+                for score, neg_id in heapq.nlargest(limit, results)]
@@ -0,0 +1,236 @@
+import dbm
+import hashlib
+import json
+import os
+
+import profiler
+from api_client import CACHE_DIR
+from country_codes import country_name, get_resolver
+from movie import FIELDS
+from site_assets import is_remote
+
+# IMDB URL to redirect user to each movie IMDB page
+IMDB: str = 'https://www.imdb.com/title/'
+# The API to get the flag image from country code
+FLAG_API: str = "https://flagsapi.com/"
+TEMPLATE_PATH: str = "./_static/index_template.html"
+OUTPUT_PATH: str = "build.html"
+PLACEHOLDER: str = '__TEMPLATE_MOVIE_GRID__'
+# Change this whenever the tile markup changes, so cached tiles are dropped
+TILE_VERSION: int = 1
+
+
+def flag_url(country_code):
+    """
+    Returns the address of the flag image of a country.
+    """
+    return f'{FLAG_API}{country_code}/shiny/24.png'
+
+
+def render_tile(movie, country_code, assets=None):
+    """
+    Returns the HTML code of one movie tile: the movie poster linking to
+    its IMDb page, the flag of its country, its IMDb rating, title and year.
+
+    With an AssetCache, the images are shown from their local copies, the
+    poster as a thumbnail if there is one. Images without a local copy
+    are shown from their remote address.
+    """
+    imdb_url = IMDB + movie["imdbID"]
+    poster = movie["poster"]
+    flag_api_call = flag_url(country_code)
+    if assets is not None:
+        poster = assets.local_url(poster, thumbnail=True) or poster
+        flag_api_call = assets.local_url(flag_api_call) or flag_api_call
+    movie_tile_template = [
+        '<li>\n',
+        '<div class="movie">\n',
+        '<div class="parent">\n',
+        f'<a href="{imdb_url}" target="blank">'
+        f'<img class="movie-poster" '
+        f'src="{poster}" '
+        f'alt="{movie["title"]} poster image" '
+        f'title="{movie["note"]}"></a>\n',
+        f'<img class="flag" src="{flag_api_call}">\n',
+        '</div>\n',
+        f'<div class="score"> IMDB Rate: {movie["rating"]}</div>\n',
+        f'<div class="movie-title">{movie["title"]}</div>\n',
+        f'<div class="movie-year">{movie["year"]}</div>\n',
+        '</div>\n',
+        '</li>\n'
+    ]
+    return ''.join(movie_tile_template)
+
+
+def fingerprint(movie, variant=''):
+    """
+    Returns a hash of everything that goes into a movie's tile, so the tile
+    only has to be rendered again when the movie's data changes. The
+    variant tells apart tiles of the same movie rendered differently, such
+    as with local images.
+    """
+    record = json.dumps([TILE_VERSION, variant]
+                        + [movie[field] for field in FIELDS], default=str)
+    return hashlib.sha1(record.encode('utf-8')).hexdigest()
+
+
+class TileCache:
+    """
+    The rendered HTML of every movie tile from the last build, keyed by the
+    movie's fingerprint.
+
+    The tiles live in a dbm database on disk and are read one at a time, so
+    a build never holds all of them in memory.
+    """
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path (str): The path of the cache database, by default `tiles`
+            in CACHE_DIR.
+        """
+        self.path = path or os.path.join(CACHE_DIR, 'tiles')
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = dbm.open(self.path, 'c')
+        self._used = set()
+
+    def __contains__(self, key):
+        return key in self._db
+
+    def get(self, key):
+        """
+        Returns the cached tile for the fingerprint, or None.
+        """
+        tile = self._db.get(key)
+        if tile is None:
+            profiler.count('tile cache misses')
+            return None
+        profiler.count('tile cache hits')
+        self._used.add(key)
+        return tile.decode('utf-8')
+
+    def put(self, key, tile):
+        """
+        Stores a freshly rendered tile.
+        """
+        self._db[key] = tile.encode('utf-8')
+        self._used.add(key)
+
+    def close(self, prune=True):
+        """
+        Closes the database. Unless `prune` is False, the tiles that weren't
+        used by this build, which belonged to movies that were changed or
+        removed, are dropped first.
+        """
+        if prune:
+            for key in self._db.keys():
+                if key.decode('utf-8') not in self._used:
+                    del self._db[key]
+        self._db.close()
+
+
+def _is_local(movie, country_code, assets):
+    """
+    Returns whether every image of a movie tile has a local copy, or
+    doesn't need one.
+    """
+    return all(assets.local_url(url) is not None
+               for url in (movie["poster"], flag_url(country_code))
+               if is_remote(url))
+
+
+def iter_tiles(movies, tile_cache=None, assets=None):
+    """
+    Yields the HTML code of every movie tile, in library order.
+
+    With a tile cache only the movies whose data changed since the last
+    build are rendered, and only their countries are resolved. With an
+    AssetCache, the posters and flags of those movies are downloaded
+    first, in parallel, and the tiles show the local copies. Tiles with an
+    image that couldn't be downloaded aren't cached, so the next build
+    tries again.
+
+    The movies are read twice, so they can be any iterable that can be
+    read more than once.
+
+    Raises:
+        FetchError: If a country code couldn't be fetched.
+    """
+    variant = '' if assets is None else f'assets:{assets.thumbnail_width}'
+    stale_countries = set()
+    stale_posters = set()
+    for movie in movies:
+        if tile_cache is None or \
+                fingerprint(movie, variant) not in tile_cache:
+            stale_countries.add(country_name(movie["country"]))
+            if assets is not None:
+                stale_posters.add(movie["poster"])
+    country_codes = get_resolver().resolve(stale_countries)
+    if assets is not None:
+        flags = {flag_url(code) for code in country_codes.values()}
+        assets.fetch(stale_posters | flags, thumbnail_urls=stale_posters)
+
+    for movie in movies:
+        if tile_cache is None:
+            yield render_tile(movie,
+                              country_codes[country_name(movie["country"])],
+                              assets)
+            continue
+        key = fingerprint(movie, variant)
+        tile = tile_cache.get(key)
+        if tile is None:
+            country_code = country_codes[country_name(movie["country"])]
+            tile = render_tile(movie, country_code, assets)
+            if assets is None or _is_local(movie, country_code, assets):
+                tile_cache.put(key, tile)
+        yield tile
+
+
+def build_website(movies, incremental=True, template_path=TEMPLATE_PATH,
+                  output_path=OUTPUT_PATH, assets=None):
+    """
+    Writes the web page with the grid of movie tiles.
+
+    The page is streamed to a temporary file: the template up to the grid
+    placeholder, then the tiles one by one as they are produced, then the
+    rest of the template. The temporary file is then renamed over the
+    output, so readers never see a half-written page and memory use doesn't
+    grow with the number of movies.
+
+    Args:
+        movies (list): The movies to show.
+        incremental (bool): Reuse the tiles of unchanged movies from the
+        last build instead of rendering every tile.
+        template_path (str): The HTML template with the grid placeholder.
+        output_path (str): The page to write.
+        assets (AssetCache): Download the images and show the local
+        copies, or None to link to the remote images.
+
+    Raises:
+        FileNotFoundError: If the template file is not found.
+        FetchError: If a country code couldn't be fetched.
+    """
+    with open(template_path, "r") as handler:
+        template_str = handler.read()
+    prefix, _, suffix = template_str.partition(PLACEHOLDER)
+
+    tile_cache = TileCache() if incremental else None
+    temp_path = f'{output_path}.{os.getpid()}.tmp'
+    try:
+        with profiler.phase('render'), open(temp_path, "w") as file_output:
+            file_output.write(prefix)
+            for tile in iter_tiles(movies, tile_cache, assets):
+                file_output.write(tile)
+            file_output.write(suffix)
+            profiler.count('bytes written', file_output.tell())
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        if tile_cache is not None:
+            tile_cache.close(prune=False)
+        raise
+    if tile_cache is not None:
+        tile_cache.close()